@@ -1,8 +1,16 @@
 from django.contrib import admin
-from .models import WeeklyPerformance
+from .models import DailyPerformance, WeeklyPerformance
 
 @admin.register(WeeklyPerformance)
 class WeeklyPerformanceAdmin(admin.ModelAdmin):
     list_display = ('bus', 'route', 'week_start_date', 'total_passengers', 'total_kms', 'total_profit')
     list_filter = ('week_start_date', 'route', 'bus')
-    search_fields = ('bus__number_plate', 'route__number')
\ No newline at end of file
+    search_fields = ('bus__number_plate', 'route__number')
+
+@admin.register(DailyPerformance)
+class DailyPerformanceAdmin(admin.ModelAdmin):
+    list_display = ('date', 'bus', 'route', 'trips', 'total_kms', 'estimated_passengers', 'total_revenue', 'total_cost')
+    list_filter = ('date', 'route')
+    search_fields = ('bus__number_plate', 'route__number')
+    date_hierarchy = 'date'
+    list_select_related = ('bus', 'route')
@@ -0,0 +1,129 @@
+"""
+Multi-week backfill of the weekly performance reports.
+
+Weeks are independent (generate_weekly_report upserts one week's rows and
+leaves actual_passengers alone), so a range of weeks is spread over a pool
+of worker processes, one week per task. Every worker opens its own database
+connection: the parent closes its connections before the pool starts and
+each worker drops whatever it inherited in its initializer, so no socket or
+SQLite handle is ever shared across a fork.
+
+Progress is recorded in a JSON checkpoint file after every finished week.
+The default file is named after the range, so backfills of different ranges
+never share one. A rerun over the same range skips the weeks already done,
+and because each
+week is an upsert, redoing one that finished just before an interruption is
+harmless. The checkpoint is removed once the whole range is done.
+"""
+import json
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import django
+from django.db import connections
+
+WeekDone = namedtuple('WeekDone', ['week_start', 'rows', 'created'])
+
+
+def week_starts(start_date, end_date):
+    """Mondays of every week touching start_date..end_date"""
+    monday = start_date - timedelta(days=start_date.weekday())
+    weeks = []
+    while monday <= end_date:
+        weeks.append(monday)
+        monday += timedelta(weeks=1)
+    return weeks
+
+
+def default_checkpoint_path(first_week, last_week):
+    """Checkpoint file in the temp directory for the range first_week..last_week"""
+    return os.path.join(
+        tempfile.gettempdir(), f'weekly_report_backfill_{first_week:%Y%m%d}_{last_week:%Y%m%d}.json',
+    )
+
+
+class Checkpoint:
+    """Weeks already reported for one backfill range, kept in a JSON file"""
+
+    def __init__(self, path, first_week, last_week):
+        self.path = path
+        self.range = [first_week.isoformat(), last_week.isoformat()]
+        self.done = set()
+
+    def load(self):
+        """Read the weeks done by an earlier run over the same range; returns how many"""
+        try:
+            with open(self.path) as handle:
+                state = json.load(handle)
+        except (OSError, ValueError):
+            return 0
+        if state.get('range') == self.range:
+            self.done = set(state.get('done', []))
+        return len(self.done)
+
+    def mark(self, week_start):
+        self.done.add(week_start.isoformat())
+        # Write then rename, so an interruption never leaves half a file behind
+        partial = f'{self.path}.tmp'
+        with open(partial, 'w') as handle:
+            json.dump({'range': self.range, 'done': sorted(self.done)}, handle)
+        os.replace(partial, self.path)
+
+    def is_done(self, week_start):
+        return week_start.isoformat() in self.done
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _start_worker():
+    django.setup()
+    # Forget any connection inherited from the parent; the first query opens this worker's own
+    for connection in connections.all(initialized_only=True):
+        connection.connection = None
+    connections.close_all()
+
+
+def _report_week(week_start):
+    from .reports import generate_weekly_report
+
+    rows = generate_weekly_report(week_start)
+    return WeekDone(week_start, len(rows), sum(row.created for row in rows))
+
+
+def backfill_weekly_reports(weeks, checkpoint, workers=None):
+    """Generate the reports of `weeks` across `workers` processes, skipping weeks in the checkpoint.
+
+    Yields a WeekDone per week as it finishes (in completion order). With a
+    single worker the weeks run in this process.
+    """
+    pending = [week_start for week_start in weeks if not checkpoint.is_done(week_start)]
+    if not pending:
+        return
+
+    if workers == 1:
+        for week_start in pending:
+            done = _report_week(week_start)
+            checkpoint.mark(week_start)
+            yield done
+        return
+
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker) as pool:
+        futures = [pool.submit(_report_week, week_start) for week_start in pending]
+        try:
+            for future in as_completed(futures):
+                done = future.result()
+                checkpoint.mark(done.week_start)
+                yield done
+        except BaseException:
+            # Don't start the queued weeks; the checkpoint has everything finished so far
+            for future in futures:
+                future.cancel()
+            raise
@@ -0,0 +1,78 @@
+"""
+Cached weekly summary behind the admin dashboard, one entry per week_start_date.
+
+A week is built in the database: one aggregate() for the totals, one
+annotate() per ranking (routes and buses by profit) and one values() query
+for the detail table, so no model instances are loaded and nothing is summed
+in Python. The result is cached, so a warm dashboard doesn't
+query the performance table at all. Saving or deleting any row of a week
+drops that week's entry (see signals.py); the report engine's bulk upsert
+sends no signals, so it invalidates the week itself. The cache alias is a
+shared backend (the database by default), so an invalidation made by the
+generate_weekly_report command or a backfill worker reaches the web server.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import WeeklyPerformance
+
+WeekSummary = namedtuple('WeekSummary', [
+    'total_profit', 'total_revenue', 'total_cost', 'total_passengers',
+    'route_performance', 'bus_performance', 'performances',
+])
+
+SUMMARY_FIELDS = (
+    'bus__number_plate', 'route__number', 'route__name',
+    'total_passengers', 'total_kms', 'total_revenue', 'total_cost', 'total_profit',
+)
+
+
+def _cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def _key(week_start):
+    return f'dashboard:week:{week_start.isoformat()}'
+
+
+def build_week_summary(week_start):
+    """WeekSummary of the week starting on `week_start`, straight from the database"""
+    week = WeeklyPerformance.objects.filter(week_start_date=week_start)
+    money = DecimalField(max_digits=12, decimal_places=2)
+    totals = week.aggregate(
+        total_profit=Coalesce(Sum('total_profit'), Value(Decimal('0')), output_field=money),
+        total_revenue=Coalesce(Sum('total_revenue'), Value(Decimal('0')), output_field=money),
+        total_cost=Coalesce(Sum('total_cost'), Value(Decimal('0')), output_field=money),
+        total_passengers=Coalesce(Sum('total_passengers'), 0),
+    )
+    route_performance = list(
+        week.values('route__number', 'route__name')
+        .annotate(total_profit=Sum('total_profit'), total_passengers=Sum('total_passengers'))
+        .order_by('-total_profit', 'route__number')
+    )
+    bus_performance = list(
+        week.values('bus__number_plate')
+        .annotate(total_profit=Sum('total_profit'), total_routes=Count('id'))
+        .order_by('-total_profit', 'bus__number_plate')
+    )
+    performances = list(week.values(*SUMMARY_FIELDS).order_by('bus__number_plate', 'route__number'))
+    return WeekSummary(route_performance=route_performance, bus_performance=bus_performance,
+                       performances=performances, **totals)
+
+
+def week_summary(week_start):
+    """Cached WeekSummary of the week starting on `week_start`"""
+    summary = _cache().get(_key(week_start))
+    if summary is None:
+        summary = build_week_summary(week_start)
+        _cache().set(_key(week_start), summary, getattr(settings, 'DASHBOARD_CACHE_SECONDS', 3600))
+    return summary
+
+
+def invalidate_week_summary(*week_starts):
+    _cache().delete_many([_key(week_start) for week_start in week_starts])
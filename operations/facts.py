@@ -0,0 +1,104 @@
+"""
+Daily performance fact table (DailyPerformance), one row per (date, bus, route).
+
+Each row holds the bus's assignments on the route that day, the kilometres
+they add up to (one route length per assignment), its share of the route's
+PreInform requests for the day (split between the route's buses by trips,
+largest remainder first, so the shares add up to the route's count) and the
+revenue and cost priced with the same formula as WeeklyPerformance.
+
+Facts are recomputed per (date, route): every write to a BusSchedule or
+PreInform row refreshes the days it touches (see signals.py), and bulk
+writers that skip signals call refresh_daily_performance themselves. Route
+distance and bus mileage edits are not tracked; run the
+rebuild_daily_performance command after changing those, or to backfill.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils.dateparse import parse_date
+
+from preinforms.models import PreInform
+from schedules.models import BusSchedule
+from .models import DailyPerformance, price_operation
+
+# (date, route) pairs refreshed per round of queries
+REFRESH_CHUNK = 200
+
+
+def share_out(total, weights):
+    """Split an integer total in proportion to weights; the parts add up to the total"""
+    weight_sum = sum(weights)
+    if not weight_sum:
+        return [0] * len(weights)
+    exact = [total * weight / weight_sum for weight in weights]
+    parts = [int(value) for value in exact]
+    leftovers = sorted(range(len(weights)), key=lambda index: exact[index] - parts[index], reverse=True)
+    for index in leftovers[:total - sum(parts)]:
+        parts[index] += 1
+    return parts
+
+
+def compute_facts(schedules, preinforms):
+    """DailyPerformance rows (unsaved) for the given BusSchedule and PreInform querysets"""
+    requests = {
+        (row['date_of_travel'], row['route_id']): row['requests']
+        for row in preinforms.values('date_of_travel', 'route_id').annotate(requests=Count('id'))
+    }
+    by_route_day = defaultdict(list)
+    for row in schedules.values('date', 'route_id', 'bus_id', 'route__total_distance', 'bus__mileage').annotate(
+            trips=Count('id')):
+        by_route_day[(row['date'], row['route_id'])].append(row)
+
+    facts = []
+    for (day, route_id), rows in by_route_day.items():
+        shares = share_out(requests.get((day, route_id), 0), [row['trips'] for row in rows])
+        for row, passengers in zip(rows, shares):
+            total_kms = row['route__total_distance'] * row['trips']
+            revenue, cost = price_operation(passengers, row['route__total_distance'], total_kms, row['bus__mileage'])
+            facts.append(DailyPerformance(
+                date=day, bus_id=row['bus_id'], route_id=route_id, trips=row['trips'], total_kms=total_kms,
+                estimated_passengers=passengers, total_revenue=revenue.quantize(Decimal('0.01')),
+                total_cost=cost.quantize(Decimal('0.01')),
+            ))
+    return facts
+
+
+def refresh_daily_performance(pairs):
+    """Recompute the facts of these (date, route_id) pairs; returns the number of rows written"""
+    pairs = sorted({
+        (parse_date(day) if isinstance(day, str) else day, route_id)
+        for day, route_id in pairs if day is not None and route_id is not None
+    })
+    written = 0
+    for start in range(0, len(pairs), REFRESH_CHUNK):
+        by_day = defaultdict(list)
+        for day, route_id in pairs[start:start + REFRESH_CHUNK]:
+            by_day[day].append(route_id)
+        match = reduce(or_, (Q(date=day, route_id__in=route_ids) for day, route_ids in by_day.items()))
+        requested = reduce(or_, (
+            Q(date_of_travel=day, route_id__in=route_ids) for day, route_ids in by_day.items()
+        ))
+
+        facts = compute_facts(BusSchedule.objects.filter(match), PreInform.objects.filter(requested))
+        with transaction.atomic():
+            DailyPerformance.objects.filter(match).delete()
+            DailyPerformance.objects.bulk_create(facts)
+        written += len(facts)
+    return written
+
+
+def rebuild_daily_performance(start_date, end_date):
+    """Recompute every fact from start_date to end_date inclusive; returns the number of rows written"""
+    facts = compute_facts(
+        BusSchedule.objects.filter(date__range=(start_date, end_date)),
+        PreInform.objects.filter(date_of_travel__range=(start_date, end_date)),
+    )
+    with transaction.atomic():
+        DailyPerformance.objects.filter(date__range=(start_date, end_date)).delete()
+        DailyPerformance.objects.bulk_create(facts, batch_size=1000)
+    return len(facts)
@@ -1,62 +1,74 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from datetime import timedelta
-from schedules.models import BusSchedule
-from operations.models import WeeklyPerformance
-from preinforms.models import PreInform
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from operations.backfill import Checkpoint, backfill_weekly_reports, default_checkpoint_path, week_starts
+from operations.reports import generate_weekly_report, last_week_start, week_bounds
 
 class Command(BaseCommand):
     help = 'Automatically generates weekly performance reports for all buses'
-    
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='Backfill every week from this date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', help='Last date of the backfill (YYYY-MM-DD, default end of last week)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes for a backfill (default: one per core)')
+        parser.add_argument('--checkpoint',
+                            help='File recording finished weeks, so an interrupted backfill can resume '
+                                 '(default: one per week range in the temp directory)')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and redo every week')
+
     def handle(self, *args, **options):
+        if options['start'] or options['end']:
+            return self.backfill(options)
+
         # Calculate last week's dates (Monday to Sunday)
-        today = timezone.now().date()
-        start_of_last_week = today - timedelta(days=today.weekday() + 7)
-        end_of_last_week = start_of_last_week + timedelta(days=6)
+        start_of_last_week, end_of_last_week = week_bounds(last_week_start())
         
         self.stdout.write(f"📊 Generating weekly report for {start_of_last_week} to {end_of_last_week}")
         
-        # Get all bus assignments from last week
-        weekly_assignments = BusSchedule.objects.filter(
-            date__gte=start_of_last_week,
-            date__lte=end_of_last_week
-        ).select_related('bus', 'route')
-        
-        # Group assignments by bus and route (since your model has both)
-        from itertools import groupby
-        from operator import attrgetter
-        
-        # Sort by both bus and route since your WeeklyPerformance requires both
-        assignments_sorted = sorted(weekly_assignments, key=lambda x: (x.bus_id, x.route_id))
-        
-        for (bus, route), bus_assignments in groupby(assignments_sorted, key=lambda x: (x.bus, x.route)):
-            bus_assignments = list(bus_assignments)
-            
-            # 1. Calculate total kilometers for this bus on this route
-            total_kms = sum(assignment.route.total_distance for assignment in bus_assignments)
-            
-            # 2. Calculate ESTIMATED passengers from PreInform for this specific route
-            estimated_passengers = PreInform.objects.filter(
-                route=route,  # Specific to this route
-                date_of_travel__gte=start_of_last_week,
-                date_of_travel__lte=end_of_last_week
-            ).count()
-            
-            # 3. Create weekly performance record for this bus + route combination
-            weekly_perf, created = WeeklyPerformance.objects.get_or_create(
-                bus=bus,
-                route=route,  # Your model requires route
-                week_start_date=start_of_last_week,
-                defaults={
-                    'estimated_passengers': estimated_passengers,
-                    'total_kms': total_kms,
-                    'actual_passengers': 0  # Start with 0, admin will update
-                }
-            )
-            
-            if created:
-                self.stdout.write(f"✅ Created: {bus} on {route} - {estimated_passengers} est. passengers, {total_kms} km")
+        # One weekly performance record per bus + route combination that ran last week
+        for row in generate_weekly_report(start_of_last_week):
+            if row.created:
+                self.stdout.write(f"✅ Created: {row.bus_number_plate} on route {row.route_number} - "
+                                  f"{row.estimated_passengers} est. passengers, {row.total_kms} km")
             else:
-                self.stdout.write(f"📝 Updated: {bus} on {route} - {estimated_passengers} est. passengers added")
+                self.stdout.write(f"📝 Updated: {row.bus_number_plate} on route {row.route_number} - "
+                                  f"{row.estimated_passengers} est. passengers, {row.total_kms} km")
         
-        self.stdout.write("🎉 Weekly report generation completed! Admin can now add actual ticket numbers.")
\ No newline at end of file
+        self.stdout.write("🎉 Weekly report generation completed! Admin can now add actual ticket numbers.")
+
+    def backfill(self, options):
+        if not options['start']:
+            raise CommandError('--to needs --from')
+        start = parse_date(options['start'])
+        end = parse_date(options['end']) if options['end'] else week_bounds(last_week_start())[1]
+        if start is None or end is None:
+            raise CommandError('Dates must be YYYY-MM-DD')
+        if end < start:
+            raise CommandError('--to is before --from')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        weeks = week_starts(start, end)
+        checkpoint = Checkpoint(
+            options['checkpoint'] or default_checkpoint_path(weeks[0], weeks[-1]), weeks[0], weeks[-1],
+        )
+        if options['restart']:
+            checkpoint.clear()
+        elif checkpoint.load():
+            self.stdout.write(f"⏩ Resuming: {len(checkpoint.done)} of {len(weeks)} weeks already done")
+
+        self.stdout.write(f"📊 Backfilling {len(weeks)} weekly reports from {weeks[0]} "
+                          f"with {options['workers']} workers")
+        began = time.monotonic()
+        finished, rows = len(checkpoint.done), 0
+        for done in backfill_weekly_reports(weeks, checkpoint, options['workers']):
+            finished += 1
+            rows += done.rows
+            self.stdout.write(f"✅ [{finished}/{len(weeks)}] Week of {done.week_start}: {done.rows} rows "
+                              f"({done.created} new)")
+        checkpoint.clear()
+        self.stdout.write(f"🎉 Backfill completed: {rows} rows in {time.monotonic() - began:.1f}s")
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils.dateparse import parse_date
+
+from operations.facts import rebuild_daily_performance
+from schedules.models import BusSchedule
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily performance facts from BusSchedule and PreInform rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First day (YYYY-MM-DD, default the first assignment)')
+        parser.add_argument('--to', dest='end', help='Last day, inclusive (YYYY-MM-DD, default the last assignment)')
+
+    def handle(self, *args, **options):
+        span = BusSchedule.objects.aggregate(first=Min('date'), last=Max('date'))
+        start = parse_date(options['start']) if options['start'] else span['first']
+        end = parse_date(options['end']) if options['end'] else span['last']
+        if start is None or end is None:
+            if options['start'] or options['end']:
+                raise CommandError('Dates must be YYYY-MM-DD')
+            self.stdout.write("❌ No bus assignments to build facts from!")
+            return
+        if end < start:
+            raise CommandError('--to is before --from')
+
+        self.stdout.write(f"🧱 Rebuilding daily performance from {start} to {end}...")
+        written = 0
+        # A week at a time keeps memory flat on long backfills
+        window_start = start
+        while window_start <= end:
+            window_end = min(window_start + timedelta(days=6), end)
+            rows = rebuild_daily_performance(window_start, window_end)
+            written += rows
+            self.stdout.write(f"✅ {window_start} to {window_end}: {rows} rows")
+            window_start = window_end + timedelta(days=1)
+        self.stdout.write(f"🎉 Daily performance rebuilt: {written} rows")
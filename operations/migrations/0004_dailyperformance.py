@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("operations", "0003_weeklyperformance_actual_passengers_and_more"),
+        ("routes", "0003_stop_is_limited_stop"),
+        ("schedules", "0010_stoptime"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyPerformance",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("date", models.DateField()),
+                ("trips", models.PositiveIntegerField(default=0, help_text="Bus assignments on this route that day")),
+                ("total_kms", models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ("estimated_passengers", models.PositiveIntegerField(default=0, help_text="The route's PreInform requests that day, shared between its buses by trips")),
+                ("total_revenue", models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ("total_cost", models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("bus", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="daily_performances", to="schedules.bus")),
+                ("route", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="daily_performances", to="routes.route")),
+            ],
+            options={
+                "ordering": ["date", "bus"],
+                "indexes": [models.Index(fields=["route", "date"], name="daily_perf_route_day_idx")],
+                "unique_together": {("date", "bus", "route")},
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Count, Max, Min
+
+# Days of history rebuilt per round of queries
+BACKFILL_DAYS = 31
+
+
+def backfill_daily_performance(apps, schema_editor):
+    # Same facts as operations.facts.compute_facts, built with the historical models
+    from operations.facts import share_out
+    from operations.models import price_operation
+
+    BusSchedule = apps.get_model("schedules", "BusSchedule")
+    PreInform = apps.get_model("preinforms", "PreInform")
+    DailyPerformance = apps.get_model("operations", "DailyPerformance")
+
+    span = BusSchedule.objects.aggregate(first=Min("date"), last=Max("date"))
+    if span["first"] is None:
+        return
+
+    start = span["first"]
+    while start <= span["last"]:
+        end = start + timedelta(days=BACKFILL_DAYS - 1)
+        requests = {
+            (row["date_of_travel"], row["route_id"]): row["requests"]
+            for row in PreInform.objects.filter(date_of_travel__range=(start, end))
+            .values("date_of_travel", "route_id").annotate(requests=Count("id"))
+        }
+        by_route_day = defaultdict(list)
+        for row in (
+            BusSchedule.objects.filter(date__range=(start, end))
+            .values("date", "route_id", "bus_id", "route__total_distance", "bus__mileage")
+            .annotate(trips=Count("id")).order_by("date", "route_id", "bus_id")
+        ):
+            by_route_day[(row["date"], row["route_id"])].append(row)
+
+        facts = []
+        for (day, route_id), rows in by_route_day.items():
+            shares = share_out(requests.get((day, route_id), 0), [row["trips"] for row in rows])
+            for row, passengers in zip(rows, shares):
+                total_kms = row["route__total_distance"] * row["trips"]
+                revenue, cost = price_operation(passengers, row["route__total_distance"], total_kms, row["bus__mileage"])
+                facts.append(DailyPerformance(
+                    date=day, bus_id=row["bus_id"], route_id=route_id, trips=row["trips"], total_kms=total_kms,
+                    estimated_passengers=passengers, total_revenue=revenue.quantize(Decimal("0.01")),
+                    total_cost=cost.quantize(Decimal("0.01")),
+                ))
+        DailyPerformance.objects.filter(date__range=(start, end)).delete()
+        DailyPerformance.objects.bulk_create(facts, batch_size=1000)
+        start = end + timedelta(days=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("operations", "0004_dailyperformance"),
+        ("preinforms", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_performance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_dashboard_cache_table(apps, schema_editor):
+    # The weekly summaries are shared by every process through the database
+    # (see operations/dashboard.py); createcachetable skips a table that already exists
+    cache = settings.CACHES.get(getattr(settings, "DASHBOARD_CACHE_ALIAS", "default"), {})
+    if cache.get("BACKEND") == "django.core.cache.backends.db.DatabaseCache":
+        call_command("createcachetable", cache["LOCATION"], database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("operations", "0005_backfill_daily_performance"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_dashboard_cache_table, migrations.RunPython.noop),
+    ]
@@ -4,6 +4,16 @@ from schedules.models import Bus
 from routes.models import Route
 from decimal import Decimal
 
+def price_operation(passengers, route_distance, total_kms, bus_mileage):
+    """(revenue, cost) of carrying `passengers` on a route and running `total_kms`"""
+    # Passengers ride half the route on average
+    average_journey_distance = Decimal(route_distance) * Decimal('0.5')
+    revenue = passengers * average_journey_distance * Decimal(settings.TICKET_PRICE_PER_KM)
+    fuel_used = Decimal(total_kms) / Decimal(bus_mileage)
+    cost = fuel_used * Decimal(settings.FUEL_PRICE_PER_LITER)
+    return revenue, cost
+
+
 class WeeklyPerformance(models.Model):
     bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='weekly_performances')
     route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='weekly_performances')
@@ -41,24 +51,57 @@ class WeeklyPerformance(models.Model):
     def __str__(self):
         return f"{self.bus} - {self.route} - Week of {self.week_start_date}"
 
-    # UPDATED SAVE METHOD
-    def save(self, *args, **kwargs):
+    def apply_financials(self, route_distance, bus_mileage):
+        """Fill in total_passengers and the revenue/cost/profit figures.
+
+        Takes the route distance and bus mileage as values so bulk writers can
+        price rows without loading each row's route and bus.
+        """
         # Auto-calculate total_passengers as sum of estimated + actual
         self.total_passengers = self.estimated_passengers + self.actual_passengers
         
         # Use ACTUAL passengers for revenue calculation if available, otherwise use estimated
         passengers_for_revenue = self.actual_passengers if self.actual_passengers > 0 else self.estimated_passengers
         
-        # 1. CALCULATE REVENUE
-        average_journey_distance = self.route.total_distance * Decimal('0.5')
-        self.total_revenue = passengers_for_revenue * average_journey_distance * Decimal(settings.TICKET_PRICE_PER_KM)
-        
-        # 2. CALCULATE COST
-        fuel_used = self.total_kms / Decimal(self.bus.mileage)
-        self.total_cost = fuel_used * Decimal(settings.FUEL_PRICE_PER_LITER)
+        # 1. CALCULATE REVENUE and 2. CALCULATE COST
+        self.total_revenue, self.total_cost = price_operation(
+            passengers_for_revenue, route_distance, self.total_kms, bus_mileage
+        )
         
         # 3. CALCULATE PROFIT
         self.total_profit = self.total_revenue - self.total_cost
+
+    # UPDATED SAVE METHOD
+    def save(self, *args, **kwargs):
+        self.apply_financials(self.route.total_distance, self.bus.mileage)
         
         # Call the original save method
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class DailyPerformance(models.Model):
+    """Per-day figures for each bus on each route, kept in step with BusSchedule and PreInform (see facts.py)"""
+    date = models.DateField()
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='daily_performances')
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='daily_performances')
+
+    trips = models.PositiveIntegerField(default=0, help_text="Bus assignments on this route that day")
+    total_kms = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    estimated_passengers = models.PositiveIntegerField(
+        default=0,
+        help_text="The route's PreInform requests that day, shared between its buses by trips"
+    )
+    total_revenue = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['date', 'bus', 'route']
+        ordering = ['date', 'bus']
+        indexes = [
+            models.Index(fields=['route', 'date'], name='daily_perf_route_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.bus} - {self.route} - {self.date}"
@@ -0,0 +1,112 @@
+"""
+Weekly performance report engine, shared by the generate_weekly_report
+command and the "Generate Weekly Report" page.
+
+A week is computed with grouped aggregate queries instead of per-group
+lookups:
+
+1. the week's DailyPerformance facts summed per (bus, route) into
+   kilometres (one route length per assignment) and estimated passengers
+   (each bus's share of its route's PreInform requests, see facts.py), with
+   the route distance and bus mileage needed for pricing (a week with
+   assignments but no facts has its facts rebuilt first);
+2. the week's existing WeeklyPerformance rows, so actual_passengers entered
+   by an admin survives a regeneration and still drives the revenue.
+
+Every row is priced with WeeklyPerformance.apply_financials (the same
+calculation save() runs) and written with a single bulk upsert on
+(bus, route, week_start_date), after which the week's cached dashboard
+summary is dropped. The query count doesn't depend on the size of the fleet.
+"""
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from schedules.models import BusSchedule
+from .dashboard import invalidate_week_summary
+from .facts import rebuild_daily_performance
+from .models import DailyPerformance, WeeklyPerformance
+
+# Columns rewritten when a report row already exists; actual_passengers is left alone
+UPSERT_FIELDS = [
+    'estimated_passengers', 'total_passengers', 'total_kms',
+    'total_revenue', 'total_cost', 'total_profit', 'updated_at',
+]
+
+ReportRow = namedtuple('ReportRow', [
+    'bus_id', 'bus_number_plate', 'route_id', 'route_number', 'estimated_passengers', 'total_kms', 'created',
+])
+
+
+def last_week_start(today=None):
+    """Monday of the week before `today`"""
+    today = today or timezone.now().date()
+    return today - timedelta(days=today.weekday() + 7)
+
+
+def week_bounds(week_start):
+    return week_start, week_start + timedelta(days=6)
+
+
+def week_groups(start, end):
+    return list(
+        DailyPerformance.objects.filter(date__gte=start, date__lte=end)
+        .values('bus_id', 'route_id', 'bus__number_plate', 'bus__mileage', 'route__number', 'route__total_distance')
+        .annotate(total_kms=Sum('total_kms'), estimated_passengers=Sum('estimated_passengers'))
+        .order_by('bus_id', 'route_id')
+    )
+
+
+def generate_weekly_report(week_start):
+    """Create or refresh the WeeklyPerformance rows of the week starting on `week_start`.
+
+    Returns a ReportRow per (bus, route) that ran that week, ordered by bus
+    and route; empty if there were no assignments.
+    """
+    start, end = week_bounds(week_start)
+    groups = week_groups(start, end)
+    if not groups and BusSchedule.objects.filter(date__gte=start, date__lte=end).exists():
+        # Assignments the facts never saw (written before they existed, or by a
+        # bulk write that skipped the refresh): build the week's facts first
+        rebuild_daily_performance(start, end)
+        groups = week_groups(start, end)
+    if not groups:
+        return []
+
+    actual = {
+        (bus_id, route_id): actual_passengers
+        for bus_id, route_id, actual_passengers in WeeklyPerformance.objects.filter(
+            week_start_date=week_start).values_list('bus_id', 'route_id', 'actual_passengers')
+    }
+
+    performances, rows = [], []
+    for group in groups:
+        key = (group['bus_id'], group['route_id'])
+        performance = WeeklyPerformance(
+            bus_id=group['bus_id'],
+            route_id=group['route_id'],
+            week_start_date=week_start,
+            estimated_passengers=group['estimated_passengers'],
+            actual_passengers=actual.get(key, 0),
+            total_kms=group['total_kms'],
+        )
+        performance.apply_financials(group['route__total_distance'], group['bus__mileage'])
+        performances.append(performance)
+        rows.append(ReportRow(
+            group['bus_id'], group['bus__number_plate'], group['route_id'], group['route__number'],
+            performance.estimated_passengers, performance.total_kms, key not in actual,
+        ))
+
+    with transaction.atomic():
+        WeeklyPerformance.objects.bulk_create(
+            performances,
+            update_conflicts=True,
+            unique_fields=['bus', 'route', 'week_start_date'],
+            update_fields=UPSERT_FIELDS,
+        )
+    # The upsert sends no post_save, so the cached dashboard summary is dropped here
+    invalidate_week_summary(week_start)
+    return rows
@@ -0,0 +1,52 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from preinforms.models import PreInform
+from schedules.models import BusSchedule
+from .dashboard import invalidate_week_summary
+from .facts import refresh_daily_performance
+from .models import WeeklyPerformance
+
+
+@receiver(pre_save, sender=BusSchedule)
+def remember_assignment_day(sender, instance, **kwargs):
+    # An assignment moved to another day or route also changes the facts it leaves behind
+    instance._previous_fact_day = None
+    if instance.pk:
+        instance._previous_fact_day = BusSchedule.objects.filter(pk=instance.pk).values_list('date', 'route_id').first()
+
+
+@receiver(post_save, sender=BusSchedule)
+@receiver(post_delete, sender=BusSchedule)
+def refresh_assignment_facts(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_fact_day', None)
+    refresh_daily_performance([(instance.date, instance.route_id)] + ([previous] if previous else []))
+
+
+@receiver(pre_save, sender=PreInform)
+def remember_preinform_day(sender, instance, **kwargs):
+    instance._previous_fact_day = None
+    if instance.pk:
+        instance._previous_fact_day = PreInform.objects.filter(pk=instance.pk).values_list(
+            'date_of_travel', 'route_id').first()
+
+
+@receiver(post_save, sender=PreInform)
+@receiver(post_delete, sender=PreInform)
+def refresh_preinform_facts(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_fact_day', None)
+    refresh_daily_performance([(instance.date_of_travel, instance.route_id)] + ([previous] if previous else []))
+
+
+@receiver(pre_save, sender=WeeklyPerformance)
+def remember_report_week(sender, instance, **kwargs):
+    instance._previous_week = None
+    if instance.pk:
+        instance._previous_week = WeeklyPerformance.objects.filter(pk=instance.pk).values_list(
+            'week_start_date', flat=True).first()
+
+
+@receiver(post_save, sender=WeeklyPerformance)
+@receiver(post_delete, sender=WeeklyPerformance)
+def refresh_report_week(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_week', None)
+    invalidate_week_summary(instance.week_start_date, *([previous] if previous else []))
@@ -1,3 +1,320 @@
+import os
+import tempfile
+from datetime import time, timedelta
+from decimal import Decimal
+from importlib import import_module
+
+from django.apps import apps
+from django.conf import settings
+
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Sum
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from preinforms.models import PreInform
+from routes.models import Route, Stop
+from schedules.models import Bus, BusSchedule
+from users.models import CustomUser
+from .backfill import Checkpoint, backfill_weekly_reports, default_checkpoint_path, week_starts
+from .dashboard import build_week_summary
+from .models import DailyPerformance, WeeklyPerformance
+from .reports import generate_weekly_report, last_week_start
+
+
+class AnalyticsDashboardQueryTests(TestCase):
+    """The analytics page aggregates in the database, so its query count doesn't grow with history"""
+
+    # Session and user lookups, the four rollups (weekly trends, routes, buses,
+    # demand patterns), then the session save (savepoint, update, release)
+    QUERY_BUDGET = 9
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user(email='admin@example.com', password='pass', role='admin')
+        cls.routes = [
+            Route.objects.create(number=str(number), name=f'Route {number}', origin='A', destination='B',
+                                 total_distance=10 + number)
+            for number in range(3)
+        ]
+        cls.buses = [Bus.objects.create(number_plate=f'KL-{number}', mileage=5) for number in range(4)]
+
+    def add_weeks(self, weeks):
+        today = timezone.now().date()
+        for week in range(weeks):
+            week_start = today - timedelta(days=today.weekday(), weeks=week + 1)
+            for bus in self.buses:
+                for route in self.routes:
+                    WeeklyPerformance.objects.get_or_create(
+                        bus=bus, route=route, week_start_date=week_start,
+                        defaults={'estimated_passengers': 10 * (week + 1), 'total_kms': 100},
+                    )
+
+    def get_dashboard(self):
+        self.client.force_login(self.admin)
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.client.get(reverse('analytics-dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_query_budget_holds_as_history_grows(self):
+        self.add_weeks(2)
+        self.get_dashboard()
+        self.add_weeks(6)
+        response = self.get_dashboard()
+        self.assertEqual(len(response.context['weekly_trends']), 6)
+
+    def test_rollups_match_the_rows(self):
+        self.add_weeks(2)
+        response = self.get_dashboard()
+
+        route = response.context['route_performance'][0]
+        rows = WeeklyPerformance.objects.filter(route__number=route['route__number'])
+        total_profit = sum(row.total_profit for row in rows)
+        total_kms = sum(row.total_kms for row in rows)
+        self.assertEqual(route['total_profit'], total_profit)
+        self.assertAlmostEqual(route['profit_per_km'], float(total_profit / total_kms), places=4)
+
+        trend = response.context['weekly_trends'][0]
+        week = WeeklyPerformance.objects.filter(week_start_date=trend['week_start_date'])
+        self.assertEqual(trend['total_passengers'], sum(row.total_passengers for row in week))
+
+
+class AdminDashboardCacheTests(TestCase):
+    """The weekly summary is cached per week and dropped when a row of that week changes"""
+
+    # Totals, route ranking, bus ranking and the detail table
+    SUMMARY_QUERIES = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user(email='admin@example.com', password='pass', role='admin')
+        cls.route = Route.objects.create(number='7', name='Route 7', origin='A', destination='B', total_distance=20)
+        cls.buses = [Bus.objects.create(number_plate=f'KL-{number}', mileage=5) for number in range(3)]
+        for bus in cls.buses:
+            WeeklyPerformance.objects.create(bus=bus, route=cls.route, week_start_date=last_week_start(),
+                                             estimated_passengers=10, total_kms=100)
+
+    def setUp(self):
+        caches[settings.DASHBOARD_CACHE_ALIAS].clear()
+        self.client.force_login(self.admin)
+
+    def get_dashboard(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin-dashboard'))
+        self.assertEqual(response.status_code, 200)
+        table = WeeklyPerformance._meta.db_table
+        return response, [query['sql'] for query in queries if table in query['sql']]
+
+    def test_warm_dashboard_skips_the_performance_table(self):
+        _, cold = self.get_dashboard()
+        self.assertEqual(len(cold), self.SUMMARY_QUERIES)
+        response, warm = self.get_dashboard()
+        self.assertEqual(warm, [])
+        self.assertEqual(response.context['total_passengers'], 30)
+        self.assertEqual(response.context['bus_performance'][0]['total_routes'], 1)
+
+    def test_saving_a_row_refreshes_the_week(self):
+        self.get_dashboard()
+        performance = WeeklyPerformance.objects.filter(bus=self.buses[0]).get()
+        performance.actual_passengers = 25
+        performance.save()
+        response, queries = self.get_dashboard()
+        self.assertEqual(len(queries), self.SUMMARY_QUERIES)
+        self.assertEqual(response.context['total_passengers'], 55)
+
+    def test_summary_matches_the_rows(self):
+        other = Route.objects.create(number='8', name='Route 8', origin='B', destination='C', total_distance=35)
+        WeeklyPerformance.objects.create(bus=self.buses[0], route=other, week_start_date=last_week_start(),
+                                         estimated_passengers=40, actual_passengers=12, total_kms=70)
+        summary = build_week_summary(last_week_start())
+
+        rows = list(WeeklyPerformance.objects.filter(week_start_date=last_week_start()))
+        for field in ('total_profit', 'total_revenue', 'total_cost', 'total_passengers'):
+            self.assertEqual(getattr(summary, field), sum(getattr(row, field) for row in rows))
+        self.assertEqual(
+            [(route['route__number'], route['total_profit'], route['total_passengers'])
+             for route in summary.route_performance],
+            sorted(((number, sum(row.total_profit for row in rows if row.route.number == number),
+                     sum(row.total_passengers for row in rows if row.route.number == number))
+                    for number in ('7', '8')), key=lambda route: route[1], reverse=True),
+        )
+        self.assertEqual(
+            {bus['bus__number_plate']: bus['total_routes'] for bus in summary.bus_performance},
+            {'KL-0': 2, 'KL-1': 1, 'KL-2': 1},
+        )
+        self.assertEqual(summary.bus_performance[0]['bus__number_plate'],
+                         max(self.buses, key=lambda bus: sum(row.total_profit for row in rows if row.bus == bus)).number_plate)
+        self.assertEqual(len(summary.performances), 4)
+
+    def test_empty_week_sums_to_zero(self):
+        summary = build_week_summary(last_week_start() - timedelta(weeks=1))
+        self.assertEqual((summary.total_profit, summary.total_revenue, summary.total_cost, summary.total_passengers),
+                         (0, 0, 0, 0))
+        self.assertEqual((summary.route_performance, summary.bus_performance, summary.performances), ([], [], []))
+
+
+class WeeklyReportHistoryTests(TestCase):
+    """Reports still cover assignments written before the daily facts existed"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.week_start = last_week_start()
+        cls.route = Route.objects.create(number='7', name='Route 7', origin='A', destination='B', total_distance=20)
+        cls.bus = Bus.objects.create(number_plate='KL-7', mileage=5)
+
+    def setUp(self):
+        # bulk_create sends no signals, so these rows have no facts, like history from before the table
+        BusSchedule.objects.bulk_create([
+            BusSchedule(bus=self.bus, route=self.route, date=self.week_start + timedelta(days=day),
+                        start_time=time(6, 0), end_time=time(10, 0))
+            for day in range(3)
+        ])
+        self.assertFalse(DailyPerformance.objects.exists())
+
+    def test_report_builds_missing_facts(self):
+        rows = generate_weekly_report(self.week_start)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].total_kms, 60)
+        self.assertEqual(DailyPerformance.objects.count(), 3)
+
+    def test_migration_backfills_existing_history(self):
+        migration = import_module('operations.migrations.0005_backfill_daily_performance')
+        migration.backfill_daily_performance(apps, None)
+        facts = DailyPerformance.objects.filter(bus=self.bus, route=self.route)
+        self.assertEqual([(fact.trips, fact.total_kms) for fact in facts], [(1, 20)] * 3)
+
+
+class WeeklyReportUpsertTests(TestCase):
+    """Regenerating a week rewrites the computed figures and keeps what an admin entered"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.week_start = last_week_start()
+        cls.route = Route.objects.create(number='7', name='Route 7', origin='A', destination='B', total_distance=20)
+        cls.stop = Stop.objects.create(route=cls.route, name='Stop 1', sequence=1, distance_from_origin=0)
+        cls.bus = Bus.objects.create(number_plate='KL-7', mileage=Decimal('4.5'))
+        cls.passenger = CustomUser.objects.create_user(email='passenger@example.com', role='passenger')
+        for day in range(3):
+            cls.assign(day)
+        cls.preinform(0)
+        cls.preinform(1)
+
+    @classmethod
+    def assign(cls, day):
+        BusSchedule.objects.create(bus=cls.bus, route=cls.route, date=cls.week_start + timedelta(days=day),
+                                   start_time=time(6, 0), end_time=time(10, 0))
+
+    @classmethod
+    def preinform(cls, day):
+        PreInform.objects.create(user=cls.passenger, route=cls.route, date_of_travel=cls.week_start + timedelta(days=day),
+                                 desired_time=time(7, 0), boarding_stop=cls.stop)
+
+    @staticmethod
+    def old_save_financials(performance):
+        """What WeeklyPerformance.save() computed before apply_financials existed"""
+        passengers_for_revenue = (
+            performance.actual_passengers if performance.actual_passengers > 0 else performance.estimated_passengers
+        )
+        average_journey_distance = performance.route.total_distance * Decimal('0.5')
+        revenue = passengers_for_revenue * average_journey_distance * Decimal(settings.TICKET_PRICE_PER_KM)
+        cost = performance.total_kms / Decimal(performance.bus.mileage) * Decimal(settings.FUEL_PRICE_PER_LITER)
+        return (performance.estimated_passengers + performance.actual_passengers, revenue, cost, revenue - cost)
+
+    def test_regenerating_keeps_actual_passengers(self):
+        [row] = generate_weekly_report(self.week_start)
+        self.assertTrue(row.created)
+        first = WeeklyPerformance.objects.get()
+        self.assertEqual((first.estimated_passengers, first.total_kms), (2, 60))
+        # Entered by an admin from ticket sales; update() so save() doesn't reprice it first
+        WeeklyPerformance.objects.update(actual_passengers=35)
+
+        self.assign(3)
+        self.preinform(3)
+        [row] = generate_weekly_report(self.week_start)
+        self.assertFalse(row.created)
+
+        performance = WeeklyPerformance.objects.get()
+        self.assertEqual(performance.pk, first.pk)
+        self.assertEqual(performance.created_at, first.created_at)
+        self.assertEqual(performance.actual_passengers, 35)
+        self.assertEqual((performance.estimated_passengers, performance.total_kms), (3, 80))
+        self.assertEqual(performance.total_passengers, 38)
+        # Revenue follows the actual passengers, cost the new kilometres
+        self.assertEqual(
+            (performance.total_passengers, performance.total_revenue, performance.total_cost, performance.total_profit),
+            tuple(Decimal(value).quantize(Decimal('0.01')) for value in self.old_save_financials(performance)),
+        )
+
+    def test_estimated_passengers_come_from_the_daily_facts(self):
+        # A second bus shares the first day's route, and its one pre-inform, with the first
+        other = Bus.objects.create(number_plate='KL-8', mileage=5)
+        BusSchedule.objects.create(bus=other, route=self.route, date=self.week_start,
+                                   start_time=time(11, 0), end_time=time(15, 0))
+        rows = generate_weekly_report(self.week_start)
+
+        facts = dict(DailyPerformance.objects.filter(date__gte=self.week_start).values('bus_id')
+                     .annotate(passengers=Sum('estimated_passengers')).values_list('bus_id', 'passengers'))
+        self.assertEqual({row.bus_id: row.estimated_passengers for row in rows}, facts)
+        # Shares, not the route's whole count for every bus
+        self.assertEqual(sum(row.estimated_passengers for row in rows), PreInform.objects.count())
+
+    def test_apply_financials_matches_the_old_save(self):
+        for estimated, actual, total_kms in ((12, 0, Decimal('60')), (12, 30, Decimal('61.25')), (0, 0, Decimal('0'))):
+            performance = WeeklyPerformance(bus=self.bus, route=self.route, week_start_date=self.week_start,
+                                            estimated_passengers=estimated, actual_passengers=actual,
+                                            total_kms=total_kms)
+            with self.subTest(estimated=estimated, actual=actual):
+                performance.apply_financials(self.route.total_distance, self.bus.mileage)
+                self.assertEqual(
+                    (performance.total_passengers, performance.total_revenue, performance.total_cost,
+                     performance.total_profit),
+                    self.old_save_financials(performance),
+                )
+
+
+class WeeklyReportBackfillTests(TestCase):
+    """A resumed backfill only generates the weeks its checkpoint doesn't have"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.weeks = week_starts(last_week_start() - timedelta(weeks=3), last_week_start())
+        route = Route.objects.create(number='7', name='Route 7', origin='A', destination='B', total_distance=20)
+        bus = Bus.objects.create(number_plate='KL-7', mileage=5)
+        for week_start in cls.weeks:
+            BusSchedule.objects.create(bus=bus, route=route, date=week_start + timedelta(days=2),
+                                       start_time=time(6, 0), end_time=time(10, 0))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'checkpoint.json')
+
+    def test_resume_skips_the_weeks_already_done(self):
+        interrupted = Checkpoint(self.path, self.weeks[0], self.weeks[-1])
+        interrupted.mark(self.weeks[0])
+        interrupted.mark(self.weeks[2])
+
+        checkpoint = Checkpoint(self.path, self.weeks[0], self.weeks[-1])
+        self.assertEqual(checkpoint.load(), 2)
+        done = list(backfill_weekly_reports(self.weeks, checkpoint, workers=1))
+
+        self.assertEqual([week.week_start for week in done], [self.weeks[1], self.weeks[3]])
+        self.assertEqual(set(WeeklyPerformance.objects.values_list('week_start_date', flat=True)),
+                         {self.weeks[1], self.weeks[3]})
+        resumed = Checkpoint(self.path, self.weeks[0], self.weeks[-1])
+        self.assertEqual(resumed.load(), 4)
+
+    def test_checkpoints_belong_to_one_range(self):
+        self.assertEqual(default_checkpoint_path(self.weeks[0], self.weeks[-1]),
+                         default_checkpoint_path(self.weeks[0], self.weeks[-1]))
+        self.assertNotEqual(default_checkpoint_path(self.weeks[0], self.weeks[-1]),
+                            default_checkpoint_path(self.weeks[1], self.weeks[-1]))
 
-# Create your tests here.
+        Checkpoint(self.path, self.weeks[1], self.weeks[-1]).mark(self.weeks[1])
+        checkpoint = Checkpoint(self.path, self.weeks[0], self.weeks[-1])
+        self.assertEqual(checkpoint.load(), 0)
+        self.assertEqual(len(list(backfill_weekly_reports(self.weeks, checkpoint, workers=1))), 4)
@@ -3,9 +3,11 @@ from django.contrib.auth.decorators import user_passes_test
 from django.utils import timezone
 from datetime import timedelta
 from .models import WeeklyPerformance
-from django.db.models import Sum, Count  
+from .dashboard import week_summary
+from .reports import generate_weekly_report, last_week_start, week_bounds
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum, Value
+from django.db.models.functions import Coalesce, NullIf
 from django.contrib import messages  
-from schedules.models import BusSchedule  
 from preinforms.models import PreInform  
 
 def admin_check(user):
@@ -15,43 +17,12 @@ def admin_check(user):
 def admin_dashboard(request):
     """View for the admin dashboard showing weekly performance summary"""
     
-    # Calculate the start of last week (assuming week starts on Monday)
-    today = timezone.now().date()
-    start_of_last_week = today - timedelta(days=today.weekday() + 7)
-    
-    # Get all performance records from last week
-    last_week_performances = WeeklyPerformance.objects.filter(
-        week_start_date=start_of_last_week
-    ).select_related('bus', 'route')
-    
-    # Calculate totals
-    total_profit = sum(performance.total_profit for performance in last_week_performances)
-    total_revenue = sum(performance.total_revenue for performance in last_week_performances)
-    total_cost = sum(performance.total_cost for performance in last_week_performances)
-    total_passengers = sum(performance.total_passengers for performance in last_week_performances)
-    
-    # Get top performing routes (by total profit)
-    from django.db.models import Sum
-    route_performance = last_week_performances.values('route__number', 'route__name').annotate(
-        total_profit=Sum('total_profit'),
-        total_passengers=Sum('total_passengers')
-    ).order_by('-total_profit')
-    
-    # Get top performing buses (by total profit)
-    bus_performance = last_week_performances.values('bus__number_plate').annotate(
-        total_profit=Sum('total_profit'),
-        total_routes=Count('id')
-    ).order_by('-total_profit')
-    
+    start_of_last_week = last_week_start()
+    summary = week_summary(start_of_last_week)
+
     context = {
         'week_start': start_of_last_week,
-        'total_profit': total_profit,
-        'total_revenue': total_revenue,
-        'total_cost': total_cost,
-        'total_passengers': total_passengers,
-        'route_performance': route_performance,
-        'bus_performance': bus_performance,
-        'performances': last_week_performances,
+        **summary._asdict(),
     }
     
     return render(request, 'admin_dashboard.html', context)
@@ -61,61 +32,13 @@ def admin_dashboard(request):
 def generate_weekly_report_view(request):
     """View that generates weekly reports (same functionality as the command)"""
     # Calculate last week's dates (Monday to Sunday)
-    today = timezone.now().date()
-    start_of_last_week = today - timedelta(days=today.weekday() + 7)
-    end_of_last_week = start_of_last_week + timedelta(days=6)
-    
-    report_data = []
+    start_of_last_week, end_of_last_week = week_bounds(last_week_start())
     
-    # Get all bus assignments from last week
-    weekly_assignments = BusSchedule.objects.filter(
-        date__gte=start_of_last_week,
-        date__lte=end_of_last_week
-    ).select_related('bus', 'route')
-    
-    if not weekly_assignments.exists():
+    report_data = generate_weekly_report(start_of_last_week)
+    if not report_data:
         messages.warning(request, "No bus assignments found for last week. Create some BusSchedule records first.")
         return redirect('admin-dashboard')
     
-    # Group assignments by bus and route
-    from itertools import groupby
-    from operator import attrgetter
-    
-    assignments_sorted = sorted(weekly_assignments, key=lambda x: (x.bus_id, x.route_id))
-    
-    for (bus, route), bus_assignments in groupby(assignments_sorted, key=lambda x: (x.bus, x.route)):
-        bus_assignments = list(bus_assignments)
-        
-        # Calculate total kilometers for this bus on this route
-        total_kms = sum(assignment.route.total_distance for assignment in bus_assignments)
-        
-        # Calculate ESTIMATED passengers from PreInform
-        estimated_passengers = PreInform.objects.filter(
-            route=route,
-            date_of_travel__gte=start_of_last_week,
-            date_of_travel__lte=end_of_last_week
-        ).count()
-        
-        # Create or update weekly performance record
-        weekly_perf, created = WeeklyPerformance.objects.get_or_create(
-            bus=bus,
-            route=route,
-            week_start_date=start_of_last_week,
-            defaults={
-                'estimated_passengers': estimated_passengers,
-                'total_kms': total_kms,
-                'actual_passengers': 0
-            }
-        )
-        
-        report_data.append({
-            'bus': bus,
-            'route': route,
-            'estimated_passengers': estimated_passengers,
-            'total_kms': total_kms,
-            'created': created
-        })
-    
     messages.success(request, f"Generated weekly report for {start_of_last_week} to {end_of_last_week}")
     return render(request, 'report_generated.html', {
         'report_data': report_data,
@@ -125,6 +48,14 @@ def generate_weekly_report_view(request):
     
 
 
+def per_km(total):
+    """SQL for <total> / total_kms over an aggregated queryset, 0 where no kms were run"""
+    return Coalesce(
+        ExpressionWrapper(F(total) / NullIf(F('total_kms'), 0), output_field=FloatField()),
+        Value(0.0),
+        output_field=FloatField(),
+    )
+
 @user_passes_test(admin_check)
 def analytics_dashboard(request):
     """Advanced analytics dashboard with trends and patterns"""
@@ -132,75 +63,43 @@ def analytics_dashboard(request):
     today = timezone.now().date()
     start_date = today - timedelta(weeks=8)
     
-    # 1. Weekly Trends
-    weekly_data = WeeklyPerformance.objects.filter(
-        week_start_date__gte=start_date
-    ).values('week_start_date')
+    performances = WeeklyPerformance.objects.filter(week_start_date__gte=start_date)
     
-    weekly_trends = []
-    for week in weekly_data.distinct():
-        week_start = week['week_start_date']
-        week_data = WeeklyPerformance.objects.filter(week_start_date=week_start)
-        
-        weekly_trends.append({
-            'week_start_date': week_start,
-            'total_profit': sum(p.total_profit for p in week_data),
-            'total_revenue': sum(p.total_revenue for p in week_data),
-            'total_passengers': sum(p.total_passengers for p in week_data),
-        })
+    # 1. Weekly Trends
+    weekly_trends = (
+        performances.values('week_start_date')
+        .annotate(
+            total_profit=Sum('total_profit'),
+            total_revenue=Sum('total_revenue'),
+            total_passengers=Sum('total_passengers'),
+        )
+        .order_by('-week_start_date')
+    )
     
     # 2. Route Performance
-    route_data = []
-    for performance in WeeklyPerformance.objects.filter(week_start_date__gte=start_date):
-        found = False
-        for item in route_data:
-            if item['route__number'] == performance.route.number:
-                item['total_profit'] += performance.total_profit
-                item['total_kms'] += performance.total_kms
-                item['total_passengers'] += performance.total_passengers
-                found = True
-                break
-        
-        if not found:
-            route_data.append({
-                'route__number': performance.route.number,
-                'route__name': performance.route.name,
-                'total_profit': performance.total_profit,
-                'total_kms': performance.total_kms,
-                'total_passengers': performance.total_passengers,
-            })
-    
-    for item in route_data:
-        item['profit_per_km'] = item['total_profit'] / item['total_kms'] if item['total_kms'] > 0 else 0
-    
-    route_performance = sorted(route_data, key=lambda x: x['total_profit'], reverse=True)[:10]
+    route_performance = (
+        performances.values('route__number', 'route__name')
+        .annotate(
+            total_profit=Sum('total_profit'),
+            total_kms=Sum('total_kms'),
+            total_passengers=Sum('total_passengers'),
+        )
+        .annotate(profit_per_km=per_km('total_profit'))
+        .order_by('-total_profit')[:10]
+    )
     
     # 3. Bus Efficiency
-    bus_data = []
-    for performance in WeeklyPerformance.objects.filter(week_start_date__gte=start_date):
-        found = False
-        for item in bus_data:
-            if item['bus__number_plate'] == performance.bus.number_plate:
-                item['total_profit'] += performance.total_profit
-                item['total_revenue'] += performance.total_revenue
-                item['total_kms'] += performance.total_kms
-                item['total_passengers'] += performance.total_passengers
-                found = True
-                break
-        
-        if not found:
-            bus_data.append({
-                'bus__number_plate': performance.bus.number_plate,
-                'total_profit': performance.total_profit,
-                'total_revenue': performance.total_revenue,
-                'total_kms': performance.total_kms,
-                'total_passengers': performance.total_passengers,
-            })
-    
-    for item in bus_data:
-        item['revenue_per_km'] = item['total_revenue'] / item['total_kms'] if item['total_kms'] > 0 else 0
-    
-    bus_efficiency = sorted(bus_data, key=lambda x: x['revenue_per_km'], reverse=True)[:10]
+    bus_efficiency = (
+        performances.values('bus__number_plate')
+        .annotate(
+            total_profit=Sum('total_profit'),
+            total_revenue=Sum('total_revenue'),
+            total_kms=Sum('total_kms'),
+            total_passengers=Sum('total_passengers'),
+        )
+        .annotate(revenue_per_km=per_km('total_revenue'))
+        .order_by('-revenue_per_km')[:10]
+    )
     
     # 4. Demand Patterns (Fixed for SQLite)
     from django.db.models.functions import ExtractHour, ExtractWeekDay
@@ -214,9 +113,9 @@ def analytics_dashboard(request):
     )
     
     context = {
-        'weekly_trends': weekly_trends,
-        'route_performance': route_performance,
-        'bus_efficiency': bus_efficiency,
+        'weekly_trends': list(weekly_trends),
+        'route_performance': list(route_performance),
+        'bus_efficiency': list(bus_efficiency),
         'demand_patterns': list(demand_patterns),
     }
     
@@ -1,4 +1,8 @@
-from django.contrib import admin
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.utils import timezone
 from .models import Route, Stop
 
 # Allows adding Stops directly from the Route admin page
@@ -16,6 +20,25 @@ class RouteAdmin(admin.ModelAdmin):
     list_filter = ('origin', 'destination')
     # Show the Stop forms inline
     inlines = [StopInline]
+    actions = ['generate_schedules']
+
+    @admin.action(description='Generate schedules for the coming days')
+    def generate_schedules(self, request, queryset):
+        from schedules.generator import generate_fleet_schedules
+
+        days = getattr(settings, 'SCHEDULE_GENERATOR_DAYS', 7)
+        start = timezone.localdate()
+        result = generate_fleet_schedules(start, start + timedelta(days=days - 1), routes=list(queryset))
+        if not result.crews:
+            self.message_user(request, 'No active buses paired with drivers to schedule.', messages.WARNING)
+            return
+        self.message_user(
+            request,
+            f'Created {result.schedules} schedules and {result.assignments} bus assignments '
+            f'for the next {days} days ({result.skipped} trips already taken, '
+            f'{result.conflicts} bus-days skipped for overlapping assignments).',
+            messages.SUCCESS,
+        )
 
 # Register both models
 admin.site.register(Route, RouteAdmin)
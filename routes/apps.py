@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RoutesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "routes"
+
+    def ready(self):
+        from . import signals  # noqa: F401
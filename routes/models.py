@@ -38,6 +38,12 @@ class Route(models.Model):
 
     def __str__(self):
         return f"{self.number}: {self.origin} to {self.destination}"
+
+    @classmethod
+    def catalog_state(cls):
+        """(route count, latest updated_at) - changes whenever any route or its stops change"""
+        state = cls.objects.aggregate(count=models.Count('id'), last_modified=models.Max('updated_at'))
+        return state['count'], state['last_modified']
     
     # NEW METHOD: Calculate trips per day
     def calculate_trips_per_day(self, operational_hours=15):
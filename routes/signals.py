@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Route, Stop
+
+
+@receiver(post_save, sender=Stop)
+@receiver(post_delete, sender=Stop)
+def touch_route(sender, instance, **kwargs):
+    """Stops are part of a route's payload, so changing one marks the route as modified"""
+    Route.objects.filter(id=instance.route_id).update(updated_at=timezone.now())
@@ -5,4 +5,5 @@ urlpatterns = [
     path('', views.homepage, name='homepage'),
     path('', views.api_welcome, name='api-welcome'),
     path('api/routes/', views.RouteListView.as_view(), name='route-list'),
+    path('api/routes/search/', views.route_search, name='route-search'),
 ]
\ No newline at end of file
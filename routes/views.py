@@ -1,8 +1,14 @@
+from django.conf import settings
+from django.db.models import Q
 from django.http import JsonResponse
-from rest_framework import generics
+from rest_framework import generics, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 from .models import Route
 from .serializers import RouteSerializer
 from django.shortcuts import render 
+from transport_system.conditional import make_etag, not_modified, stamp_response
 
 # Add this new function at the top of the file
 def api_welcome(request):
@@ -31,4 +37,28 @@ def homepage(request):
 class RouteListView(generics.ListAPIView):
     """API view to list all bus routes."""
     queryset = Route.objects.all().prefetch_related('stops')
-    serializer_class = RouteSerializer
\ No newline at end of file
+    serializer_class = RouteSerializer
+
+    def get(self, request, *args, **kwargs):
+        # Routes rarely change; let polling clients revalidate instead of re-downloading
+        count, last_modified = Route.catalog_state()
+        etag = make_etag('routes', request.accepted_renderer.format, count, last_modified)
+        cached = not_modified(request, etag, last_modified)
+        if cached is not None:
+            return cached
+        return stamp_response(super().get(request, *args, **kwargs), etag, last_modified)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def route_search(request):
+    """Routes whose number or name contains ?q=, for the assignment page's route picker"""
+    if request.user.role != 'admin':
+        return Response({'error': 'Only admins can search routes'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    query = request.GET.get('q', '').strip()
+    routes = Route.objects.filter(Q(number__icontains=query) | Q(name__icontains=query)).order_by('number')
+    return Response([
+        {'id': route.id, 'label': f"{route.number}: {route.name}"}
+        for route in routes[:getattr(settings, 'AUTOCOMPLETE_RESULTS', 20)]
+    ])
@@ -0,0 +1,40 @@
+"""
+Seat reservations across one or more schedules.
+
+Every schedule is booked with a conditional decrement in the database
+(see Schedule.take_seats), so concurrent bookers can never oversell a
+departure. A multi-schedule reservation runs in one transaction and is
+all-or-nothing: if any schedule is short of seats, nothing is booked.
+"""
+from django.db import transaction
+
+from .inventory import seat_inventory
+from .models import Schedule
+
+
+class SeatsUnavailable(Exception):
+    def __init__(self, schedule_id):
+        super().__init__(f'Not enough seats left on schedule {schedule_id}')
+        self.schedule_id = schedule_id
+
+
+def reserve_seats(requests):
+    """Book {schedule_id: seats} atomically; returns {schedule_id: available_seats left}.
+
+    Raises Schedule.DoesNotExist for unknown schedules and SeatsUnavailable
+    when any schedule cannot supply the seats asked for.
+    """
+    schedule_ids = sorted(requests)
+    with transaction.atomic():
+        # Fixed lock order, so two overlapping reservations cannot deadlock
+        for schedule_id in schedule_ids:
+            if not Schedule.take_seats(schedule_id, requests[schedule_id]):
+                if not Schedule.objects.filter(pk=schedule_id).exists():
+                    raise Schedule.DoesNotExist(f'Schedule {schedule_id} does not exist')
+                raise SeatsUnavailable(schedule_id)
+        remaining = list(Schedule.objects.filter(pk__in=schedule_ids).values_list(
+            'id', 'available_seats', 'date', 'updated_at'))
+
+    for schedule_id, available_seats, day, updated_at in remaining:
+        seat_inventory.record_booking(schedule_id, available_seats, day, updated_at)
+    return {schedule_id: available_seats for schedule_id, available_seats, _, _ in remaining}
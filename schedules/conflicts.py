@@ -0,0 +1,116 @@
+"""
+Overlap detection for bus assignments (BusSchedule).
+
+Each bus's assignments are placed on one timeline running across days,
+sorted by start and swept once: an assignment overlaps every earlier one
+that is still running when it starts. Saved rows for the buses involved, on
+the candidates' days and the days either side, are loaded with a single
+query. Validating one new assignment or a bulk import of thousands costs the
+same one query, and the sweep is O(n log n) overall.
+
+An end time at or before the start is a shift running past midnight. It
+ends at that time on the next day, so it can clash with that day's early
+shifts. Assignments that only touch (one ends when the next starts) do not
+overlap.
+"""
+import heapq
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from .models import BusSchedule
+
+SECONDS_PER_DAY = 24 * 3600
+
+# first/second are the overlapping BusSchedule objects, in start order; saved rows have a pk,
+# candidates may not. date is the day the overlap begins (second's date).
+AssignmentConflict = namedtuple('AssignmentConflict', ['bus_id', 'date', 'first', 'second'])
+
+
+def seconds(clock):
+    return clock.hour * 3600 + clock.minute * 60 + clock.second
+
+
+def span(assignment):
+    """(start, end) of an assignment in seconds since midnight of its date; overnight shifts end after 24:00"""
+    start, end = seconds(assignment.start_time), seconds(assignment.end_time)
+    return start, end if end > start else end + SECONDS_PER_DAY
+
+
+def timeline(assignment):
+    """(start, end) of an assignment in seconds on a timeline shared by every day"""
+    midnight = assignment.date.toordinal() * SECONDS_PER_DAY
+    start, end = span(assignment)
+    return midnight + start, midnight + end
+
+
+def sweep(assignments):
+    """Overlapping pairs among one bus's (is_new, assignment) items, in start order"""
+    ordered = sorted(
+        ((timeline(assignment), is_new, assignment) for is_new, assignment in assignments),
+        key=lambda item: item[0],
+    )
+    running = []  # heap of (end, position, is_new, assignment)
+    pairs = []
+    for position, ((start, end), is_new, assignment) in enumerate(ordered):
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        for _, _, earlier_is_new, earlier in running:
+            if is_new or earlier_is_new:
+                pairs.append((earlier, assignment))
+        heapq.heappush(running, (end, position, is_new, assignment))
+    return pairs
+
+
+def find_conflicts(assignments):
+    """Every overlap among `assignments` and between them and the saved BusSchedule rows.
+
+    Candidates may be unsaved; a saved candidate replaces its stored row, so
+    editing an assignment is not reported as overlapping itself. Overlaps
+    between two rows that are both already saved are not reported.
+    """
+    assignments = list(assignments)
+    if not assignments:
+        return []
+    groups = defaultdict(list)
+    # Saved rows from the day before (overnight shifts) to the day after can reach a candidate
+    reach = defaultdict(set)
+    for assignment in assignments:
+        groups[assignment.bus_id].append((True, assignment))
+        reach[assignment.bus_id].update(assignment.date + timedelta(days=offset) for offset in (-1, 0, 1))
+
+    edited = {assignment.pk for assignment in assignments if assignment.pk}
+    days = set().union(*reach.values())
+    existing = BusSchedule.objects.filter(
+        bus_id__in=list(groups), date__range=(min(days), max(days)),
+    ).exclude(pk__in=edited).only('id', 'bus_id', 'route_id', 'date', 'start_time', 'end_time')
+    for assignment in existing:
+        if assignment.date in reach[assignment.bus_id]:
+            groups[assignment.bus_id].append((False, assignment))
+
+    conflicts = []
+    for bus_id, group in groups.items():
+        if len(group) > 1:
+            conflicts.extend(
+                AssignmentConflict(bus_id, second.date, first, second) for first, second in sweep(group)
+            )
+    return conflicts
+
+
+def blocked_days(assignments):
+    """(bus_id, date) of every candidate that overlaps another assignment, one query"""
+    assignments = list(assignments)
+    candidates = {id(assignment) for assignment in assignments}
+    return {
+        (assignment.bus_id, assignment.date)
+        for conflict in find_conflicts(assignments)
+        for assignment in (conflict.first, conflict.second) if id(assignment) in candidates
+    }
+
+
+def describe(conflict):
+    """One-line explanation of a conflict, for forms and command output"""
+    def label(assignment):
+        name = f'assignment #{assignment.pk}' if assignment.pk else 'new assignment'
+        return f'{name} ({assignment.start_time:%H:%M}-{assignment.end_time:%H:%M})'
+
+    return f'Bus {conflict.bus_id} on {conflict.date}: {label(conflict.first)} overlaps {label(conflict.second)}'
@@ -0,0 +1,51 @@
+"""
+Vectorised great-circle distances.
+
+NumPy versions of the haversine formula that compute the distance from one
+point to N buses, or an M x N matrix between M points and N buses, in a
+single array operation instead of a Python loop of scalar math calls.
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between two coordinates in kilometers"""
+    lat1_rad = math.radians(lat1)
+    lon1_rad = math.radians(lon1)
+    lat2_rad = math.radians(lat2)
+    lon2_rad = math.radians(lon2)
+
+    dlat = lat2_rad - lat1_rad
+    dlon = lon2_rad - lon1_rad
+
+    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    return EARTH_RADIUS_KM * c
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    """Haversine on radian arrays that broadcast against each other"""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def distances_from(lat, lng, lats, lngs):
+    """Distances in km from one point to every (lats[i], lngs[i]); returns shape (N,)"""
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lngs = np.radians(np.asarray(lngs, dtype=float))
+    return _haversine(math.radians(lat), math.radians(lng), lats, lngs)
+
+
+def distance_matrix(point_lats, point_lngs, lats, lngs):
+    """Distances in km between M points and N positions; returns shape (M, N)"""
+    point_lats = np.radians(np.asarray(point_lats, dtype=float))[:, np.newaxis]
+    point_lngs = np.radians(np.asarray(point_lngs, dtype=float))[:, np.newaxis]
+    lats = np.radians(np.asarray(lats, dtype=float))[np.newaxis, :]
+    lngs = np.radians(np.asarray(lngs, dtype=float))[np.newaxis, :]
+    return _haversine(point_lats, point_lngs, lats, lngs)
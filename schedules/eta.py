@@ -0,0 +1,192 @@
+"""
+Real-time arrival predictions for running buses.
+
+Stops only carry `distance_from_origin`, so a bus's progress along its route
+is tracked as the GPS distance it has covered since its current trip began
+(seeded from the timetable when the first fix arrives mid-trip). On every
+accepted fix the engine advances that odometer, smooths the observed speed
+and recomputes the ETA to each downstream stop. Predictions are stored per
+bus and per stop, so reads are dictionary lookups with no geometry work.
+"""
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from .distance import calculate_distance
+from .trips import current_trips
+
+# Readings faster than this are GPS jumps, not driving
+MAX_PLAUSIBLE_SPEED_KMH = 120
+# Below this the bus is waiting at a stop or in traffic; fall back to the timetable speed
+MIN_MOVING_SPEED_KMH = 5
+SPEED_SMOOTHING = 0.3
+
+RouteStops = namedtuple('RouteStops', ['total_distance', 'scheduled_speed', 'stops'])
+StopInfo = namedtuple('StopInfo', ['id', 'name', 'sequence', 'distance_from_origin'])
+
+
+class BusProgress:
+    def __init__(self, route_id, trip_id, distance_km, latitude, longitude, timestamp):
+        self.route_id = route_id
+        self.trip_id = trip_id
+        self.distance_km = distance_km
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timestamp = timestamp
+        self.speed_kmh = None
+
+
+class EtaEngine:
+    """Keeps per-bus route progress and the ETAs it implies"""
+
+    def __init__(self):
+        self._routes = {}
+        self._progress = {}
+        self._bus_etas = {}
+        self._stop_arrivals = {}
+        self._lock = threading.RLock()
+
+    def route_stops(self, route_id):
+        """Ordered stops of a route, loaded once and kept until the route changes"""
+        from routes.models import Route, Stop
+
+        with self._lock:
+            cached = self._routes.get(route_id)
+        if cached is not None:
+            return cached
+
+        route = Route.objects.filter(id=route_id).values('total_distance', 'duration').first()
+        if route is None:
+            return None
+        stops = [
+            StopInfo(stop_id, name, sequence, float(distance))
+            for stop_id, name, sequence, distance in Stop.objects.filter(route_id=route_id)
+            .order_by('distance_from_origin', 'sequence')
+            .values_list('id', 'name', 'sequence', 'distance_from_origin')
+        ]
+        total_distance = float(route['total_distance'])
+        duration = float(route['duration'])
+        scheduled_speed = total_distance / duration if duration > 0 else MIN_MOVING_SPEED_KMH
+        cached = RouteStops(total_distance, scheduled_speed, stops)
+        with self._lock:
+            self._routes[route_id] = cached
+        return cached
+
+    def update(self, bus_id, latitude, longitude, timestamp, route_id, trips=None):
+        """Advance a bus along its route and recompute its downstream ETAs.
+
+        `trips` is an optional {bus_id: Schedule or None} already resolved by
+        the caller (batch ingest resolves a whole upload with one query).
+        """
+        if route_id is None:
+            self.forget(bus_id)
+            return
+        route = self.route_stops(route_id)
+        if route is None:
+            self.forget(bus_id)
+            return
+        if trips is not None and bus_id in trips:
+            trip = trips[bus_id]
+        else:
+            trip = current_trips.current_trip(bus_id)
+        trip_id = trip.id if trip else None
+        latitude, longitude = float(latitude), float(longitude)
+
+        with self._lock:
+            progress = self._progress.get(bus_id)
+            if progress is None or progress.route_id != route_id or progress.trip_id != trip_id:
+                progress = BusProgress(
+                    route_id, trip_id, self._starting_distance(route, trip, timestamp),
+                    latitude, longitude, timestamp
+                )
+                self._progress[bus_id] = progress
+            elif timestamp > progress.timestamp:
+                step = calculate_distance(progress.latitude, progress.longitude, latitude, longitude)
+                hours = (timestamp - progress.timestamp).total_seconds() / 3600
+                speed = step / hours
+                if speed <= MAX_PLAUSIBLE_SPEED_KMH:
+                    progress.distance_km = min(progress.distance_km + step, route.total_distance)
+                    if progress.speed_kmh is None:
+                        progress.speed_kmh = speed
+                    else:
+                        progress.speed_kmh += SPEED_SMOOTHING * (speed - progress.speed_kmh)
+                progress.latitude, progress.longitude, progress.timestamp = latitude, longitude, timestamp
+            else:
+                return
+
+            speed = progress.speed_kmh
+            if speed is None or speed < MIN_MOVING_SPEED_KMH:
+                speed = route.scheduled_speed
+
+            etas = []
+            for stop in route.stops:
+                remaining = stop.distance_from_origin - progress.distance_km
+                if remaining < 0:
+                    continue
+                etas.append({
+                    'stop_id': stop.id,
+                    'stop_name': stop.name,
+                    'sequence': stop.sequence,
+                    'distance_km': round(remaining, 2),
+                    'eta': timestamp + timedelta(hours=remaining / speed),
+                })
+            self._replace_etas(bus_id, route_id, etas, timestamp)
+
+    @staticmethod
+    def _starting_distance(route, trip, timestamp):
+        """Where a bus is when we first see it: the origin, or the timetable position mid-trip"""
+        if trip is None:
+            return 0.0
+        departure = timezone.make_aware(datetime.combine(trip.date, trip.departure_time))
+        arrival = timezone.make_aware(datetime.combine(trip.date, trip.arrival_time))
+        if arrival <= departure:
+            arrival += timedelta(days=1)
+        elapsed = (timestamp - departure) / (arrival - departure)
+        return route.total_distance * min(max(elapsed, 0.0), 1.0)
+
+    def _replace_etas(self, bus_id, route_id, etas, updated_at=None):
+        for entry in self._bus_etas.get(bus_id, ()):
+            arrivals = self._stop_arrivals.get(entry['stop_id'])
+            if arrivals is not None:
+                arrivals.pop(bus_id, None)
+                if not arrivals:
+                    del self._stop_arrivals[entry['stop_id']]
+        self._bus_etas[bus_id] = etas
+        for entry in etas:
+            self._stop_arrivals.setdefault(entry['stop_id'], {})[bus_id] = {
+                'bus_id': bus_id,
+                'route_id': route_id,
+                'distance_km': entry['distance_km'],
+                'eta': entry['eta'],
+                'updated_at': updated_at,
+            }
+
+    def bus_etas(self, bus_id):
+        """Predicted arrivals of one bus at its downstream stops"""
+        with self._lock:
+            return list(self._bus_etas.get(bus_id, ()))
+
+    def stop_arrivals(self, stop_id, updated_after=None):
+        """Buses predicted to reach a stop, soonest first, optionally only from recent fixes"""
+        with self._lock:
+            arrivals = [
+                arrival for arrival in self._stop_arrivals.get(stop_id, {}).values()
+                if updated_after is None or arrival['updated_at'] >= updated_after
+            ]
+        return sorted(arrivals, key=lambda arrival: arrival['eta'])
+
+    def forget(self, bus_id):
+        with self._lock:
+            self._progress.pop(bus_id, None)
+            self._replace_etas(bus_id, None, [])
+            self._bus_etas.pop(bus_id, None)
+
+    def invalidate_route(self, route_id):
+        """Stops or timings changed; reload them on the next fix"""
+        with self._lock:
+            self._routes.pop(route_id, None)
+
+
+eta_engine = EtaEngine()
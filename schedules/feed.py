@@ -0,0 +1,159 @@
+"""
+Fan-out of live bus position changes to streaming subscribers.
+
+Clients subscribe to a bounding box or a route. Bounding-box subscriptions
+are registered in the spatial grid cells they cover, so publishing a fix
+only touches the subscribers whose area contains the bus (or contained it
+before the move). Each subscription coalesces events per bus, so a slow
+client only ever receives the latest position of every bus it watches.
+"""
+import asyncio
+import threading
+
+from .spatial import bus_index, in_bbox
+
+# Boxes covering more cells than this are matched on every publish instead
+MAX_SUBSCRIPTION_CELLS = 400
+
+
+def position_event(bus_id, position, in_view=True):
+    return {
+        'id': bus_id,
+        'current_latitude': str(position.latitude),
+        'current_longitude': str(position.longitude),
+        'last_location_update': position.timestamp,
+        'route_id': position.route_id,
+        'in_view': in_view,
+    }
+
+
+class Subscription:
+    """One streaming client; events are delivered on the client's event loop"""
+
+    def __init__(self, loop, bbox=None, route_id=None):
+        self.loop = loop
+        self.bbox = bbox
+        self.route_id = route_id
+        self.visible = set()
+        self._pending = {}
+        self._ready = asyncio.Event()
+
+    def matches(self, position):
+        if self.route_id is not None and position.route_id != self.route_id:
+            return False
+        if self.bbox is not None:
+            return in_bbox(float(position.latitude), float(position.longitude), *self.bbox)
+        return True
+
+    def push(self, event):
+        """Safe to call from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, event)
+        except RuntimeError:
+            # The client's loop has already shut down
+            pass
+
+    def _deliver(self, event):
+        self._pending[event['id']] = event
+        self._ready.set()
+
+    async def next_events(self, timeout):
+        """Wait for changes; returns the latest event per bus, or [] on timeout"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        events = list(self._pending.values())
+        self._pending.clear()
+        return events
+
+
+class LiveFeedHub:
+    """Routes published positions to the subscriptions interested in them"""
+
+    def __init__(self, index):
+        self.index = index
+        self._by_route = {}
+        self._by_cell = {}
+        self._wide = set()
+        self._watching = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, subscription):
+        with self._lock:
+            for key, registry in self._registrations(subscription):
+                registry.setdefault(key, set()).add(subscription)
+            if subscription.route_id is None and self._is_wide(subscription):
+                self._wide.add(subscription)
+        return subscription
+
+    def seed(self, subscription, bus_ids):
+        """Mark buses already sent in the initial snapshot as visible"""
+        with self._lock:
+            for bus_id in bus_ids:
+                subscription.visible.add(bus_id)
+                self._watching.setdefault(bus_id, set()).add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for key, registry in self._registrations(subscription):
+                self._discard(registry, key, subscription)
+            self._wide.discard(subscription)
+            for bus_id in subscription.visible:
+                self._discard(self._watching, bus_id, subscription)
+
+    def _is_wide(self, subscription):
+        rows, columns = self.index.bbox_ranges(*subscription.bbox)
+        return len(rows) * len(columns) > MAX_SUBSCRIPTION_CELLS
+
+    def _registrations(self, subscription):
+        """(key, registry) pairs a subscription is filed under"""
+        if subscription.route_id is not None:
+            return [(subscription.route_id, self._by_route)]
+        if self._is_wide(subscription):
+            return []
+        rows, columns = self.index.bbox_ranges(*subscription.bbox)
+        return [((row, col), self._by_cell) for row in rows for col in columns]
+
+    @staticmethod
+    def _discard(registry, key, subscription):
+        members = registry.get(key)
+        if members is not None:
+            members.discard(subscription)
+            if not members:
+                del registry[key]
+
+    def publish(self, bus_id, position):
+        """Notify subscribers that a bus moved"""
+        cell = self.index.cell(float(position.latitude), float(position.longitude))
+        with self._lock:
+            candidates = set(self._by_cell.get(cell, ()))
+            candidates |= self._by_route.get(position.route_id, set())
+            candidates |= self._watching.get(bus_id, set())
+            candidates |= self._wide
+            deliveries = []
+            for subscription in candidates:
+                if subscription.matches(position):
+                    subscription.visible.add(bus_id)
+                    self._watching.setdefault(bus_id, set()).add(subscription)
+                    deliveries.append((subscription, True))
+                elif bus_id in subscription.visible:
+                    # The bus left the area or route: tell the client to drop it
+                    subscription.visible.discard(bus_id)
+                    self._discard(self._watching, bus_id, subscription)
+                    deliveries.append((subscription, False))
+        for subscription, in_view in deliveries:
+            subscription.push(position_event(bus_id, position, in_view))
+
+    def remove(self, bus_id):
+        """A bus stopped running; clear it from every client showing it"""
+        with self._lock:
+            watchers = self._watching.pop(bus_id, set())
+            for subscription in watchers:
+                subscription.visible.discard(bus_id)
+        for subscription in watchers:
+            subscription.push({'id': bus_id, 'in_view': False})
+
+
+live_feed = LiveFeedHub(bus_index)
@@ -0,0 +1,198 @@
+"""
+Fleet-wide timetable generation.
+
+Expands a date range into Schedule rows (one per round trip, bookable on the
+outbound leg) and BusSchedule rows (one per bus per day) for the whole fleet.
+Active buses are paired with drivers one to one and the crews are dealt out
+over the routes in id order, so a route always gets the same crews no matter
+which routes a run was asked to generate. Each crew runs back-to-back round
+trips of `2 * duration + turnaround_time + buffer_time` hours, as many as
+`Route.calculate_trips_per_day` allows; the crews on one route are staggered
+across that cycle to spread the departures evenly.
+
+Rows that would break Schedule's unique_together constraints, or that already
+exist, are skipped in memory, and everything is written with bulk_create, so
+re-running a range is safe and only fills the gaps. Before anything is
+written the generated shifts are checked for overlaps, and a crew-day is
+left out when its shift overlaps an assignment the bus already has (see
+conflicts.py) or a saved trip of its bus or its driver, other than the
+trips an earlier run generated for that same crew-day.
+
+Two limits: crews are dealt out the same way every day, with no rotation or
+rest rules across days, and only the outbound leg of each round trip becomes
+a Schedule row (the return leg is counted in the shift but not bookable).
+"""
+from collections import defaultdict, namedtuple
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from operations.facts import refresh_daily_performance
+from routes.models import Route
+from .conflicts import blocked_days, sweep
+from .models import Bus, BusSchedule, Schedule
+from .stoptimes import rebuild_stop_times
+from .timetable import timetable_cache
+from .trips import current_trips
+
+BULK_BATCH_SIZE = 500
+
+GenerationResult = namedtuple('GenerationResult', [
+    'schedules', 'assignments', 'skipped', 'conflicts', 'idle_buses', 'crews',
+])
+# A saved Schedule trip, placed on the same timeline as the generated shifts
+SavedTrip = namedtuple('SavedTrip', ['date', 'start_time', 'end_time'])
+
+
+def fleet_crews():
+    """Active buses paired with active drivers in id order; returns (crews, buses left without a driver)"""
+    buses = list(Bus.objects.filter(is_active=True).order_by('id'))
+    drivers = list(get_user_model().objects.filter(role='driver', is_active=True).order_by('id'))
+    return list(zip(buses, drivers)), buses[len(drivers):]
+
+
+def allocate_crews(crews, routes):
+    """Deal crews out over routes round-robin: {route_id: [(bus, driver), ...]}"""
+    allocation = {route.id: [] for route in routes}
+    for position, crew in enumerate(crews):
+        allocation[routes[position % len(routes)].id].append(crew)
+    return allocation
+
+
+def add_hours(day, clock, hours):
+    return datetime.combine(day, clock) + timedelta(hours=float(hours))
+
+
+def crew_day(route, day, first_departure, operational_hours, stagger):
+    """(departure, arrival) datetimes of one crew's round trips on a day; none run past midnight"""
+    cycle = float(route.duration * 2 + route.turnaround_time + route.buffer_time)
+    if cycle <= 0:
+        return []
+    midnight = datetime.combine(day + timedelta(days=1), time.min)
+    trips = []
+    # Route durations are Decimals; a float from the command line can't be divided by them
+    for trip in range(route.calculate_trips_per_day(Decimal(str(operational_hours)))):
+        departure = add_hours(day, first_departure, stagger * cycle + trip * cycle)
+        departure = departure.replace(second=0, microsecond=0)
+        if departure + timedelta(hours=cycle) > midnight:
+            break
+        trips.append((departure, departure + timedelta(hours=float(route.duration))))
+    return trips
+
+
+def busy_crew_days(shifts, saved_trips):
+    """(bus_id, date) of generated shifts that overlap a saved trip of the same bus or driver.
+
+    `shifts` are (driver_id, BusSchedule, trip keys) per crew-day and
+    `saved_trips` (bus_id, driver_id, route_id, date, departure_time,
+    arrival_time) rows. Saved trips whose key is one of the shift's own trips
+    were written by an earlier run and don't count.
+    """
+    own = set()
+    timelines = defaultdict(list)
+    for driver_id, shift, keys in shifts:
+        own.update(keys)
+        timelines[('bus', shift.bus_id)].append((True, shift))
+        timelines[('driver', driver_id)].append((True, shift))
+    for bus_id, driver_id, route_id, day, departure, arrival in saved_trips:
+        if (bus_id, driver_id, route_id, day, departure) in own:
+            continue
+        trip = SavedTrip(day, departure, arrival)
+        for key in (('bus', bus_id), ('driver', driver_id)):
+            if key in timelines:
+                timelines[key].append((False, trip))
+
+    busy = set()
+    for timeline in timelines.values():
+        if len(timeline) > 1:
+            for pair in sweep(timeline):
+                busy.update((item.bus_id, item.date) for item in pair if isinstance(item, BusSchedule))
+    return busy
+
+
+def generate_fleet_schedules(start_date, end_date, routes=None, first_departure=time(6, 0),
+                             operational_hours=15, dry_run=False):
+    """Create Schedule/BusSchedule rows for every day from start_date to end_date inclusive.
+
+    `routes` limits the output to some routes (crews are still allocated over
+    the whole network). Returns a GenerationResult of counts.
+    """
+    all_routes = list(Route.objects.order_by('id'))
+    crews, idle_buses = fleet_crews()
+    if not all_routes or not crews:
+        return GenerationResult(0, 0, 0, 0, len(idle_buses), len(crews))
+    allocation = allocate_crews(crews, all_routes)
+    wanted = {route.id for route in routes} if routes is not None else None
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+    # Everything the new rows could collide with, loaded once; a day either side for overnight trips
+    existing = list(Schedule.objects.filter(
+        date__range=(start_date - timedelta(days=1), end_date + timedelta(days=1)),
+    ).values_list('bus_id', 'driver_id', 'route_id', 'date', 'departure_time', 'arrival_time'))
+    taken_by_bus = {(bus_id, day, departure) for bus_id, _, _, day, departure, _ in existing}
+    taken_by_driver = {(driver_id, day, departure) for _, driver_id, _, day, departure, _ in existing}
+    assigned = set(BusSchedule.objects.filter(date__range=(start_date, end_date)).values_list(
+        'bus_id', 'route_id', 'date', 'start_time'))
+
+    crew_days, shifts, assignments = [], [], []
+    for route in all_routes:
+        if wanted is not None and route.id not in wanted:
+            continue
+        route_crews = allocation[route.id]
+        for position, (bus, driver) in enumerate(route_crews):
+            stagger = position / len(route_crews)
+            for day in days:
+                trips = crew_day(route, day, first_departure, operational_hours, stagger)
+                if not trips:
+                    continue
+                crew_days.append((route, bus, driver, day, trips))
+
+                start_time = trips[0][0].time()
+                back_at = trips[-1][0] + timedelta(hours=float(route.duration * 2 + route.turnaround_time))
+                end_time = back_at.replace(second=0, microsecond=0).time()
+                shift = BusSchedule(bus=bus, route=route, date=day, start_time=start_time, end_time=end_time)
+                shifts.append((driver.id, shift, [
+                    (bus.id, driver.id, route.id, day, departure.time()) for departure, _ in trips
+                ]))
+                if (bus.id, route.id, day, start_time) not in assigned:
+                    assigned.add((bus.id, route.id, day, start_time))
+                    assignments.append(shift)
+
+    # A bus or driver already busy elsewhere during a generated shift keeps that day free
+    blocked = blocked_days(assignments) | busy_crew_days(shifts, existing)
+    assignments = [
+        assignment for assignment in assignments if (assignment.bus_id, assignment.date) not in blocked
+    ]
+
+    schedules, skipped = [], 0
+    for route, bus, driver, day, trips in crew_days:
+        if (bus.id, day) in blocked:
+            continue
+        for departure, arrival in trips:
+            bus_key = (bus.id, day, departure.time())
+            driver_key = (driver.id, day, departure.time())
+            if bus_key in taken_by_bus or driver_key in taken_by_driver:
+                skipped += 1
+                continue
+            taken_by_bus.add(bus_key)
+            taken_by_driver.add(driver_key)
+            schedules.append(Schedule(
+                route=route, bus=bus, driver=driver, date=day,
+                departure_time=departure.time(), arrival_time=arrival.time(),
+                total_seats=bus.capacity, available_seats=bus.capacity,
+            ))
+
+    if not dry_run:
+        with transaction.atomic():
+            Schedule.objects.bulk_create(schedules, batch_size=BULK_BATCH_SIZE)
+            BusSchedule.objects.bulk_create(assignments, batch_size=BULK_BATCH_SIZE)
+        # bulk_create sends no post_save, so do what the Schedule signals would have done
+        rebuild_stop_times(schedules)
+        refresh_daily_performance({(assignment.date, assignment.route_id) for assignment in assignments})
+        timetable_cache.invalidate_routes({schedule.route_id for schedule in schedules})
+        for bus_id in {schedule.bus_id for schedule in schedules}:
+            current_trips.invalidate(bus_id)
+
+    return GenerationResult(len(schedules), len(assignments), skipped, len(blocked), len(idle_buses), len(crews))
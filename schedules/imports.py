@@ -0,0 +1,127 @@
+"""
+Bulk import of bus assignments (BusSchedule) from CSV.
+
+The file is read row by row and handled in chunks of IMPORT_CHUNK_SIZE rows,
+so memory stays flat however long the file is. For each chunk the bus plates
+and route numbers not seen yet are resolved with one query each, rows are
+parsed and validated, overlaps are checked in one pass (see conflicts.py)
+against saved assignments and the rest of the chunk, and the valid rows are
+written with one bulk_create. Later chunks see the rows saved by earlier
+ones, so overlaps anywhere in the file are caught.
+
+Expected columns: bus (number plate), route (number), date (YYYY-MM-DD),
+start_time and end_time (HH:MM). Invalid rows are skipped and reported with
+their line number; the valid rows are imported.
+"""
+import csv
+from collections import namedtuple
+
+from django.utils.dateparse import parse_date, parse_time
+
+from operations.facts import refresh_daily_performance
+from routes.models import Route
+from .conflicts import describe, find_conflicts
+from .models import Bus, BusSchedule
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_COLUMNS = ('bus', 'route', 'date', 'start_time', 'end_time')
+# Errors kept for the report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+ImportResult = namedtuple('ImportResult', ['created', 'error_count', 'errors'])
+
+
+class AssignmentImport:
+    def __init__(self):
+        self.buses = {}
+        self.routes = {}
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def resolve(self, rows):
+        """Load the buses and routes a chunk mentions that earlier chunks didn't"""
+        # DictReader fills the missing fields of a short row with None
+        plates = {(row.get('bus') or '').strip() for _, row in rows} - set(self.buses)
+        numbers = {(row.get('route') or '').strip() for _, row in rows} - set(self.routes)
+        if plates:
+            self.buses.update(Bus.objects.filter(number_plate__in=plates).values_list('number_plate', 'id'))
+        if numbers:
+            self.routes.update(Route.objects.filter(number__in=numbers).values_list('number', 'id'))
+
+    def parse(self, line, row):
+        """Unsaved BusSchedule for one CSV row, or None after reporting why it is invalid"""
+        bus_id = self.buses.get((row.get('bus') or '').strip())
+        route_id = self.routes.get((row.get('route') or '').strip())
+        try:
+            day = parse_date((row.get('date') or '').strip())
+            start_time = parse_time((row.get('start_time') or '').strip())
+            end_time = parse_time((row.get('end_time') or '').strip())
+        except ValueError:
+            day = start_time = end_time = None
+
+        if bus_id is None:
+            self.error(line, f"Unknown bus '{row.get('bus')}'")
+        elif route_id is None:
+            self.error(line, f"Unknown route '{row.get('route')}'")
+        elif day is None or start_time is None or end_time is None:
+            self.error(line, 'date must be YYYY-MM-DD and start_time/end_time HH:MM')
+        else:
+            assignment = BusSchedule(bus_id=bus_id, route_id=route_id, date=day, start_time=start_time, end_time=end_time)
+            assignment.line = line
+            return assignment
+        return None
+
+    def import_chunk(self, rows):
+        self.resolve(rows)
+        assignments = [assignment for assignment in (self.parse(line, row) for line, row in rows) if assignment]
+
+        # Keep the earlier line when two new rows overlap (a saved row always wins),
+        # and don't hold a row against one that was itself rejected
+        overlaps = []
+        for conflict in find_conflicts(assignments):
+            new = [item for item in (conflict.first, conflict.second) if item.pk is None]
+            loser = max(new, key=lambda item: item.line)
+            winner = next((item for item in (conflict.first, conflict.second) if item is not loser))
+            overlaps.append((loser.line, getattr(winner, 'line', None), conflict))
+        rejected = set()
+        for line, other, conflict in sorted(overlaps, key=lambda overlap: overlap[0]):
+            if line not in rejected and other not in rejected:
+                rejected.add(line)
+                self.error(line, describe(conflict))
+
+        valid = [assignment for assignment in assignments if assignment.line not in rejected]
+        BusSchedule.objects.bulk_create(valid)
+        # bulk_create skips the signals that keep the daily performance facts current
+        refresh_daily_performance({(assignment.date, assignment.route_id) for assignment in valid})
+        self.created += len(valid)
+
+    def run(self, lines, chunk_size=IMPORT_CHUNK_SIZE):
+        reader = csv.DictReader(lines)
+        missing = set(IMPORT_COLUMNS) - set(reader.fieldnames or ())
+        if missing:
+            self.error(1, f"Missing column(s): {', '.join(sorted(missing))}")
+            return self.result()
+
+        chunk = []
+        for row in reader:
+            chunk.append((reader.line_num, row))
+            if len(chunk) >= chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self.result()
+
+    def result(self):
+        return ImportResult(self.created, self.error_count, self.errors)
+
+
+def import_assignments(lines, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import BusSchedule rows from an iterable of CSV lines; returns an ImportResult"""
+    return AssignmentImport().run(lines, chunk_size)
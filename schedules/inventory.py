@@ -0,0 +1,176 @@
+"""
+Hot seat-availability counters keyed by schedule id.
+
+Availability is read far more often than it changes, so readers (schedule
+lists, nearby buses, bus details) take `available_seats` from this
+in-process map instead of the database. The booking path and Schedule
+saves write the new counts straight into it. Each counter remembers the
+`updated_at` of the row it came from, so a row loaded later that is newer
+(a booking made by another process) replaces it as soon as it is read. Every
+SEAT_INVENTORY_RECONCILE_SECONDS the tracked counters are compared with
+`Schedule.available_seats` in bulk. Any drift (bookings made by another
+process, queryset updates that bypass the booking path) is logged and
+repaired, and counters for past departures are dropped.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Ids per reconciliation query, well under SQLite's bound-parameter limit
+RECONCILE_CHUNK = 500
+
+
+class SeatInventory:
+    """schedule_id -> seats left, with periodic reconciliation against the database"""
+
+    def __init__(self, reconcile_seconds=30):
+        self.reconcile_seconds = reconcile_seconds
+        # schedule_id -> [available_seats, date, generation of the last write, row updated_at]
+        self._seats = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._reconcile_lock = threading.Lock()
+        self._reconciled_at = None
+        self.last_drift = []
+
+    def _write(self, schedule_id, available_seats, day, updated_at=None):
+        self._generation += 1
+        self._seats[schedule_id] = [available_seats, day, self._generation, updated_at]
+
+    @staticmethod
+    def _is_newer(updated_at, entry):
+        return updated_at is not None and (entry[3] is None or updated_at > entry[3])
+
+    def record(self, schedule_id, available_seats, day, updated_at=None):
+        """Authoritative count, e.g. from a saved Schedule"""
+        with self._lock:
+            self._write(schedule_id, available_seats, day, updated_at)
+
+    def record_booking(self, schedule_id, available_seats, day=None, updated_at=None):
+        """Count read back after a booking; bookings only ever lower it"""
+        with self._lock:
+            entry = self._seats.get(schedule_id)
+            if entry is None:
+                self._write(schedule_id, available_seats, day, updated_at)
+            elif available_seats < entry[0] or self._is_newer(updated_at, entry):
+                self._write(schedule_id, available_seats, entry[1] or day, updated_at)
+
+    def discard(self, schedule_id):
+        with self._lock:
+            self._seats.pop(schedule_id, None)
+
+    def observe(self, schedule):
+        """Seats left on a Schedule just loaded from the database.
+
+        Seeds the counter if untracked, and refreshes it if the row was saved
+        after the count the counter holds.
+        """
+        self._reconcile_if_due()
+        with self._lock:
+            entry = self._seats.get(schedule.id)
+            if entry is None or self._is_newer(schedule.updated_at, entry):
+                self._write(schedule.id, schedule.available_seats, schedule.date, schedule.updated_at)
+                return schedule.available_seats
+            return entry[0]
+
+    def seats(self, schedule_ids):
+        """Map schedule ids to seats left; untracked ids are loaded with one query"""
+        from .models import Schedule
+
+        self._reconcile_if_due()
+        with self._lock:
+            found = {
+                schedule_id: self._seats[schedule_id][0]
+                for schedule_id in schedule_ids if schedule_id in self._seats
+            }
+        missing = [schedule_id for schedule_id in schedule_ids if schedule_id not in found]
+        if missing:
+            for schedule_id, available_seats, day, updated_at in Schedule.objects.filter(
+                    id__in=missing).values_list('id', 'available_seats', 'date', 'updated_at'):
+                with self._lock:
+                    if schedule_id not in self._seats:
+                        self._write(schedule_id, available_seats, day, updated_at)
+                    found[schedule_id] = self._seats[schedule_id][0]
+        return found
+
+    def is_due(self):
+        return self._reconciled_at is None or time.monotonic() - self._reconciled_at > self.reconcile_seconds
+
+    def _reconcile_if_due(self):
+        if self.is_due() and self._reconcile_lock.acquire(blocking=False):
+            # Only one reader pays for reconciliation; the rest keep serving counters
+            try:
+                self.reconcile()
+            finally:
+                self._reconcile_lock.release()
+
+    def reconcile(self):
+        """Compare every tracked counter with the database and repair drift.
+
+        Returns [(schedule_id, cached, actual)] for the counters that had
+        drifted; actual is None for schedules that no longer exist.
+        """
+        from .models import Schedule
+
+        today = timezone.localdate()
+        with self._lock:
+            # Departures in the past are not read any more
+            for schedule_id in [key for key, entry in self._seats.items() if entry[1] and entry[1] < today]:
+                del self._seats[schedule_id]
+            snapshot = {schedule_id: (entry[0], entry[2]) for schedule_id, entry in self._seats.items()}
+
+        actual = {}
+        ids = list(snapshot)
+        for start in range(0, len(ids), RECONCILE_CHUNK):
+            actual.update(
+                (schedule_id, (available_seats, day, updated_at))
+                for schedule_id, available_seats, day, updated_at in Schedule.objects.filter(
+                    id__in=ids[start:start + RECONCILE_CHUNK]
+                ).values_list('id', 'available_seats', 'date', 'updated_at')
+            )
+
+        drift = []
+        with self._lock:
+            for schedule_id, (cached, generation) in snapshot.items():
+                entry = self._seats.get(schedule_id)
+                if entry is None or entry[2] != generation:
+                    # Written after the snapshot; that write is newer than what we read
+                    continue
+                if schedule_id not in actual:
+                    drift.append((schedule_id, cached, None))
+                    del self._seats[schedule_id]
+                elif actual[schedule_id][0] != cached:
+                    drift.append((schedule_id, cached, actual[schedule_id][0]))
+                    self._write(schedule_id, *actual[schedule_id])
+                else:
+                    # Counters seeded by a booking don't know their departure date yet
+                    entry[1] = entry[1] or actual[schedule_id][1]
+                    entry[3] = actual[schedule_id][2]
+            self._reconciled_at = time.monotonic()
+            self.last_drift = drift
+
+        if drift:
+            logger.warning('Seat inventory drifted on %d schedules; repaired from the database', len(drift))
+        return drift
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked': len(self._seats),
+                'reconcile_seconds': self.reconcile_seconds,
+                'seconds_since_reconcile': (
+                    round(time.monotonic() - self._reconciled_at, 1) if self._reconciled_at is not None else None
+                ),
+                'last_drift': [
+                    {'schedule_id': schedule_id, 'cached': cached, 'actual': actual}
+                    for schedule_id, cached, actual in self.last_drift
+                ],
+            }
+
+
+seat_inventory = SeatInventory(getattr(settings, 'SEAT_INVENTORY_RECONCILE_SECONDS', 30))
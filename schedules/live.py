@@ -0,0 +1,267 @@
+"""
+Write-behind store for live bus positions.
+
+GPS ingest writes into this in-process store instead of the `schedules_bus`
+row. A background flusher persists only the latest position of each bus to
+`Bus.current_latitude/current_longitude/last_location_update` every
+LIVE_POSITION_FLUSH_INTERVAL seconds with one bulk UPDATE. Positions that
+fail to flush stay pending and are retried on the next cycle. A final flush
+runs at interpreter exit, so graceful restarts lose nothing. A worker that
+crashes or is killed with SIGKILL loses the fixes it hadn't flushed: at most
+one flush interval of live positions, which the trajectory files still hold.
+
+Every worker process has its own store and grid. Before a grid read, at most
+once every BUS_GRID_CATCH_UP_SECONDS, the store runs one query for Bus rows
+stamped after the newest position it has seen (less a margin of two flush
+intervals), so fixes flushed by other workers show up within about one flush
+interval. The full reload every
+BUS_GRID_RESYNC_SECONDS also catches buses that stopped running, and
+uploads stamped earlier than the margin.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .eta import eta_engine
+from .feed import live_feed
+from .spatial import bus_index, running_bus_positions
+
+logger = logging.getLogger(__name__)
+
+COORDINATE_PLACES = Decimal('0.00000001')
+
+LivePosition = namedtuple('LivePosition', ['latitude', 'longitude', 'timestamp', 'route_id'])
+
+
+def to_coordinate(value):
+    """Round a coordinate the same way the Bus decimal fields store it"""
+    return Decimal(str(value)).quantize(COORDINATE_PLACES)
+
+
+class LivePositionStore:
+    """Latest position per bus, flushed to the database in the background"""
+
+    def __init__(self, index, flush_interval=5, catch_up_seconds=1):
+        self.index = index
+        self.flush_interval = flush_interval
+        self.catch_up_seconds = catch_up_seconds
+        self._positions = {}
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        # Newest last_location_update read back from the database
+        self._synced_until = None
+        self._caught_up_at = None
+
+    def record(self, bus_id, latitude, longitude, timestamp, route_id=None, trips=None):
+        """Accept a fix for a bus; returns False if it is older than what we have.
+
+        `trips` optionally maps bus ids to their already resolved current trip
+        (see EtaEngine.update).
+        """
+        position = LivePosition(to_coordinate(latitude), to_coordinate(longitude), timestamp, route_id)
+        with self._lock:
+            current = self._positions.get(bus_id)
+            if current and current.timestamp and timestamp < current.timestamp:
+                return False
+            self._positions[bus_id] = position
+            self._pending[bus_id] = position
+            self.index.update(bus_id, float(position.latitude), float(position.longitude), timestamp)
+        live_feed.publish(bus_id, position)
+        eta_engine.update(bus_id, position.latitude, position.longitude, timestamp, route_id, trips)
+
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_flusher()
+        return True
+
+    def get(self, bus_id):
+        with self._lock:
+            return self._positions.get(bus_id)
+
+    def apply(self, bus):
+        """Overlay the live position on a Bus loaded from the database"""
+        position = self.get(bus.id)
+        if position is None:
+            return bus
+        if bus.last_location_update and position.timestamp <= bus.last_location_update:
+            return bus
+        bus.current_latitude = position.latitude
+        bus.current_longitude = position.longitude
+        bus.last_location_update = position.timestamp
+        bus.is_running = True
+        if position.route_id != bus.current_route_id:
+            bus.current_route_id = position.route_id
+        return bus
+
+    def forget(self, bus_id):
+        """Drop a bus that stopped running; any unflushed fix is discarded"""
+        with self._lock:
+            self._positions.pop(bus_id, None)
+            self._pending.pop(bus_id, None)
+        self.index.remove(bus_id)
+        live_feed.remove(bus_id)
+        eta_engine.forget(bus_id)
+
+    def sync_bus(self, bus):
+        """Mirror a saved Bus into the store and grid (used by the post_save signal)"""
+        if not bus.is_running or bus.current_latitude is None or bus.current_longitude is None:
+            self.forget(bus.id)
+            return
+        position = self.get(bus.id)
+        if position and bus.last_location_update and position.timestamp > bus.last_location_update:
+            # The store already holds a newer fix than the saved row
+            return
+        with self._lock:
+            self._positions.pop(bus.id, None)
+            self._pending.pop(bus.id, None)
+        self.index.sync_bus(bus)
+
+    def bus_ids_on_route(self, route_id):
+        with self._lock:
+            return [bus_id for bus_id, position in self._positions.items() if position.route_id == route_id]
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Persist pending positions with one bulk UPDATE; returns the number written"""
+        from .models import Bus
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            buses = [
+                Bus(
+                    id=bus_id,
+                    current_latitude=position.latitude,
+                    current_longitude=position.longitude,
+                    last_location_update=position.timestamp,
+                    current_route_id=position.route_id,
+                    is_running=True,
+                )
+                for bus_id, position in pending.items()
+            ]
+            try:
+                Bus.objects.bulk_update(buses, [
+                    'current_latitude', 'current_longitude', 'last_location_update',
+                    'current_route', 'is_running'
+                ])
+            except Exception:
+                # Put the batch back unless a newer fix arrived meanwhile
+                with self._lock:
+                    for bus_id, position in pending.items():
+                        if bus_id in self._positions:
+                            self._pending.setdefault(bus_id, position)
+                raise
+            return len(buses)
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='live-position-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._wakeup.wait(self.flush_interval):
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception('Flushing %d live bus positions failed; will retry', self.pending_count())
+
+    def stop(self):
+        """Stop the flusher and write whatever is still pending"""
+        self._wakeup.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Final flush of %d live bus positions failed', self.pending_count())
+
+    def refresh_index(self):
+        """Reload the grid from the database, keeping fixes that haven't been flushed yet"""
+        rows = {row[0]: row for row in running_bus_positions()}
+        synced_until = max((row[3] for row in rows.values() if row[3]), default=None)
+        with self._lock:
+            for bus_id, position in self._positions.items():
+                rows[bus_id] = (bus_id, position.latitude, position.longitude, position.timestamp)
+            self._synced_until = synced_until
+        self.index.load(rows.values())
+
+    def catch_up(self):
+        """Apply positions other processes flushed since the last sync; one query"""
+        from .models import Bus
+
+        buses = Bus.objects.all()
+        if self._synced_until is not None:
+            margin = timedelta(seconds=2 * max(self.flush_interval, 1))
+            buses = buses.filter(last_location_update__gte=self._synced_until - margin)
+        rows = list(buses.filter(last_location_update__isnull=False).values_list(
+            'id', 'current_latitude', 'current_longitude', 'last_location_update', 'is_running'))
+        with self._lock:
+            indexed = self.index.last_updates([row[0] for row in rows])
+            for bus_id, lat, lng, updated_at, is_running in rows:
+                position = self._positions.get(bus_id)
+                if position and position.timestamp >= updated_at:
+                    # This process holds the same or a newer fix
+                    continue
+                if bus_id in indexed and indexed[bus_id] and indexed[bus_id] >= updated_at:
+                    continue
+                if is_running and lat is not None and lng is not None:
+                    self.index.update(bus_id, float(lat), float(lng), updated_at)
+                else:
+                    self.index.remove(bus_id)
+                if self._synced_until is None or updated_at > self._synced_until:
+                    self._synced_until = updated_at
+            self._caught_up_at = time.monotonic()
+
+    def _sync_index(self):
+        if self.index.is_stale():
+            self.refresh_index()
+        elif self._caught_up_at is None or time.monotonic() - self._caught_up_at >= self.catch_up_seconds:
+            self.catch_up()
+
+    def nearby(self, lat, lng, radius_km, updated_after=None):
+        """Ids of buses within radius_km according to the live positions"""
+        self._sync_index()
+        return self.index.nearby(lat, lng, radius_km, updated_after=updated_after)
+
+    def positions(self, updated_after=None):
+        """(ids, lats, lngs) of every running bus according to the live positions"""
+        self._sync_index()
+        return self.index.positions(updated_after=updated_after)
+
+    def last_updates(self, bus_ids):
+        """Map bus ids to the time of their live position (buses not running are left out)"""
+        self._sync_index()
+        return self.index.last_updates(bus_ids)
+
+    def within_bbox(self, min_lat, min_lng, max_lat, max_lng):
+        """Ids of buses inside a bounding box according to the live positions"""
+        self._sync_index()
+        return self.index.within_bbox(min_lat, min_lng, max_lat, max_lng)
+
+
+live_positions = LivePositionStore(
+    bus_index,
+    flush_interval=getattr(settings, 'LIVE_POSITION_FLUSH_INTERVAL', 5),
+    catch_up_seconds=getattr(settings, 'BUS_GRID_CATCH_UP_SECONDS', 1),
+)
+atexit.register(live_positions.stop)
@@ -0,0 +1,59 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from schedules.distance import calculate_distance, distance_matrix, distances_from
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the scalar distance loop against the vectorised distance engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buses', type=int, default=10000, help='Number of synthetic bus positions')
+        parser.add_argument('--points', type=int, default=50, help='Rows of the distance matrix (e.g. stops)')
+        parser.add_argument('--repeat', type=int, default=5, help='Best-of repetitions per measurement')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        buses, points, repeat = options['buses'], options['points'], options['repeat']
+
+        # Synthetic fleet spread over roughly a 100 km square
+        lats = [10 + rng.uniform(-0.5, 0.5) for _ in range(buses)]
+        lngs = [76 + rng.uniform(-0.5, 0.5) for _ in range(buses)]
+        point_lats = [10 + rng.uniform(-0.5, 0.5) for _ in range(points)]
+        point_lngs = [76 + rng.uniform(-0.5, 0.5) for _ in range(points)]
+
+        def best_of(func):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+            return min(timings)
+
+        self.stdout.write(f"📏 {buses} buses, {points} points, best of {repeat}")
+
+        scalar = best_of(lambda: [
+            calculate_distance(point_lats[0], point_lngs[0], lat, lng) for lat, lng in zip(lats, lngs)
+        ])
+        vector = best_of(lambda: distances_from(point_lats[0], point_lngs[0], lats, lngs))
+        self.stdout.write(
+            f"One point -> N buses: loop {scalar * 1000:.2f} ms, numpy {vector * 1000:.2f} ms "
+            f"({scalar / vector:.1f}x)"
+        )
+
+        scalar = best_of(lambda: [
+            [calculate_distance(plat, plng, lat, lng) for lat, lng in zip(lats, lngs)]
+            for plat, plng in zip(point_lats, point_lngs)
+        ])
+        vector = best_of(lambda: distance_matrix(point_lats, point_lngs, lats, lngs))
+        self.stdout.write(
+            f"{points} x N matrix: loop {scalar * 1000:.2f} ms, numpy {vector * 1000:.2f} ms "
+            f"({scalar / vector:.1f}x)"
+        )
+
+        # Both engines must agree before the numbers mean anything
+        expected = [calculate_distance(point_lats[0], point_lngs[0], lat, lng) for lat, lng in zip(lats, lngs)]
+        error = max(abs(a - b) for a, b in zip(expected, distances_from(point_lats[0], point_lngs[0], lats, lngs)))
+        self.stdout.write(f"Max difference between engines: {error:.2e} km")
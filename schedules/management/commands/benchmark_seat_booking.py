@@ -0,0 +1,122 @@
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from schedules.models import Bus, Route, Schedule
+
+BENCH_LABEL = 'BENCH-SEAT'
+
+
+def legacy_book_seat(schedule_id):
+    """The old read-modify-write booking: read the row, decrement in Python, save every column"""
+    schedule = Schedule.objects.get(pk=schedule_id)
+    if schedule.available_seats > 0:
+        schedule.available_seats -= 1
+        schedule.save()
+        return True
+    return False
+
+
+def atomic_book_seat(schedule_id):
+    return Schedule(pk=schedule_id).book_seat()
+
+
+class Command(BaseCommand):
+    help = 'Races hundreds of concurrent bookers on one departure and checks that no seat is oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookers', type=int, default=300, help='Concurrent booking threads')
+        parser.add_argument('--seats', type=int, default=40, help='Seats on the contested departure')
+        parser.add_argument('--legacy', action='store_true',
+                            help='Also run the old read-modify-write booking for comparison')
+
+    def handle(self, *args, **options):
+        bookers, seats = options['bookers'], options['seats']
+        strategies = [('atomic', atomic_book_seat)]
+        if options['legacy']:
+            strategies.insert(0, ('legacy', legacy_book_seat))
+
+        self.stdout.write(f"🎟️  {bookers} concurrent bookers racing for {seats} seats on one departure")
+        route, bus, driver = self.create_fixtures()
+        try:
+            for name, book in strategies:
+                schedule = Schedule.objects.create(
+                    route=route, bus=bus, driver=driver, date=timezone.now().date(),
+                    departure_time=timezone.now().time().replace(microsecond=0),
+                    arrival_time='23:59', total_seats=seats, available_seats=seats,
+                )
+                result = self.race(book, schedule.id, bookers)
+                schedule.refresh_from_db()
+                schedule.delete()
+
+                oversold = result['booked'] - seats
+                line = (
+                    f"{name:>7}: {result['booked']} booked, {result['rejected']} turned away, "
+                    f"{result['errors']} errors, {schedule.available_seats} seats left | "
+                    f"{result['throughput']:.0f} bookings/s, p50 {result['p50'] * 1000:.1f} ms, "
+                    f"p99 {result['p99'] * 1000:.1f} ms"
+                )
+                if oversold > 0:
+                    self.stdout.write(self.style.ERROR(f"{line} | OVERSOLD by {oversold}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"{line} | no overselling"))
+        finally:
+            route.delete()
+            bus.delete()
+            driver.delete()
+
+    def create_fixtures(self):
+        route, _ = Route.objects.get_or_create(
+            number=BENCH_LABEL,
+            defaults={'name': 'Seat booking benchmark', 'origin': 'A', 'destination': 'B', 'total_distance': 10},
+        )
+        bus, _ = Bus.objects.get_or_create(number_plate=BENCH_LABEL)
+        User = get_user_model()
+        driver = User.objects.filter(email='bench-seat@example.com').first()
+        if driver is None:
+            driver = User.objects.create_user(email='bench-seat@example.com', role='driver')
+        return route, bus, driver
+
+    def race(self, book, schedule_id, bookers):
+        """Release every booker at once and collect outcomes and latencies"""
+        start_line = threading.Barrier(bookers + 1)
+        lock = threading.Lock()
+        outcomes = {'booked': 0, 'rejected': 0, 'errors': 0}
+        latencies = []
+
+        def booker():
+            try:
+                start_line.wait()
+                started = time.perf_counter()
+                try:
+                    outcome = 'booked' if book(schedule_id) else 'rejected'
+                except DatabaseError:
+                    # e.g. SQLite "database is locked" after the busy timeout
+                    outcome = 'errors'
+                elapsed = time.perf_counter() - started
+                with lock:
+                    outcomes[outcome] += 1
+                    latencies.append(elapsed)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=booker) for _ in range(bookers)]
+        for thread in threads:
+            thread.start()
+        start_line.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            **outcomes,
+            'throughput': bookers / elapsed,
+            'p50': latencies[len(latencies) // 2] if latencies else 0,
+            'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0,
+        }
@@ -0,0 +1,66 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_time
+
+from schedules.generator import generate_fleet_schedules
+from schedules.models import Route
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates Schedule and BusSchedule rows for the whole fleet over a date range. Crews (bus and driver) '
+        'are dealt out over the routes round-robin, the same way every day, without rotation or rest rules '
+        'across days. Only the outbound leg of each round trip becomes a bookable Schedule. A crew-day whose '
+        'shift overlaps an existing assignment or trip of its bus or driver is skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day (YYYY-MM-DD, default today)')
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--end', help='Last day, inclusive (YYYY-MM-DD)')
+        group.add_argument('--days', type=int, default=7, help='Number of days from --start (default 7)')
+        parser.add_argument('--route', action='append', dest='routes', metavar='NUMBER',
+                            help='Only generate this route (repeatable); crews are still shared over every route')
+        parser.add_argument('--first-departure', default='06:00', help='First departure of the day (HH:MM)')
+        parser.add_argument('--hours', type=float, default=15, help='Operational hours per day (default 15)')
+        parser.add_argument('--dry-run', action='store_true', help='Count the rows without writing them')
+
+    def handle(self, *args, **options):
+        start = parse_date(options['start']) if options['start'] else timezone.localdate()
+        end = parse_date(options['end']) if options['end'] else start + timedelta(days=options['days'] - 1)
+        first_departure = parse_time(options['first_departure'])
+        if start is None or end is None or first_departure is None:
+            raise CommandError('Dates must be YYYY-MM-DD and --first-departure HH:MM')
+        if end < start:
+            raise CommandError('--end is before --start')
+
+        routes = None
+        if options['routes']:
+            routes = list(Route.objects.filter(number__in=options['routes']))
+            unknown = set(options['routes']) - {route.number for route in routes}
+            if unknown:
+                raise CommandError(f"Unknown route(s): {', '.join(sorted(unknown))}")
+
+        self.stdout.write(f"🗓️  Generating schedules from {start} to {end}...")
+        started = time.perf_counter()
+        result = generate_fleet_schedules(
+            start, end, routes=routes, first_departure=first_departure,
+            operational_hours=options['hours'], dry_run=options['dry_run'],
+        )
+        elapsed = time.perf_counter() - started
+
+        if not result.crews:
+            self.stdout.write("❌ Please create some routes, active buses and drivers first!")
+            return
+        if result.conflicts:
+            self.stdout.write(f"⚠️  {result.conflicts} bus-days skipped: the bus or driver is already busy during the shift")
+        if result.idle_buses:
+            self.stdout.write(f"⚠️  {result.idle_buses} active buses have no driver to pair with")
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {verb} {result.schedules} schedules and {result.assignments} bus assignments "
+            f"for {result.crews} crews in {elapsed:.2f}s ({result.skipped} trips already taken)"
+        ))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from schedules.imports import IMPORT_CHUNK_SIZE, import_assignments
+
+
+class Command(BaseCommand):
+    help = 'Imports bus assignments from a CSV file (bus, route, date, start_time, end_time)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE,
+                            help='Rows validated and inserted per batch')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                result = import_assignments(lines, chunk_size=options['chunk_size'])
+        except OSError as exc:
+            raise CommandError(f"Cannot read {options['path']}: {exc}")
+
+        for line, message in result.errors:
+            self.stdout.write(self.style.WARNING(f"⚠️  Line {line}: {message}"))
+        if result.error_count > len(result.errors):
+            self.stdout.write(f"... and {result.error_count - len(result.errors)} more rows skipped")
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Imported {result.created} assignments in {time.perf_counter() - started:.1f}s "
+            f"({result.error_count} rows skipped)"
+        ))
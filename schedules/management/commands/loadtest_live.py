@@ -0,0 +1,414 @@
+import base64
+import http.cookiejar
+import json
+import math
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+
+from schedules.models import Bus
+
+LOADTEST_EMAIL = 'loadtest-driver@example.com'
+LOADTEST_PASSWORD = 'loadtest-driver-pass'
+PLATE_PREFIX = 'LT-'
+# Roughly km per degree of latitude, used to scatter and move simulated buses
+KM_PER_DEGREE = 111.0
+
+
+class ApiClient:
+    """Minimal HTTP client with its own cookie jar (one per simulated user)"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        self.headers = {}
+
+    def request(self, method, path, payload=None, headers=None):
+        """Returns (status, headers, body); HTTP errors are returned, not raised"""
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+        for name, value in {**self.headers, **(headers or {})}.items():
+            request.add_header(name, value)
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers, error.read()
+
+    def login(self, email, password, auth):
+        if auth == 'basic':
+            token = base64.b64encode(f'{email}:{password}'.encode()).decode()
+            self.headers['Authorization'] = f'Basic {token}'
+            return
+        status, _, body = self.request('POST', '/api/login/', {'email': email, 'password': password})
+        if status != 200:
+            raise CommandError(f'Login failed ({status}): {body[:200]!r}')
+        # Session-authenticated POSTs must echo the CSRF cookie back
+        for cookie in self.cookies:
+            if cookie.name == settings.CSRF_COOKIE_NAME:
+                self.headers['X-CSRFToken'] = cookie.value
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(math.ceil(pct / 100 * len(ordered)) - 1, 0))]
+
+
+def summarize_ms(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None, 'mean_ms': None}
+    return {
+        'p50_ms': round(percentile(ordered, 50) * 1000, 2),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 2),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+
+class LatencyRecorder:
+    """Thread-safe latency and status samples per endpoint"""
+
+    def __init__(self):
+        self._samples = {}
+        self._statuses = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, status):
+        # 304 is a successful revalidation, anything else outside 2xx is an error
+        failed = status is None or not (200 <= status < 300 or status == 304)
+        with self._lock:
+            self._samples.setdefault(endpoint, []).append(seconds)
+            key = str(status) if status is not None else 'exception'
+            statuses = self._statuses.setdefault(endpoint, {})
+            statuses[key] = statuses.get(key, 0) + 1
+            self._errors[endpoint] = self._errors.get(endpoint, 0) + failed
+
+    def summary(self, elapsed):
+        with self._lock:
+            endpoints = {}
+            for endpoint, samples in self._samples.items():
+                errors = self._errors.get(endpoint, 0)
+                endpoints[endpoint] = {
+                    'requests': len(samples),
+                    'errors': errors,
+                    'error_rate': round(errors / len(samples), 4),
+                    'throughput_rps': round(len(samples) / elapsed, 2),
+                    'statuses': dict(self._statuses.get(endpoint, {})),
+                    **summarize_ms(samples),
+                }
+            all_samples = [seconds for samples in self._samples.values() for seconds in samples]
+            errors = sum(self._errors.values())
+        totals = {
+            'requests': len(all_samples),
+            'errors': errors,
+            'error_rate': round(errors / len(all_samples), 4) if all_samples else 0,
+            'throughput_rps': round(len(all_samples) / elapsed, 2),
+            **summarize_ms(all_samples),
+        }
+        return endpoints, totals
+
+
+class LockProbe(threading.Thread):
+    """Samples database write-lock contention while the load runs.
+
+    SQLite: time to take the database write lock (BEGIN IMMEDIATE), i.e. how
+    long a writer in the server would queue. Postgres: number of sessions
+    waiting on a lock in pg_stat_activity.
+    """
+
+    def __init__(self, interval, stop):
+        super().__init__(name='loadtest-lock-probe', daemon=True)
+        self.interval = interval
+        self.stop = stop
+        self.vendor = connections['default'].vendor
+        self.waits = []
+        self.waiting_sessions = []
+        self.timeouts = 0
+
+    def run(self):
+        connection = connections['default']
+        try:
+            while not self.stop.wait(self.interval):
+                if self.vendor == 'sqlite':
+                    self._probe_sqlite(connection)
+                elif self.vendor == 'postgresql':
+                    self._probe_postgres(connection)
+        finally:
+            connection.close()
+
+    def _probe_sqlite(self, connection):
+        start = time.perf_counter()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('BEGIN IMMEDIATE')
+                self.waits.append(time.perf_counter() - start)
+                cursor.execute('ROLLBACK')
+        except OperationalError:
+            # "database is locked": the wait exceeded the busy timeout
+            self.timeouts += 1
+
+    def _probe_postgres(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND wait_event_type = 'Lock'"
+            )
+            self.waiting_sessions.append(cursor.fetchone()[0])
+
+    def summary(self):
+        if self.vendor == 'sqlite':
+            return {'database': 'sqlite', 'probes': len(self.waits) + self.timeouts,
+                    'timeouts': self.timeouts, **summarize_ms(self.waits)}
+        if self.vendor == 'postgresql':
+            samples = self.waiting_sessions
+            return {
+                'database': 'postgresql', 'probes': len(samples),
+                'max_waiting_sessions': max(samples, default=0),
+                'mean_waiting_sessions': round(sum(samples) / len(samples), 2) if samples else 0,
+            }
+        return {'database': self.vendor, 'probes': 0}
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the live tracking endpoints of a running server: N drivers post GPS fixes '
+        'while M passengers poll nearby buses and bus details. Creates LT-* buses and a '
+        'loadtest driver in the local database and saves the results as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server under test')
+        parser.add_argument('--spawn-server', action='store_true',
+                            help='Start "manage.py runserver" on the base URL port for the duration of the test')
+        parser.add_argument('--drivers', type=int, default=20, help='Simulated drivers (one bus each)')
+        parser.add_argument('--passengers', type=int, default=50, help='Simulated polling passengers')
+        parser.add_argument('--rate', type=float, default=1.0, help='Location updates per second per driver')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between passenger polls')
+        parser.add_argument('--duration', type=float, default=30.0, help='Test length in seconds')
+        parser.add_argument('--center', default='10.0,76.3', help='lat,lng the fleet is scattered around')
+        parser.add_argument('--spread-km', type=float, default=10.0, help='Radius of the simulated service area')
+        parser.add_argument('--radius', type=float, default=5.0, help='Radius passengers search with')
+        parser.add_argument('--auth', choices=['session', 'basic'], default='session',
+                            help='Driver authentication (basic hashes the password on every request)')
+        parser.add_argument('--conditional', action='store_true',
+                            help='Passengers revalidate with If-None-Match instead of refetching')
+        parser.add_argument('--lock-probe-interval', type=float, default=0.5,
+                            help='Seconds between database lock-wait probes')
+        parser.add_argument('--timeout', type=float, default=10.0, help='Per-request timeout in seconds')
+        parser.add_argument('--output', help='Results file (default: loadtests/live-<timestamp>.json)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            center = tuple(float(value) for value in options['center'].split(','))
+            if len(center) != 2:
+                raise ValueError
+        except ValueError:
+            raise CommandError('--center must be lat,lng')
+        if options['drivers'] < 1 or options['rate'] <= 0 or options['duration'] <= 0:
+            raise CommandError('--drivers, --rate and --duration must be positive')
+
+        bus_ids = self.ensure_fixtures(options['drivers'])
+        self.stdout.write(f"🚌 {len(bus_ids)} LT buses ready, driver {LOADTEST_EMAIL}")
+
+        server = self.spawn_server(options['base_url']) if options['spawn_server'] else None
+        try:
+            self.wait_for_server(options['base_url'], options['timeout'])
+            results = self.run_load(bus_ids, center, options)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+
+        output = Path(options['output'] or settings.BASE_DIR / 'loadtests' /
+                      f"live-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2, default=str))
+
+        self.report(results)
+        self.stdout.write(self.style.SUCCESS(f"✅ Results saved to {output}"))
+
+    def ensure_fixtures(self, count):
+        """A driver account and `count` LT-* buses; reused across runs"""
+        User = get_user_model()
+        driver = User.objects.filter(email=LOADTEST_EMAIL).first()
+        if driver is None:
+            User.objects.create_user(email=LOADTEST_EMAIL, password=LOADTEST_PASSWORD, role='driver')
+        elif driver.role != 'driver' or not driver.check_password(LOADTEST_PASSWORD):
+            driver.role = 'driver'
+            driver.set_password(LOADTEST_PASSWORD)
+            driver.save()
+
+        plates = [f'{PLATE_PREFIX}{number:04d}' for number in range(1, count + 1)]
+        existing = set(Bus.objects.filter(number_plate__in=plates).values_list('number_plate', flat=True))
+        Bus.objects.bulk_create([Bus(number_plate=plate) for plate in plates if plate not in existing])
+        return list(Bus.objects.filter(number_plate__in=plates).order_by('number_plate').values_list('id', flat=True))
+
+    def spawn_server(self, base_url):
+        port = urlparse(base_url).port or 8000
+        self.stdout.write(f"🚀 Starting runserver on 127.0.0.1:{port}")
+        return subprocess.Popen(
+            [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload'],
+            cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    def wait_for_server(self, base_url, timeout, attempts=60):
+        client = ApiClient(base_url, timeout)
+        for _ in range(attempts):
+            try:
+                status, _, _ = client.request('GET', '/api/routes/')
+                if status < 500:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.5)
+        raise CommandError(f'No server answering at {base_url}')
+
+    def run_load(self, bus_ids, center, options):
+        recorder = LatencyRecorder()
+        stop = threading.Event()
+        probe = LockProbe(options['lock_probe_interval'], stop)
+        rng = random.Random(options['seed'])
+        spread = options['spread_km'] / KM_PER_DEGREE
+
+        def timed(endpoint, client, method, path, payload=None, headers=None):
+            start = time.perf_counter()
+            try:
+                status, response_headers, body = client.request(method, path, payload, headers)
+            except OSError:
+                recorder.add(endpoint, time.perf_counter() - start, None)
+                return None, None, None
+            recorder.add(endpoint, time.perf_counter() - start, status)
+            return status, response_headers, body
+
+        def driver(bus_id, client, seed):
+            local = random.Random(seed)
+            lat = center[0] + local.uniform(-spread, spread)
+            lng = center[1] + local.uniform(-spread, spread)
+            interval = 1 / options['rate']
+            next_at = time.perf_counter() + local.uniform(0, interval)
+            while not stop.is_set():
+                delay = next_at - time.perf_counter()
+                if delay > 0 and stop.wait(delay):
+                    break
+                next_at += interval
+                # Drift at city-bus speed (about 30 km/h)
+                step = 30 / 3600 * interval / KM_PER_DEGREE
+                lat += local.uniform(-step, step)
+                lng += local.uniform(-step, step)
+                timed('update-location', client, 'POST', '/api/buses/update-location/',
+                      {'bus_id': bus_id, 'latitude': round(lat, 6), 'longitude': round(lng, 6)})
+
+        def passenger(seed):
+            local = random.Random(seed)
+            client = ApiClient(options['base_url'], options['timeout'])
+            lat = center[0] + local.uniform(-spread, spread)
+            lng = center[1] + local.uniform(-spread, spread)
+            nearby_path = f"/api/buses/nearby/?latitude={lat:.6f}&longitude={lng:.6f}&radius={options['radius']}"
+            etags = {}
+            seen = []
+            stop.wait(local.uniform(0, options['poll_interval']))
+            while not stop.is_set():
+                paths = [('nearby', nearby_path)]
+                if seen:
+                    # Open one of the buses the last search showed, like the app does
+                    paths.append(('bus-details', f'/api/buses/{local.choice(seen)}/'))
+                for endpoint, path in paths:
+                    headers = {'If-None-Match': etags[path]} if options['conditional'] and path in etags else None
+                    status, response_headers, body = timed(endpoint, client, 'GET', path, headers=headers)
+                    if status == 200:
+                        if response_headers.get('ETag'):
+                            etags[path] = response_headers['ETag']
+                        if endpoint == 'nearby':
+                            seen = [bus['id'] for bus in json.loads(body).get('buses', [])]
+                if stop.wait(options['poll_interval']):
+                    break
+
+        # Log every driver in up front so password hashing stays out of the measurements
+        drivers = []
+        for bus_id in bus_ids:
+            client = ApiClient(options['base_url'], options['timeout'])
+            client.login(LOADTEST_EMAIL, LOADTEST_PASSWORD, options['auth'])
+            drivers.append((bus_id, client))
+
+        threads = [
+            threading.Thread(target=driver, args=(bus_id, client, rng.random()), name=f'loadtest-driver-{bus_id}', daemon=True)
+            for bus_id, client in drivers
+        ] + [
+            threading.Thread(target=passenger, args=(rng.random(),), name=f'loadtest-passenger-{number}', daemon=True)
+            for number in range(options['passengers'])
+        ]
+
+        self.stdout.write(
+            f"⏱️  {options['drivers']} drivers at {options['rate']}/s, {options['passengers']} passengers "
+            f"every {options['poll_interval']}s for {options['duration']}s against {options['base_url']}"
+        )
+        started_at = datetime.now().astimezone()
+        start = time.perf_counter()
+        probe.start()
+        for thread in threads:
+            thread.start()
+        stop.wait(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join(options['timeout'] + 1)
+        probe.join(options['timeout'] + 1)
+        elapsed = time.perf_counter() - start
+
+        endpoints, totals = recorder.summary(elapsed)
+        return {
+            'started_at': started_at.isoformat(),
+            'elapsed_seconds': round(elapsed, 2),
+            'config': {
+                key: options[key] for key in (
+                    'base_url', 'drivers', 'passengers', 'rate', 'poll_interval', 'duration',
+                    'center', 'spread_km', 'radius', 'auth', 'conditional', 'seed'
+                )
+            },
+            'database': connections['default'].vendor,
+            'endpoints': endpoints,
+            'totals': totals,
+            'lock_waits': probe.summary(),
+        }
+
+    def report(self, results):
+        self.stdout.write(f"\n{'endpoint':<16}{'req':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'errors':>9}")
+        rows = list(results['endpoints'].items()) + [('total', results['totals'])]
+        for endpoint, stats in rows:
+            self.stdout.write(
+                f"{endpoint:<16}{stats['requests']:>8}{stats['throughput_rps']:>9}"
+                f"{stats['p50_ms'] or 0:>9}{stats['p95_ms'] or 0:>9}{stats['p99_ms'] or 0:>9}"
+                f"{stats['error_rate']:>9.2%}"
+            )
+        locks = results['lock_waits']
+        if locks['database'] == 'sqlite':
+            self.stdout.write(
+                f"\n🔒 SQLite write lock: p50 {locks['p50_ms']} ms, p99 {locks['p99_ms']} ms, "
+                f"max {locks['max_ms']} ms, {locks['timeouts']} timeouts over {locks['probes']} probes"
+            )
+        elif locks['database'] == 'postgresql':
+            self.stdout.write(
+                f"\n🔒 Postgres sessions waiting on locks: max {locks['max_waiting_sessions']}, "
+                f"mean {locks['mean_waiting_sessions']} over {locks['probes']} probes"
+            )
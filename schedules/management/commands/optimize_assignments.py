@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from operations.facts import refresh_daily_performance
+from schedules.conflicts import blocked_days
+from schedules.models import BusSchedule
+from schedules.optimizer import optimize_day
+
+
+class Command(BaseCommand):
+    help = "Plans a day's bus-to-route assignments for the whole fleet within a time budget"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to plan (YYYY-MM-DD, default tomorrow)')
+        parser.add_argument('--budget', type=float, help='Seconds to search for a better plan (default OPTIMIZER_TIME_BUDGET_SECONDS)')
+        parser.add_argument('--seed', type=int, help='Random seed for reproducible plans')
+        parser.add_argument('--apply', action='store_true', help='Save the plan as BusSchedule rows')
+
+    def handle(self, *args, **options):
+        day = parse_date(options['date']) if options['date'] else timezone.localdate() + timedelta(days=1)
+        if day is None:
+            raise CommandError('--date must be YYYY-MM-DD')
+
+        self.stdout.write(f"🧮 Planning bus assignments for {day}...")
+        started = time.perf_counter()
+        optimizer, plan, passes = optimize_day(day, budget_seconds=options['budget'], seed=options['seed'])
+        elapsed = time.perf_counter() - started
+        if not optimizer.buses or not optimizer.routes:
+            self.stdout.write("❌ Please create some routes and active buses first!")
+            return
+
+        summary = plan.summary()
+        if not passes:
+            self.stdout.write(self.style.WARNING("⚠️  The budget ran out before one full pass; the plan is partial"))
+        self.stdout.write(
+            f"✅ Best of {passes} passes in {elapsed:.1f}s: {summary['trips']} trips on {summary['buses_used']} "
+            f"of {len(optimizer.buses)} buses, {summary['idle_minutes']} idle and "
+            f"{summary['deadhead_minutes']} deadhead minutes (cost {summary['cost']})"
+        )
+        if plan.unserved:
+            self.stdout.write(self.style.WARNING(f"⚠️  {len(plan.unserved)} trips could not be covered by the fleet"))
+
+        assignments = plan.assignments(day, optimizer.routes)
+        if not options['apply']:
+            self.stdout.write(f"📋 {len(assignments)} assignments planned; run with --apply to save them")
+            return
+
+        blocked = blocked_days(assignments)
+        saved = [assignment for assignment in assignments if (assignment.bus_id, assignment.date) not in blocked]
+        BusSchedule.objects.bulk_create(saved, batch_size=500)
+        refresh_daily_performance({(assignment.date, assignment.route_id) for assignment in saved})
+        if blocked:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️  {len(blocked)} buses already have overlapping assignments on {day}; their plans were not saved"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"💾 Saved {len(saved)} bus assignments"))
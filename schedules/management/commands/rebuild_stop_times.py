@@ -0,0 +1,38 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from schedules.models import Schedule, StopTime
+from schedules.stoptimes import REBUILD_CHUNK, rebuild_stop_times
+
+
+class Command(BaseCommand):
+    help = 'Re-materializes the stop-time index for a range of days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First day (YYYY-MM-DD, default today)')
+        parser.add_argument('--days', type=int, default=7, help='Number of days to rebuild (default 7)')
+        parser.add_argument('--prune', action='store_true', help='Also delete stop times of days before --from')
+
+    def handle(self, *args, **options):
+        start = parse_date(options['start']) if options['start'] else timezone.localdate()
+        if start is None:
+            raise CommandError('--from must be YYYY-MM-DD')
+        end = start + timedelta(days=options['days'] - 1)
+
+        started = time.perf_counter()
+        self.stdout.write(f"🚏 Rebuilding stop times from {start} to {end}...")
+        written = 0
+        for day in range(options['days']):
+            schedules = Schedule.objects.filter(date=start + timedelta(days=day)).only(
+                'id', 'route_id', 'date', 'departure_time')
+            written += rebuild_stop_times(schedules.iterator(chunk_size=REBUILD_CHUNK))
+        if options['prune']:
+            pruned, _ = StopTime.objects.filter(schedule__date__lt=start).delete()
+            self.stdout.write(f"🧹 Pruned {pruned} stop times before {start}")
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Wrote {written} stop times in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routes", "0003_stop_is_limited_stop"),
+        ("schedules", "0007_remove_bus_current_schedule_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="schedule",
+            index=models.Index(
+                fields=["date", "departure_time", "id"], name="schedule_timetable_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="schedule",
+            index=models.Index(
+                fields=["route", "date", "departure_time", "id"],
+                name="schedule_route_timetable_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routes", "0003_stop_is_limited_stop"),
+        ("schedules", "0008_schedule_timetable_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="busschedule",
+            index=models.Index(fields=["date", "start_time"], name="bus_assignment_day_idx"),
+        ),
+    ]
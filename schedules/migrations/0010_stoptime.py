@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routes", "0003_stop_is_limited_stop"),
+        ("schedules", "0009_busschedule_day_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StopTime",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("date", models.DateField()),
+                ("passing_time", models.TimeField()),
+                ("schedule", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="stop_times", to="schedules.schedule")),
+                ("stop", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="stop_times", to="routes.stop")),
+            ],
+            options={
+                "ordering": ["date", "passing_time"],
+                "indexes": [models.Index(fields=["stop", "date", "passing_time"], name="stop_time_departures_idx")],
+                "unique_together": {("schedule", "stop")},
+            },
+        ),
+    ]
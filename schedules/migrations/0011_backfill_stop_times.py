@@ -0,0 +1,47 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+# Schedules indexed per round of queries
+BACKFILL_CHUNK = 500
+
+
+def backfill_stop_times(apps, schema_editor):
+    # Same rows as schedules.stoptimes.rebuild_stop_times, built with the historical models
+    from schedules.stoptimes import passing_times
+
+    Route = apps.get_model("routes", "Route")
+    Stop = apps.get_model("routes", "Stop")
+    Schedule = apps.get_model("schedules", "Schedule")
+    StopTime = apps.get_model("schedules", "StopTime")
+
+    routes = Route.objects.in_bulk()
+    stops = defaultdict(list)
+    for route_id, stop_id, distance in Stop.objects.values_list("route_id", "id", "distance_from_origin"):
+        stops[route_id].append((stop_id, distance))
+
+    schedules = Schedule.objects.exclude(stop_times__isnull=False).only("id", "route_id", "date", "departure_time")
+    rows = []
+    for schedule in schedules.iterator(chunk_size=BACKFILL_CHUNK):
+        if schedule.route_id not in routes:
+            continue
+        rows.extend(
+            StopTime(schedule_id=schedule.id, stop_id=stop_id, date=day, passing_time=passing_time)
+            for stop_id, day, passing_time in passing_times(schedule, routes[schedule.route_id], stops[schedule.route_id])
+        )
+        if len(rows) >= BACKFILL_CHUNK * 20:
+            StopTime.objects.bulk_create(rows)
+            rows = []
+    StopTime.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routes", "0003_stop_is_limited_stop"),
+        ("schedules", "0010_stoptime"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_stop_times, migrations.RunPython.noop),
+    ]
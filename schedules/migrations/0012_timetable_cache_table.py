@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_timetable_cache_table(apps, schema_editor):
+    # The timetable cache is shared by every process through the database
+    # (see schedules/timetable.py); createcachetable skips a table that already exists
+    cache = settings.CACHES.get(getattr(settings, "TIMETABLE_CACHE_ALIAS", "default"), {})
+    if cache.get("BACKEND") == "django.core.cache.backends.db.DatabaseCache":
+        call_command("createcachetable", cache["LOCATION"], database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("schedules", "0011_backfill_stop_times"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_timetable_cache_table, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,9 @@
 from django.db import models
+from django.db.models import F
 from django.conf import settings
-from routes.models import Route
+from routes.models import Route, Stop
 from django.utils import timezone
+from .inventory import seat_inventory
 
 class Bus(models.Model):
     number_plate = models.CharField(max_length=15, unique=True)
@@ -43,8 +45,12 @@ class Bus(models.Model):
     
     def save(self, *args, **kwargs):
         """Override save to auto-update last_location_update when location changes"""
+        # Callers that write last_location_update themselves don't need the re-read
+        update_fields = kwargs.get('update_fields')
+        location_stamped = update_fields is not None and 'last_location_update' in update_fields
+        
         # Check if this is an update (not a new creation)
-        if self.pk:
+        if self.pk and not location_stamped:
             # Get the original object from database
             try:
                 original = Bus.objects.get(pk=self.pk)
@@ -54,7 +60,7 @@ class Bus(models.Model):
                     self.last_location_update = timezone.now()
             except Bus.DoesNotExist:
                 pass
-        else:
+        elif not self.pk:
             # For new objects, set last_location_update if location is provided
             if self.current_latitude and self.current_longitude:
                 self.last_location_update = timezone.now()
@@ -95,6 +101,11 @@ class Schedule(models.Model):
             ['driver', 'date', 'departure_time']
         ]
         ordering = ['date', 'departure_time']
+        indexes = [
+            # Keyset pagination walks the timetable in (date, departure_time, id) order
+            models.Index(fields=['date', 'departure_time', 'id'], name='schedule_timetable_idx'),
+            models.Index(fields=['route', 'date', 'departure_time', 'id'], name='schedule_route_timetable_idx'),
+        ]
 
     def __str__(self):
         return f"{self.route.number} - {self.date} {self.departure_time} ({self.bus.number_plate})"
@@ -102,12 +113,21 @@ class Schedule(models.Model):
     def is_seat_available(self):
         return self.available_seats > 0
 
-    def book_seat(self):
-        if self.is_seat_available():
-            self.available_seats -= 1
-            self.save()
-            return True
-        return False
+    def book_seat(self, seats=1):
+        """Take seats with a conditional decrement in the database, so concurrent bookings never oversell"""
+        booked = Schedule.take_seats(self.pk, seats)
+        self.refresh_from_db(fields=['available_seats', 'updated_at'])
+        # update() skips post_save, so feed the new count to the seat inventory ourselves
+        seat_inventory.record_booking(self.pk, self.available_seats, self.date, self.updated_at)
+        return booked
+
+    @classmethod
+    def take_seats(cls, schedule_id, seats=1):
+        """UPDATE ... SET available_seats = available_seats - n WHERE available_seats >= n"""
+        return cls.objects.filter(pk=schedule_id, available_seats__gte=seats).update(
+            available_seats=F('available_seats') - seats,
+            updated_at=timezone.now(),
+        ) == 1
 
 
 class BusSchedule(models.Model):
@@ -120,6 +140,10 @@ class BusSchedule(models.Model):
     
     class Meta:
         ordering = ['date', 'start_time']
+        indexes = [
+            # The assignment page and the overlap checks read one date window at a time
+            models.Index(fields=['date', 'start_time'], name='bus_assignment_day_idx'),
+        ]
         verbose_name = 'Bus Assignment'
         verbose_name_plural = 'Bus Assignments'
     
@@ -132,4 +156,24 @@ class BusSchedule(models.Model):
         start = datetime.combine(self.date, self.start_time)
         end = datetime.combine(self.date, self.end_time)
         duration = (end - start).total_seconds() / 3600
-        return round(duration, 1)
\ No newline at end of file
+        return round(duration, 1)
+
+
+class StopTime(models.Model):
+    """When a scheduled trip passes one of its route's stops (derived from Schedule; see stoptimes.py)"""
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, related_name='stop_times')
+    stop = models.ForeignKey(Stop, on_delete=models.CASCADE, related_name='stop_times')
+    # Day and time the bus passes the stop; a trip running past midnight passes later stops the next day
+    date = models.DateField()
+    passing_time = models.TimeField()
+
+    class Meta:
+        unique_together = ['schedule', 'stop']
+        ordering = ['date', 'passing_time']
+        indexes = [
+            # "Next departures from this stop" is a range scan on (stop, date, passing_time)
+            models.Index(fields=['stop', 'date', 'passing_time'], name='stop_time_departures_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.stop.name} {self.date} {self.passing_time} (schedule {self.schedule_id})"
@@ -0,0 +1,275 @@
+"""
+Day plan for the fleet: which bus runs which route when.
+
+A day's demand is a list of trip requirements: round trips leaving a route's
+origin at a given minute, each needing some seats and optionally a service
+type. A bus on a round trip is busy for the route's full cycle
+(2 * duration + turnaround_time + buffer_time) and ends up back at the
+origin. Moving between terminals is deadhead, costed at
+OPTIMIZER_DEADHEAD_MINUTES since terminals are only known by name.
+
+Trips are assigned in departure order with a greedy best fit. For each trip
+the candidates are the buses already waiting at that terminal (the one that
+became free last, i.e. the least idle time), buses at other terminals that
+can deadhead over in time, and an unused bus (highest mileage first). The
+cheapest by idle minutes, deadhead minutes and the fixed cost of bringing
+another bus out wins. The first pass is deterministic; further passes
+perturb the candidate costs at random and the cheapest plan is kept, as long
+as it serves every trip the first pass did on no more buses (noise can trade
+a bus for idle minutes, and the fleet size is what dispatch cares about).
+Passes repeat until the time budget runs out; a randomized pass cut short by
+the deadline is discarded. If even the first pass runs out of time, the trips
+it had planned come back with the rest marked unserved.
+"""
+import bisect
+import math
+import random
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Sum
+from django.db.models.functions import ExtractHour
+
+from routes.models import Route
+from .models import Bus, BusSchedule
+
+# Cost weights, in equivalent minutes
+IDLE_WEIGHT = 1
+DEADHEAD_WEIGHT = 2
+NEW_BUS_COST = 90
+UNSERVED_COST = 10000
+
+# Relative noise applied to candidate costs on the randomized passes
+RESTART_NOISE = 0.35
+
+TripRequirement = namedtuple('TripRequirement', ['route_id', 'departure', 'seats', 'service_type'])
+PlannedTrip = namedtuple('PlannedTrip', ['bus_id', 'route_id', 'departure', 'deadhead'])
+
+
+class RouteCycle(namedtuple('RouteCycle', ['id', 'terminal', 'cycle', 'round_trip'])):
+    """A route's terminal and timings in minutes: busy for `cycle`, back at the terminal after `round_trip`"""
+
+    @classmethod
+    def from_route(cls, route):
+        round_trip = float(route.duration * 2 + route.turnaround_time) * 60
+        return cls(
+            route.id, route.origin.strip().lower(),
+            math.ceil(round_trip + float(route.buffer_time) * 60), math.ceil(round_trip),
+        )
+
+
+class Plan:
+    def __init__(self, trips, unserved, idle, deadhead, buses_used):
+        self.trips = trips
+        self.unserved = unserved
+        self.idle = idle
+        self.deadhead = deadhead
+        self.buses_used = buses_used
+        self.cost = (
+            idle * IDLE_WEIGHT + deadhead * DEADHEAD_WEIGHT
+            + buses_used * NEW_BUS_COST + len(unserved) * UNSERVED_COST
+        )
+
+    def assignments(self, day, routes):
+        """BusSchedule rows (unsaved): one per run of consecutive trips a bus makes on one route"""
+        runs = []
+        by_bus = defaultdict(list)
+        for trip in self.trips:
+            by_bus[trip.bus_id].append(trip)
+        for bus_id, trips in by_bus.items():
+            trips.sort(key=lambda trip: trip.departure)
+            for trip in trips:
+                if runs and runs[-1][0] == bus_id and runs[-1][1] == trip.route_id:
+                    runs[-1][3] = trip.departure
+                else:
+                    runs.append([bus_id, trip.route_id, trip.departure, trip.departure])
+        midnight = datetime.combine(day, datetime.min.time())
+        return [
+            BusSchedule(
+                bus_id=bus_id, route_id=route_id, date=day,
+                start_time=(midnight + timedelta(minutes=first)).time(),
+                end_time=(midnight + timedelta(minutes=min(last + routes[route_id].round_trip, 24 * 60 - 1))).time(),
+            )
+            for bus_id, route_id, first, last in runs
+        ]
+
+    def summary(self):
+        return {
+            'trips': len(self.trips),
+            'unserved': len(self.unserved),
+            'buses_used': self.buses_used,
+            'idle_minutes': self.idle,
+            'deadhead_minutes': self.deadhead,
+            'cost': round(self.cost, 1),
+        }
+
+
+class PassExpired(Exception):
+    def __init__(self, plan):
+        super().__init__()
+        self.plan = plan  # what the pass had planned, the remaining trips unserved
+
+
+class FleetOptimizer:
+    def __init__(self, buses, routes, requirements, deadhead_minutes=30):
+        self.buses = sorted(buses, key=lambda bus: (-float(bus.mileage), bus.capacity, bus.id))
+        self.routes = {route.id: RouteCycle.from_route(route) for route in routes}
+        self.requirements = sorted(
+            (requirement for requirement in requirements if requirement.route_id in self.routes),
+            key=lambda requirement: (requirement.departure, requirement.route_id),
+        )
+        self.deadhead_minutes = deadhead_minutes
+
+    @staticmethod
+    def fits(bus, requirement):
+        if requirement.service_type and bus.service_type != requirement.service_type:
+            return False
+        return bus.capacity >= requirement.seats
+
+    def latest_fitting(self, waiting, limit, requirement, exclude=None):
+        """Index in `waiting` ((ready, bus index) sorted) of the bus free last at or before `limit` that fits"""
+        position = bisect.bisect_right(waiting, (limit, len(self.buses)))
+        while position > 0:
+            position -= 1
+            ready, index = waiting[position]
+            if index != exclude and self.fits(self.buses[index], requirement):
+                return position
+        return None
+
+    def run_pass(self, rng=None, deadline=None):
+        """One greedy pass; raises PassExpired (carrying the partial plan) if the deadline passes first"""
+        unused = list(range(len(self.buses)))
+        at_terminal = defaultdict(list)  # terminal -> sorted [(ready, bus index)]
+        everywhere = []                  # every bus in service -> sorted [(ready, bus index)]
+        location = {}
+        noise = (lambda cost: cost * rng.uniform(1 - RESTART_NOISE, 1 + RESTART_NOISE)) if rng else (lambda cost: cost)
+
+        trips, unserved = [], []
+        idle = deadhead = 0
+        for count, requirement in enumerate(self.requirements):
+            if deadline is not None and count % 256 == 0 and time.monotonic() > deadline:
+                raise PassExpired(Plan(trips, unserved + self.requirements[count:], idle, deadhead, len(location)))
+            route = self.routes[requirement.route_id]
+            departure = requirement.departure
+            candidates = []
+
+            local = at_terminal[route.terminal]
+            position = self.latest_fitting(local, departure, requirement)
+            if position is not None:
+                ready, index = local[position]
+                candidates.append((noise((departure - ready) * IDLE_WEIGHT), index, ready, 0))
+
+            position = self.latest_fitting(
+                everywhere, departure - self.deadhead_minutes, requirement,
+                exclude=candidates[0][1] if candidates else None,
+            )
+            if position is not None:
+                ready, index = everywhere[position]
+                if location[index] != route.terminal:
+                    candidates.append((
+                        noise((departure - ready - self.deadhead_minutes) * IDLE_WEIGHT
+                              + self.deadhead_minutes * DEADHEAD_WEIGHT),
+                        index, ready, self.deadhead_minutes,
+                    ))
+
+            fresh = next((index for index in unused if self.fits(self.buses[index], requirement)), None)
+            if fresh is not None:
+                candidates.append((noise(NEW_BUS_COST), fresh, None, 0))
+
+            if not candidates:
+                unserved.append(requirement)
+                continue
+            _, index, ready, moved = min(candidates, key=lambda candidate: candidate[0])
+            if ready is None:
+                unused.remove(index)
+            else:
+                everywhere.remove((ready, index))
+                at_terminal[location[index]].remove((ready, index))
+                idle += departure - ready - moved
+                deadhead += moved
+
+            ready = departure + route.cycle
+            location[index] = route.terminal
+            bisect.insort(at_terminal[route.terminal], (ready, index))
+            bisect.insort(everywhere, (ready, index))
+            trips.append(PlannedTrip(self.buses[index].id, route.id, departure, moved))
+
+        return Plan(trips, unserved, idle, deadhead, len(location))
+
+    def solve(self, budget_seconds=10, seed=None):
+        """Best plan found within the budget; returns (plan, number of passes completed)"""
+        deadline = time.monotonic() + budget_seconds
+        try:
+            best = greedy = self.run_pass(deadline=deadline)
+        except PassExpired as expired:
+            return expired.plan, 0
+        passes = 1
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            try:
+                plan = self.run_pass(rng, deadline)
+            except PassExpired:
+                break
+            passes += 1
+            if (plan.cost < best.cost and len(plan.unserved) <= len(greedy.unserved)
+                    and plan.buses_used <= greedy.buses_used):
+                best = plan
+        return best, passes
+
+
+def trip_requirements(day, routes, first_departure=6 * 60, operational_hours=15, headway_minutes=60,
+                      seats_per_bus=40):
+    """Round trips each route needs on `day`.
+
+    Every route gets a departure each `headway_minutes` across the service
+    window. Hours with pre-informed passengers get enough extra departures
+    to seat them at `seats_per_bus`, with the passengers spread evenly.
+    """
+    from preinforms.models import PreInform
+
+    demand = defaultdict(int)
+    rows = PreInform.objects.filter(date_of_travel=day, route__in=routes).annotate(
+        hour=ExtractHour('desired_time')).values('route_id', 'hour').annotate(passengers=Sum('passenger_count'))
+    for row in rows:
+        demand[(row['route_id'], row['hour'])] += row['passengers']
+
+    requirements = []
+    window_end = first_departure + operational_hours * 60
+    for route in routes:
+        cycle = RouteCycle.from_route(route).cycle
+        base = defaultdict(list)
+        for departure in range(first_departure, window_end, headway_minutes):
+            if departure + cycle <= 24 * 60:
+                base[departure // 60].append(departure)
+        for hour in sorted(set(base) | {hour for route_id, hour in demand if route_id == route.id}):
+            passengers = demand.get((route.id, hour), 0)
+            count = max(len(base[hour]), math.ceil(passengers / seats_per_bus))
+            if hour * 60 + cycle > 24 * 60 or count == 0:
+                continue
+            departures = base[hour] if len(base[hour]) == count else [
+                hour * 60 + slot * 60 // count for slot in range(count)
+            ]
+            seats = math.ceil(passengers / count)
+            requirements.extend(TripRequirement(route.id, departure, seats, None) for departure in departures)
+    return requirements
+
+
+def optimize_day(day, budget_seconds=None, seed=None):
+    """Plan `day` for the active fleet over every route; returns (optimizer, plan, passes)"""
+    buses = list(Bus.objects.filter(is_active=True))
+    routes = list(Route.objects.all())
+    capacities = sorted(bus.capacity for bus in buses)
+    requirements = trip_requirements(
+        day, routes,
+        headway_minutes=getattr(settings, 'OPTIMIZER_BASE_HEADWAY_MINUTES', 60),
+        seats_per_bus=capacities[len(capacities) // 2] if capacities else 40,
+    )
+    optimizer = FleetOptimizer(
+        buses, routes, requirements, deadhead_minutes=getattr(settings, 'OPTIMIZER_DEADHEAD_MINUTES', 30),
+    )
+    if budget_seconds is None:
+        budget_seconds = getattr(settings, 'OPTIMIZER_TIME_BUDGET_SECONDS', 10)
+    plan, passes = optimizer.solve(budget_seconds, seed=seed)
+    return optimizer, plan, passes
@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination for the schedule timetable.
+
+Pages are walked in (date, departure_time, id) order. The cursor is the key
+of the last row served, and the next page is "rows after that key", so
+every page is a short range scan on the timetable indexes. Its cost does not
+grow with the page number or the size of the table, unlike OFFSET-based
+paging.
+"""
+import base64
+import json
+from datetime import date, time
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ScheduleKeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('date', 'departure_time', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'SCHEDULE_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'SCHEDULE_MAX_PAGE_SIZE', 200)
+
+    def get_page_size(self, request):
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(requested, 1), self.max_page_size)
+
+    def encode_cursor(self, schedule):
+        key = [schedule.date.isoformat(), schedule.departure_time.isoformat(), schedule.id]
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            day, departure, schedule_id = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            return date.fromisoformat(day), time.fromisoformat(departure), int(schedule_id)
+        except (TypeError, ValueError, OverflowError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            day, departure, schedule_id = cursor
+            # (date, departure_time, id) > cursor; the date__gte bound lets the index seek straight to it
+            queryset = queryset.filter(date__gte=day).filter(
+                Q(date__gt=day)
+                | Q(date=day, departure_time__gt=departure)
+                | Q(date=day, departure_time=departure, id__gt=schedule_id)
+            )
+
+        # One extra row tells us whether there is a next page without a COUNT
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        page = rows[:page_size]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -1,6 +1,10 @@
 from rest_framework import serializers
 from .models import Schedule, Bus
+from routes.models import Route
+from django.contrib.auth import get_user_model
 from routes.serializers import RouteSerializer  # We'll use this to nest route info
+from .eta import eta_engine
+from .inventory import seat_inventory
 
 class BusSerializer(serializers.ModelSerializer):
     class Meta:
@@ -22,31 +26,38 @@ class BusLocationSerializer(serializers.ModelSerializer):
         model = Bus
         fields = [
             'id', 'number_plate', 'current_latitude', 'current_longitude',
-            'last_location_update', 'is_running', 'current_route', 'current_schedule'
+            'last_location_update', 'is_running', 'current_route'
         ]
 
 class LiveBusSerializer(serializers.ModelSerializer):
     """Serializer for live bus tracking"""
     route = RouteSerializer(source='current_route', read_only=True)
     schedule = serializers.SerializerMethodField()
+    etas = serializers.SerializerMethodField()
     
     class Meta:
         model = Bus
         fields = [
             'id', 'number_plate', 'capacity', 'current_latitude', 
             'current_longitude', 'last_location_update', 'is_running',
-            'route', 'schedule'
+            'route', 'schedule', 'etas'
         ]
     
+    def get_etas(self, obj):
+        # Precomputed on each location update, so this is only a lookup
+        return eta_engine.bus_etas(obj.id)
+    
     def get_schedule(self, obj):
-        if obj.current_schedule:
+        current_schedule = getattr(obj, 'current_schedule', None)
+        if current_schedule:
+            seats_left = seat_inventory.seats([current_schedule.id])
             return {
-                'id': obj.current_schedule.id,
-                'available_seats': obj.current_schedule.available_seats,
-                'total_seats': obj.current_schedule.total_seats,
-                'departure_time': obj.current_schedule.departure_time,
-                'arrival_time': obj.current_schedule.arrival_time,
-                'date': obj.current_schedule.date
+                'id': current_schedule.id,
+                'available_seats': seats_left.get(current_schedule.id, current_schedule.available_seats),
+                'total_seats': current_schedule.total_seats,
+                'departure_time': current_schedule.departure_time,
+                'arrival_time': current_schedule.arrival_time,
+                'date': current_schedule.date
             }
         return None
 
@@ -55,6 +66,7 @@ class ScheduleSerializer(serializers.ModelSerializer):
     route = RouteSerializer(read_only=True)
     bus = BusLocationSerializer(read_only=True)
     driver = serializers.SerializerMethodField()
+    available_seats = serializers.SerializerMethodField()
 
     class Meta:
         model = Schedule
@@ -68,4 +80,51 @@ class ScheduleSerializer(serializers.ModelSerializer):
             'id': obj.driver.id,
             'name': f"{obj.driver.first_name} {obj.driver.last_name}".strip() or obj.driver.email
         }
-        
\ No newline at end of file
+        
+    
+    def get_available_seats(self, obj):
+        # Bookings land in the seat inventory first; the row may already be behind
+        return seat_inventory.observe(obj)
+
+
+# Normalized timetable responses (?include=routes,buses,drivers): schedules carry
+# only ids, and each route/bus/driver they reference is serialized once.
+TIMETABLE_INCLUDES = ('routes', 'buses', 'drivers')
+
+
+def schedule_row(schedule, seats_left):
+    """A schedule with its route, bus and driver as ids"""
+    return {
+        'id': schedule.id,
+        'route': schedule.route_id,
+        'bus': schedule.bus_id,
+        'driver': schedule.driver_id,
+        'date': schedule.date.isoformat(),
+        'departure_time': schedule.departure_time.isoformat(),
+        'arrival_time': schedule.arrival_time.isoformat(),
+        'total_seats': schedule.total_seats,
+        'available_seats': seats_left.get(schedule.id, schedule.available_seats),
+    }
+
+
+def side_load(schedules, include):
+    """Each referenced route (with stops), bus and driver once, keyed by id; one or two queries per kind"""
+    included = {}
+    if 'routes' in include:
+        routes = Route.objects.filter(id__in={schedule.route_id for schedule in schedules}).prefetch_related('stops')
+        included['routes'] = {route['id']: route for route in RouteSerializer(routes, many=True).data}
+    if 'buses' in include:
+        buses = Bus.objects.filter(id__in={schedule.bus_id for schedule in schedules})
+        included['buses'] = {bus['id']: bus for bus in BusLocationSerializer(buses, many=True).data}
+    if 'drivers' in include:
+        drivers = get_user_model().objects.filter(
+            id__in={schedule.driver_id for schedule in schedules}
+        ).only('id', 'first_name', 'last_name', 'email')
+        included['drivers'] = {
+            driver.id: {
+                'id': driver.id,
+                'name': f"{driver.first_name} {driver.last_name}".strip() or driver.email
+            }
+            for driver in drivers
+        }
+    return included
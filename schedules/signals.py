@@ -0,0 +1,152 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Bus, Schedule
+from .live import live_positions
+from .trips import current_trips
+from .inventory import seat_inventory
+from .timetable import timetable_cache
+from .stoptimes import rebuild_route_on_commit, rebuild_stop_times
+from .eta import eta_engine
+from routes.models import Route, Stop
+
+
+@receiver(post_save, sender=Bus)
+def index_bus_location(sender, instance, **kwargs):
+    """Keep the live store and spatial grid in step with every saved bus"""
+    live_positions.sync_bus(instance)
+
+
+@receiver(post_delete, sender=Bus)
+def unindex_bus(sender, instance, **kwargs):
+    live_positions.forget(instance.id)
+
+
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+def refresh_current_trip(sender, instance, **kwargs):
+    """A changed timetable may change which trip the bus is running"""
+    current_trips.invalidate(instance.bus_id)
+
+
+@receiver(post_save, sender=Schedule)
+def record_seat_count(sender, instance, **kwargs):
+    seat_inventory.record(instance.id, instance.available_seats, instance.date, instance.updated_at)
+
+
+@receiver(post_delete, sender=Schedule)
+def drop_seat_count(sender, instance, **kwargs):
+    seat_inventory.discard(instance.id)
+
+
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+def refresh_route_etas(sender, instance, **kwargs):
+    eta_engine.invalidate_route(instance.id)
+
+
+@receiver(post_save, sender=Stop)
+@receiver(post_delete, sender=Stop)
+def refresh_stop_etas(sender, instance, **kwargs):
+    eta_engine.invalidate_route(instance.route_id)
+
+
+def schedule_routes(**filters):
+    """Ids of the routes with schedules that match"""
+    return Schedule.objects.filter(**filters).values_list('route_id', flat=True).distinct()
+
+
+@receiver(pre_save, sender=Schedule)
+def remember_timetable(sender, instance, **kwargs):
+    # A schedule moved to another route or day also leaves its old timetable stale
+    instance._previous_timetable = None
+    if instance.pk:
+        instance._previous_timetable = Schedule.objects.filter(pk=instance.pk).values_list('route_id', 'date').first()
+
+
+@receiver(post_save, sender=Schedule)
+def invalidate_schedule_timetable(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_timetable', None)
+    timetable_cache.invalidate([(instance.route_id, instance.date)] + ([previous] if previous else []))
+
+
+@receiver(post_delete, sender=Schedule)
+def invalidate_deleted_schedule_timetable(sender, instance, **kwargs):
+    timetable_cache.invalidate([(instance.route_id, instance.date)])
+
+
+# Position-only saves are overlaid on cached timetables instead
+LOCATION_FIELDS = {'current_latitude', 'current_longitude', 'last_location_update'}
+
+
+@receiver(post_save, sender=Bus)
+def invalidate_bus_timetables(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields and set(update_fields) <= LOCATION_FIELDS):
+        return
+    timetable_cache.invalidate_routes(schedule_routes(bus_id=instance.id))
+
+
+@receiver(post_save, sender=Route)
+def invalidate_route_timetables(sender, instance, created, **kwargs):
+    if not created:
+        timetable_cache.invalidate_routes([instance.id])
+
+
+@receiver(post_save, sender=Stop)
+@receiver(post_delete, sender=Stop)
+def invalidate_stop_timetables(sender, instance, **kwargs):
+    # Stops are nested in every schedule of their route
+    timetable_cache.invalidate_routes([instance.route_id])
+
+
+# Fields that move a schedule's stop times
+STOP_TIME_FIELDS = {'route', 'route_id', 'date', 'departure_time'}
+
+
+@receiver(post_save, sender=Schedule)
+def index_schedule_stop_times(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not set(update_fields) & STOP_TIME_FIELDS:
+        return
+    rebuild_stop_times([instance])
+
+
+# Route and Stop fields that move passing times; renames and the like don't
+ROUTE_TIMING_FIELDS = ('duration', 'total_distance')
+STOP_TIMING_FIELDS = ('route_id', 'sequence', 'distance_from_origin')
+
+
+def saved_values(instance, fields):
+    return instance.__class__.objects.filter(pk=instance.pk).values_list(*fields).first() if instance.pk else None
+
+
+def current_values(instance, fields):
+    return tuple(instance.__class__._meta.get_field(field).to_python(getattr(instance, field)) for field in fields)
+
+
+@receiver(pre_save, sender=Route)
+def remember_route_timing(sender, instance, **kwargs):
+    instance._previous_timing = saved_values(instance, ROUTE_TIMING_FIELDS)
+
+
+@receiver(post_save, sender=Route)
+def reindex_route_stop_times(sender, instance, created, **kwargs):
+    # A new route has no schedules yet; past days are left as they ran
+    previous = getattr(instance, '_previous_timing', None)
+    if not created and previous is not None and previous != current_values(instance, ROUTE_TIMING_FIELDS):
+        rebuild_route_on_commit(instance.id)
+
+
+@receiver(pre_save, sender=Stop)
+def remember_stop_timing(sender, instance, **kwargs):
+    instance._previous_timing = saved_values(instance, STOP_TIMING_FIELDS)
+
+
+@receiver(post_save, sender=Stop)
+def reindex_stop_stop_times(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_timing', None)
+    if previous is None:
+        rebuild_route_on_commit(instance.route_id)
+    elif previous != current_values(instance, STOP_TIMING_FIELDS):
+        rebuild_route_on_commit(instance.route_id)
+        if previous[0] != instance.route_id:
+            # The stop's rows on its old route went with it; rebuild that route too
+            rebuild_route_on_commit(previous[0])
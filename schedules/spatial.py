@@ -0,0 +1,209 @@
+"""
+In-memory spatial grid index for live bus positions.
+
+Running buses are bucketed into fixed-size latitude/longitude cells so a
+radius query only has to look at the cells overlapping the search circle
+instead of the whole fleet.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .distance import EARTH_RADIUS_KM, distances_from
+
+
+class BusGridIndex:
+    """Grid of bus positions keyed by (row, col) cell."""
+
+    def __init__(self, cell_degrees=0.05, resync_seconds=60):
+        self.cell_degrees = cell_degrees
+        self.resync_seconds = resync_seconds
+        self.lng_cells = math.ceil(360 / cell_degrees)
+        self._cells = {}
+        self._positions = {}
+        self._lock = threading.RLock()
+        self._loaded_at = None
+
+    def cell(self, lat, lng):
+        """Grid cell holding a coordinate"""
+        row = math.floor((lat + 90) / self.cell_degrees)
+        col = math.floor((lng + 180) / self.cell_degrees) % self.lng_cells
+        return row, col
+
+    def update(self, bus_id, lat, lng, updated_at):
+        """Insert or move a bus in the grid"""
+        cell = self.cell(lat, lng)
+        with self._lock:
+            previous = self._positions.get(bus_id)
+            if previous and previous[0] != cell:
+                self._discard(bus_id, previous[0])
+            self._cells.setdefault(cell, {})[bus_id] = (lat, lng, updated_at)
+            self._positions[bus_id] = (cell, lat, lng, updated_at)
+
+    def remove(self, bus_id):
+        """Drop a bus from the grid (stopped running or deleted)"""
+        with self._lock:
+            previous = self._positions.pop(bus_id, None)
+            if previous:
+                self._discard(bus_id, previous[0])
+
+    def _discard(self, bus_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.pop(bus_id, None)
+            if not members:
+                del self._cells[cell]
+
+    def sync_bus(self, bus):
+        """Mirror the indexed state of a saved Bus instance"""
+        if bus.is_running and bus.current_latitude is not None and bus.current_longitude is not None:
+            self.update(
+                bus.id, float(bus.current_latitude), float(bus.current_longitude),
+                bus.last_location_update
+            )
+        else:
+            self.remove(bus.id)
+
+    def load(self, rows=None):
+        """Rebuild the grid from (id, lat, lng, updated_at) rows, by default read from the database"""
+        if rows is None:
+            rows = running_bus_positions()
+
+        with self._lock:
+            self._cells = {}
+            self._positions = {}
+            for bus_id, lat, lng, updated_at in rows:
+                self.update(bus_id, float(lat), float(lng), updated_at)
+            self._loaded_at = time.monotonic()
+
+    def is_stale(self):
+        """True before the first load and once the resync interval has passed"""
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.resync_seconds
+
+    def _cell_ranges(self, lat, lng, radius_km):
+        """Rows and columns of every cell that can hold a point within radius_km of (lat, lng)"""
+        angular = radius_km / EARTH_RADIUS_KM
+        lat_rad = math.radians(lat)
+        min_lat = math.degrees(lat_rad - angular)
+        max_lat = math.degrees(lat_rad + angular)
+
+        # Bounding box of a circle on a sphere; fall back to every column near the poles
+        all_columns = min_lat <= -90 or max_lat >= 90
+        if not all_columns:
+            ratio = math.sin(angular) / math.cos(lat_rad)
+            all_columns = ratio >= 1
+        if all_columns:
+            columns = range(self.lng_cells)
+        else:
+            delta_lng = math.degrees(math.asin(ratio))
+            first = math.floor((lng - delta_lng + 180) / self.cell_degrees)
+            last = math.floor((lng + delta_lng + 180) / self.cell_degrees)
+            if last - first + 1 >= self.lng_cells:
+                columns = range(self.lng_cells)
+            else:
+                columns = [col % self.lng_cells for col in range(first, last + 1)]
+
+        rows = range(self.cell(max(min_lat, -90), 0)[0], self.cell(min(max_lat, 90), 0)[0] + 1)
+        return rows, columns
+
+    def bbox_ranges(self, min_lat, min_lng, max_lat, max_lng):
+        """Rows and columns overlapping a bounding box (max_lng < min_lng wraps the antimeridian)"""
+        first_row, first_col = self.cell(min_lat, min_lng)
+        last_row, last_col = self.cell(max_lat, max_lng)
+        if max_lng < min_lng:
+            last_col += self.lng_cells
+        if last_col - first_col + 1 >= self.lng_cells:
+            columns = range(self.lng_cells)
+        else:
+            columns = [col % self.lng_cells for col in range(first_col, last_col + 1)]
+        return range(first_row, last_row + 1), columns
+
+    def within_bbox(self, min_lat, min_lng, max_lat, max_lng):
+        """Ids of indexed buses inside a bounding box"""
+        rows, columns = self.bbox_ranges(min_lat, min_lng, max_lat, max_lng)
+        found = []
+        with self._lock:
+            if len(rows) * len(columns) > len(self._cells):
+                buckets = self._cells.values()
+            else:
+                buckets = (self._cells.get((row, col)) for row in rows for col in columns)
+            for members in buckets:
+                if not members:
+                    continue
+                for bus_id, (lat, lng, updated_at) in members.items():
+                    if in_bbox(lat, lng, min_lat, min_lng, max_lat, max_lng):
+                        found.append(bus_id)
+        return found
+
+    def positions(self, updated_after=None):
+        """(ids, lats, lngs) of every indexed bus, optionally updated after a time"""
+        ids, lats, lngs = [], [], []
+        with self._lock:
+            for bus_id, (cell, lat, lng, updated_at) in self._positions.items():
+                if updated_after is not None and (updated_at is None or updated_at < updated_after):
+                    continue
+                ids.append(bus_id)
+                lats.append(lat)
+                lngs.append(lng)
+        return ids, lats, lngs
+
+    def last_updates(self, bus_ids):
+        """Map each indexed bus id to the time of its position"""
+        with self._lock:
+            return {
+                bus_id: self._positions[bus_id][3]
+                for bus_id in bus_ids if bus_id in self._positions
+            }
+
+    def nearby(self, lat, lng, radius_km, updated_after=None):
+        """Return ids of indexed buses within radius_km, optionally updated after a time"""
+        rows, columns = self._cell_ranges(lat, lng, radius_km)
+        with self._lock:
+            if len(rows) * len(columns) > len(self._cells):
+                # Huge radius: walking the occupied cells is cheaper than the empty grid
+                buckets = self._cells.values()
+            else:
+                buckets = (self._cells.get((row, col)) for row in rows for col in columns)
+            ids, lats, lngs = [], [], []
+            for members in buckets:
+                if not members:
+                    continue
+                for bus_id, (bus_lat, bus_lng, updated_at) in members.items():
+                    if updated_after is not None and (updated_at is None or updated_at < updated_after):
+                        continue
+                    ids.append(bus_id)
+                    lats.append(bus_lat)
+                    lngs.append(bus_lng)
+        if not ids:
+            return []
+        # One vectorised haversine over every candidate in the covered cells
+        inside = distances_from(lat, lng, lats, lngs) <= radius_km
+        return [bus_id for bus_id, keep in zip(ids, inside) if keep]
+
+
+def running_bus_positions():
+    """Positions of every running bus as stored in the database"""
+    from .models import Bus
+
+    return list(Bus.objects.filter(
+        is_running=True,
+        current_latitude__isnull=False,
+        current_longitude__isnull=False,
+    ).values_list('id', 'current_latitude', 'current_longitude', 'last_location_update'))
+
+
+def in_bbox(lat, lng, min_lat, min_lng, max_lat, max_lng):
+    """Point-in-box test that understands boxes crossing the antimeridian"""
+    if not min_lat <= lat <= max_lat:
+        return False
+    if min_lng <= max_lng:
+        return min_lng <= lng <= max_lng
+    return lng >= min_lng or lng <= max_lng
+
+
+bus_index = BusGridIndex(
+    cell_degrees=getattr(settings, 'BUS_GRID_CELL_DEGREES', 0.05),
+    resync_seconds=getattr(settings, 'BUS_GRID_RESYNC_SECONDS', 60),
+)
@@ -0,0 +1,99 @@
+"""
+Materialized stop times: when each scheduled trip passes each stop.
+
+A trip passes a stop `duration * distance_from_origin / total_distance`
+hours after it departs. Rather than deriving that for every schedule on
+every "next departures" request, the result is stored in StopTime and read
+with a range scan on (stop, date, passing_time).
+
+The index follows the timetable incrementally: a saved Schedule rebuilds
+its own rows; a Route whose duration or distance changed, or a Stop that was
+added, moved or re-measured, rebuilds the route's upcoming schedules once
+the transaction commits (once per route, however many rows the save
+touched, e.g. a Route admin page with its stop inline); deleted schedules
+and stops cascade; and bulk writers that skip signals (the schedule
+generator) call rebuild_stop_times themselves. The rebuild_stop_times
+command re-materializes whole days.
+"""
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from routes.models import Route, Stop
+from .models import Schedule, StopTime
+
+REBUILD_CHUNK = 500
+
+# Routes queued for a rebuild on this thread, see rebuild_route_on_commit
+_queued = threading.local()
+
+
+def passing_times(schedule, route, stops):
+    """(stop_id, date, passing_time) for every stop of a schedule's route"""
+    # Freshly created instances may still hold the strings they were given
+    day = Schedule._meta.get_field('date').to_python(schedule.date)
+    departure = datetime.combine(day, Schedule._meta.get_field('departure_time').to_python(schedule.departure_time))
+    total_distance = float(route.total_distance)
+    duration = float(route.duration)
+    rows = []
+    for stop_id, distance in stops:
+        share = min(float(distance) / total_distance, 1.0) if total_distance > 0 else 0.0
+        passing = departure + timedelta(hours=duration * share)
+        rows.append((stop_id, passing.date(), passing.time().replace(microsecond=0)))
+    return rows
+
+
+def rebuild_stop_times(schedules):
+    """Replace the StopTime rows of these schedules (objects or a queryset); returns rows written"""
+    schedules = list(schedules)
+    written = 0
+    for start in range(0, len(schedules), REBUILD_CHUNK):
+        chunk = schedules[start:start + REBUILD_CHUNK]
+        route_ids = {schedule.route_id for schedule in chunk}
+        routes = Route.objects.in_bulk(route_ids)
+        stops = defaultdict(list)
+        for route_id, stop_id, distance in Stop.objects.filter(route_id__in=route_ids).values_list(
+                'route_id', 'id', 'distance_from_origin'):
+            stops[route_id].append((stop_id, distance))
+
+        rows = [
+            StopTime(schedule_id=schedule.id, stop_id=stop_id, date=day, passing_time=passing_time)
+            for schedule in chunk if schedule.route_id in routes
+            for stop_id, day, passing_time in passing_times(schedule, routes[schedule.route_id], stops[schedule.route_id])
+        ]
+        with transaction.atomic():
+            StopTime.objects.filter(schedule_id__in=[schedule.id for schedule in chunk]).delete()
+            StopTime.objects.bulk_create(rows)
+        written += len(rows)
+    return written
+
+
+def rebuild_route(route_id, from_date=None):
+    """Rebuild the stop times of a route's schedules from `from_date` (default today) on"""
+    schedules = Schedule.objects.filter(route_id=route_id, date__gte=from_date or timezone.localdate()).only(
+        'id', 'route_id', 'date', 'departure_time')
+    return rebuild_stop_times(schedules.iterator(chunk_size=REBUILD_CHUNK))
+
+
+def rebuild_route_on_commit(route_id):
+    """Rebuild a route's upcoming stop times after the current transaction commits.
+
+    Every call registers a callback, but the first one to run for a route
+    takes it off the queue, so the route is rebuilt once however many saves
+    asked for it. A rolled back transaction leaves the route queued, which
+    is harmless: the next request for it registers a fresh callback.
+    """
+    queued = getattr(_queued, 'routes', None)
+    if queued is None:
+        queued = _queued.routes = set()
+    queued.add(route_id)
+
+    def rebuild():
+        if route_id in queued:
+            queued.discard(route_id)
+            rebuild_route(route_id)
+
+    transaction.on_commit(rebuild)
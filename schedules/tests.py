@@ -1,3 +1,919 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time as clock
+from collections import defaultdict
+from importlib import import_module
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from routes.models import Route, Stop
+from users.models import CustomUser
+from .eta import eta_engine
+from .generator import crew_day, generate_fleet_schedules
+from .imports import import_assignments
+from .inventory import SeatInventory, seat_inventory
+from .live import LivePositionStore, live_positions
+from .spatial import BusGridIndex, bus_index
+from .booking import reserve_seats
+from .conflicts import blocked_days, find_conflicts
+from .distance import calculate_distance
+from .models import Bus, BusSchedule, Schedule, StopTime
+from .optimizer import FleetOptimizer, PlannedTrip, TripRequirement
+from .timetable import timetable_cache
+from .trajectory import TrajectoryStore, day_window, trajectories
+from .trips import CurrentTripResolver, current_trips
+
+
+class CrewDayTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20,
+                                         duration=Decimal('1.0'), turnaround_time=Decimal('0.25'),
+                                         buffer_time=Decimal('0.25'))
+
+    def test_fractional_hours_from_the_command_line(self):
+        # generate_schedules --hours parses to a float
+        trips = crew_day(self.route, date(2026, 1, 5), time(6, 0), 12.5, 0)
+        self.assertEqual(len(trips), 5)
+        self.assertEqual(trips[0][0].time(), time(6, 0))
+
+
+class GeneratedScheduleConflictTests(TestCase):
+    """Generated crews never overlap each other, saved trips or saved assignments"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.start = date(2026, 1, 5)
+        cls.end = cls.start + timedelta(days=2)
+        # Round trips back at the terminal after 1h45 on route 1 and 2h45 on route 2
+        cls.routes = [
+            Route.objects.create(number=str(number), name=f'Route {number}', origin='A', destination='B',
+                                 total_distance=20, duration=Decimal(duration), turnaround_time=Decimal('0.25'),
+                                 buffer_time=Decimal('0.25'))
+            for number, duration in ((1, '0.75'), (2, '1.25'))
+        ]
+        cls.buses = [Bus.objects.create(number_plate=f'KL-G{number}') for number in range(4)]
+        cls.drivers = [CustomUser.objects.create_user(email=f'driver{number}@example.com', role='driver')
+                       for number in range(4)]
+        spare = Bus.objects.create(number_plate='KL-SPARE', is_active=False)
+        # Bus 0 lent out mid-morning on the first day (to driver 3), driver 1 on the spare bus before dawn on the second
+        cls.saved = [
+            Schedule.objects.create(route=cls.routes[1], bus=cls.buses[0], driver=cls.drivers[3], date=cls.start,
+                                    departure_time=time(10, 10), arrival_time=time(11, 25),
+                                    total_seats=40, available_seats=40),
+            Schedule.objects.create(route=cls.routes[0], bus=spare, driver=cls.drivers[1],
+                                    date=cls.start + timedelta(days=1), departure_time=time(1, 30),
+                                    arrival_time=time(6, 30), total_seats=40, available_seats=40),
+        ]
+        # Bus 2 already assigned elsewhere early on the last day
+        BusSchedule.objects.create(bus=cls.buses[2], route=cls.routes[1], date=cls.end,
+                                   start_time=time(5, 0), end_time=time(7, 30))
+
+    def assert_no_overlaps(self):
+        saved = {schedule.id for schedule in self.saved}
+        windows = defaultdict(list)
+        for schedule in Schedule.objects.select_related('route'):
+            start = datetime.combine(schedule.date, schedule.departure_time)
+            if schedule.id in saved:
+                end = datetime.combine(schedule.date, schedule.arrival_time)
+            else:
+                # A generated trip keeps its crew busy until the bus is back at the terminal
+                route = schedule.route
+                end = start + timedelta(hours=float(route.duration * 2 + route.turnaround_time))
+            windows[('bus', schedule.bus_id)].append((start, end))
+            windows[('driver', schedule.driver_id)].append((start, end))
+        for assignment in BusSchedule.objects.filter(route=self.routes[1], bus=self.buses[2]):
+            windows[('bus', assignment.bus_id)].append((
+                datetime.combine(assignment.date, assignment.start_time),
+                datetime.combine(assignment.date, assignment.end_time),
+            ))
+        for key, spans in windows.items():
+            spans.sort()
+            for (_, first_end), (second_start, _) in zip(spans, spans[1:]):
+                self.assertLessEqual(first_end, second_start, key)
+        self.assertEqual(find_conflicts(BusSchedule.objects.all()), [])
+
+    def test_generated_schedules_do_not_conflict(self):
+        result = generate_fleet_schedules(self.start, self.end)
+        self.assertEqual(result.crews, 4)
+        self.assertGreater(result.schedules, 0)
+        self.assert_no_overlaps()
+        # Bus 0 and driver 3 (crew 3) on the first day, driver 1 (crew 1) on the second, bus 2 on the last
+        skipped = {(self.buses[0].id, self.start), (self.buses[3].id, self.start),
+                   (self.buses[1].id, self.start + timedelta(days=1)), (self.buses[2].id, self.end)}
+        self.assertEqual(result.conflicts, len(skipped))
+        every_day = {(bus.id, self.start + timedelta(days=offset)) for bus in self.buses for offset in range(3)}
+        self.assertEqual(set(BusSchedule.objects.values_list('bus_id', 'date')),
+                         every_day - skipped | {(self.buses[2].id, self.end)})
+        generated = set(Schedule.objects.exclude(id__in=[schedule.id for schedule in self.saved])
+                        .values_list('bus_id', 'date'))
+        self.assertEqual(generated & skipped, set())
+
+        # A rerun finds its own trips and fills nothing new
+        again = generate_fleet_schedules(self.start, self.end)
+        self.assertEqual((again.schedules, again.assignments, again.conflicts), (0, 0, len(skipped)))
+        self.assert_no_overlaps()
+
+
+class AssignmentImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20)
+        Bus.objects.create(number_plate='KL-1', mileage=5)
+
+    def test_malformed_rows_are_reported_not_fatal(self):
+        lines = [
+            'bus,route,date,start_time,end_time',
+            'KL-1,1,2026-01-05,06:00,10:00',
+            'KL-1',
+            ',,,,',
+            'KL-1,1,2026-01-06,25:00,10:00',
+            'KL-1,1,2026-01-07,06:00,10:00',
+        ]
+        result = import_assignments(lines)
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line for line, _ in result.errors], [3, 4, 5])
+        self.assertEqual(BusSchedule.objects.count(), 2)
+
+
+class AssignmentFormTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user(email='admin@example.com', password='pass', role='admin')
+        cls.route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20)
+        cls.bus = Bus.objects.create(number_plate='KL-1', mileage=5)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def post(self, **changes):
+        data = {'bus': self.bus.id, 'route': self.route.id, 'date': '2026-01-05',
+                'start_time': '06:00', 'end_time': '10:00', **changes}
+        return self.client.post(reverse('create-bus-schedule'), data)
+
+    def test_unparseable_fields_are_a_bad_request(self):
+        for changes in ({'date': '2026-02-30'}, {'start_time': '25:00'}, {'end_time': ''},
+                        {'bus': 'x'}, {'route': self.route.id + 1}):
+            with self.subTest(**changes):
+                self.assertEqual(self.post(**changes).status_code, 400)
+        self.assertFalse(BusSchedule.objects.exists())
+
+    def test_valid_and_double_booked_assignments(self):
+        self.assertEqual(self.post().status_code, 302)
+        self.assertEqual(self.post(start_time='09:00', end_time='11:00').status_code, 409)
+        self.assertEqual(BusSchedule.objects.count(), 1)
+
+
+class TrajectoryIngestTests(TestCase):
+    """Uploaded fixes reach the trajectory history exactly once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.driver = CustomUser.objects.create_user(email='driver@example.com', password='pass', role='driver')
+        route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20)
+        cls.bus = Bus.objects.create(number_plate='KL-1', current_route=route)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+        self.flush_interval, live_positions.flush_interval = live_positions.flush_interval, 0
+        history = tempfile.TemporaryDirectory()
+        self.addCleanup(history.cleanup)
+        self.trajectory_root, trajectories.root = trajectories.root, Path(history.name)
+
+    def tearDown(self):
+        live_positions.flush_interval = self.flush_interval
+        trajectories.root = self.trajectory_root
+        live_positions.forget(self.bus.id)
+
+    def test_retried_upload_adds_no_history(self):
+        now = timezone.now()
+        fixes = [
+            {'bus_id': self.bus.id, 'latitude': 10.0, 'longitude': 76.0,
+             'timestamp': (now - timedelta(seconds=30)).isoformat()},
+            {'bus_id': self.bus.id, 'latitude': 10.1, 'longitude': 76.1, 'timestamp': now.isoformat()},
+        ]
+        for attempt in range(2):
+            self.client.post(reverse('update-bus-locations-batch'), {'fixes': fixes}, format='json')
+        points = trajectories.bus_trajectory(self.bus.id, now - timedelta(minutes=1), now + timedelta(minutes=1))
+        self.assertEqual([point[1] for point in points], [10.0, 10.1])
+
+
+class BatchLocationUpdateTests(TestCase):
+    """A batch upload resolves the current trips of all its buses at once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.driver = CustomUser.objects.create_user(email='driver@example.com', password='pass', role='driver')
+        cls.route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20)
+        for sequence in range(1, 4):
+            Stop.objects.create(route=cls.route, name=f'Stop {sequence}', sequence=sequence,
+                                distance_from_origin=(sequence - 1) * 10)
+        cls.buses = [Bus.objects.create(number_plate=f'KL-{number}', current_route=cls.route)
+                     for number in range(50)]
+
+    def setUp(self):
+        current_trips.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+        self.flush_interval, live_positions.flush_interval = live_positions.flush_interval, 0
+        history = tempfile.TemporaryDirectory()
+        self.addCleanup(history.cleanup)
+        self.trajectory_root, trajectories.root = trajectories.root, Path(history.name)
+
+    def tearDown(self):
+        live_positions.flush_interval = self.flush_interval
+        trajectories.root = self.trajectory_root
+        for bus in self.buses:
+            live_positions.forget(bus.id)
+
+    def test_trip_lookups_do_not_grow_with_the_batch(self):
+        now = timezone.now().isoformat()
+        fixes = [{'bus_id': bus.id, 'latitude': 10.0, 'longitude': 76.0, 'timestamp': now} for bus in self.buses]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('update-bus-locations-batch'), {'fixes': fixes}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['updated_buses']), 50)
+        table = Schedule._meta.db_table
+        self.assertEqual(len([query for query in queries if f'FROM "{table}"' in query['sql']]), 1)
+        self.assertEqual(len(eta_engine.bus_etas(self.buses[0].id)), 3)
+
+    def test_unusable_fixes_are_rejected(self):
+        bus = self.buses[0]
+        fixes = [
+            {'bus_id': bus.id, 'latitude': 'nan', 'longitude': 76.0},
+            {'bus_id': bus.id, 'latitude': 10.0, 'longitude': '-inf'},
+            {'bus_id': bus.id, 'latitude': 90.5, 'longitude': 76.0},
+            {'bus_id': bus.id, 'latitude': 10.0, 'longitude': 180.5},
+            {'bus_id': bus.id, 'latitude': 10.0, 'longitude': 76.0, 'timestamp': 1e20},
+            {'bus_id': bus.id, 'latitude': 10.0, 'longitude': 76.0, 'timestamp': -1e20},
+            {'bus_id': bus.id, 'latitude': -90, 'longitude': 180},
+        ]
+        response = self.client.post(reverse('update-bus-locations-batch'), {'fixes': fixes}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry['index'] for entry in response.data['rejected']], [0, 1, 2, 3, 4, 5])
+        self.assertEqual(response.data['updated_buses'], [bus.id])
+        self.assertEqual(live_positions.get(bus.id).latitude, -90)
+
+
+class CurrentTripOvernightTests(TestCase):
+    """Trips that run past midnight belong to the day they departed"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.day = date(2026, 3, 10)
+        driver = CustomUser.objects.create_user(email='driver@example.com', password='pass', role='driver')
+        route = Route.objects.create(number='N1', name='Night 1', origin='A', destination='B', total_distance=20)
+        cls.bus = Bus.objects.create(number_plate='KL-N1')
+        cls.yesterday, cls.today = [
+            Schedule.objects.create(route=route, bus=cls.bus, driver=driver, date=day, departure_time=time(23, 0),
+                                    arrival_time=time(1, 0), total_seats=40, available_seats=40)
+            for day in (cls.day - timedelta(days=1), cls.day)
+        ]
+
+    def at(self, clock):
+        return timezone.make_aware(datetime.combine(self.day, clock))
+
+    def current_trip(self, clock):
+        return CurrentTripResolver().current_trip(self.bus.id, self.at(clock))
+
+    def test_after_midnight_yesterdays_trip_is_running(self):
+        self.assertEqual(self.current_trip(time(0, 30)), self.yesterday)
+
+    def test_before_midnight_todays_trip_is_running(self):
+        self.assertEqual(self.current_trip(time(23, 30)), self.today)
+
+    def test_between_trips_the_next_departure_is_returned(self):
+        self.assertEqual(self.current_trip(time(1, 30)), self.today)
+
+    def test_cached_answer_expires_at_the_arrival(self):
+        resolver = CurrentTripResolver(max_age_seconds=3600)
+        resolver.current_trip(self.bus.id, self.at(time(0, 30)))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.current_trip(self.bus.id, self.at(time(0, 59))), self.yesterday)
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver.current_trip(self.bus.id, self.at(time(1, 1))), self.today)
+
+
+class TrajectoryStoreTests(TestCase):
+    def setUp(self):
+        history = tempfile.TemporaryDirectory()
+        self.addCleanup(history.cleanup)
+        self.store = TrajectoryStore(history.name)
+        self.start, self.end = day_window(date(2026, 5, 1))
+
+    def at(self, minutes):
+        return self.start + timedelta(minutes=minutes)
+
+    def ms(self, minutes):
+        return int(self.at(minutes).astimezone(dt_timezone.utc).timestamp() * 1000)
+
+    def test_reads_come_back_in_time_order(self):
+        self.store.append([(1, self.at(10), 1.0, 2.0, 7), (2, self.at(5), 3.0, 4.0, 7)])
+        # A late fix, and the bus switching routes
+        self.store.append([(1, self.at(1), 5.0, 6.0, 7), (1, self.at(20), 7.0, 8.0, 9)])
+
+        self.assertEqual(self.store.bus_trajectory(1, self.start, self.end), [
+            (self.ms(1), 5.0, 6.0, 7), (self.ms(10), 1.0, 2.0, 7), (self.ms(20), 7.0, 8.0, 9),
+        ])
+        self.assertEqual(self.store.route_trajectories(7, self.start, self.end), {
+            1: [(self.ms(1), 5.0, 6.0), (self.ms(10), 1.0, 2.0)],
+            2: [(self.ms(5), 3.0, 4.0)],
+        })
+        self.assertEqual(self.store.route_trajectories(7, self.at(2), self.at(10)), {2: [(self.ms(5), 3.0, 4.0)]})
+        self.assertEqual(self.store.bus_trajectory(3, self.start, self.end), [])
+
+
+class StopTimeIndexTests(TestCase):
+    """Route and Stop edits rebuild the stop times only when passing times move, once per transaction"""
+
+    @classmethod
+    def setUpTestData(cls):
+        driver = CustomUser.objects.create_user(email='driver@example.com', password='pass', role='driver')
+        cls.route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20,
+                                         duration=Decimal('1.0'))
+        cls.stops = [
+            Stop.objects.create(route=cls.route, name=f'Stop {sequence}', sequence=sequence,
+                                distance_from_origin=(sequence - 1) * 10)
+            for sequence in range(1, 4)
+        ]
+        bus = Bus.objects.create(number_plate='KL-1')
+        day = timezone.localdate() + timedelta(days=1)
+        cls.schedules = [
+            Schedule.objects.create(route=cls.route, bus=bus, driver=driver, date=day, departure_time=time(hour, 0),
+                                    arrival_time=time(hour + 1, 0), total_seats=40, available_seats=40)
+            for hour in (6, 9)
+        ]
+
+    def rebuilds(self, queries):
+        return len([query for query in queries if query['sql'].startswith(f'DELETE FROM "{StopTime._meta.db_table}"')])
+
+    def test_rename_does_not_rebuild(self):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.route.name = 'Renamed'
+            self.route.save()
+            self.stops[0].name = 'Renamed stop'
+            self.stops[0].save()
+        self.assertEqual(self.rebuilds(queries), 0)
+
+    def test_admin_style_save_rebuilds_once(self):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.route.duration = Decimal('2.0')
+                self.route.save()
+                for stop in self.stops:
+                    stop.distance_from_origin += 1
+                    stop.save()
+        self.assertEqual(self.rebuilds(queries), 1)
+        middle_stop = StopTime.objects.get(schedule=self.schedules[0], stop=self.stops[1])
+        self.assertEqual(middle_stop.passing_time, time(7, 6))
+
+    def test_migration_backfills_existing_schedules(self):
+        StopTime.objects.all().delete()
+        migration = import_module('schedules.migrations.0011_backfill_stop_times')
+        migration.backfill_stop_times(apps, None)
+        self.assertEqual(StopTime.objects.count(), len(self.schedules) * len(self.stops))
+
+
+class SeatBookingRaceTests(TransactionTestCase):
+    """Bookers racing for the last seats never oversell a departure"""
+
+    def setUp(self):
+        self.driver = CustomUser.objects.create_user(email='driver@example.com', password='pass', role='driver')
+        self.passenger = CustomUser.objects.create_user(email='rider@example.com', password='pass', role='passenger')
+        route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20)
+        bus = Bus.objects.create(number_plate='KL-1')
+        self.schedule = Schedule.objects.create(route=route, bus=bus, driver=self.driver, date=date(2026, 6, 1),
+                                                departure_time=time(8, 0), arrival_time=time(9, 0),
+                                                total_seats=40, available_seats=3)
+
+    def test_last_seats_go_to_exactly_that_many_bookers(self):
+        bookers = 12
+        start = threading.Barrier(bookers)
+        responses = []
+
+        def book():
+            client = APIClient()
+            client.force_authenticate(self.passenger)
+            start.wait()
+            try:
+                responses.append(client.post(reverse('reserve-schedule-seats'), {
+                    'reservations': [{'schedule_id': self.schedule.id, 'seats': 1}],
+                }, format='json'))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=book) for _ in range(bookers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        winners = [response for response in responses if response.status_code == 200]
+        losers = [response for response in responses if response.status_code != 200]
+        self.assertEqual(len(winners), 3)
+        self.assertEqual(sorted(response.data['reserved'][0]['available_seats'] for response in winners), [0, 1, 2])
+        self.assertEqual({response.status_code for response in losers}, {409})
+        for response in losers:
+            self.assertEqual(response.data['error'], f'Not enough seats left on schedule {self.schedule.id}')
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.available_seats, 0)
+
+
+class TimetableCacheTests(TestCase):
+    """One route's day is served from the shared cache until something it shows changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.day, cls.next_day = date(2026, 6, 1), date(2026, 6, 2)
+        driver = CustomUser.objects.create_user(email='driver@example.com', password='pass', role='driver')
+        cls.route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20)
+        cls.other_route = Route.objects.create(number='2', name='Route 2', origin='B', destination='C',
+                                               total_distance=20)
+        bus = Bus.objects.create(number_plate='KL-1')
+        cls.schedules = {
+            (route.id, day): Schedule.objects.create(route=route, bus=bus, driver=driver, date=day,
+                                                     departure_time=time(hour, 0), arrival_time=time(hour + 1, 0),
+                                                     total_seats=40, available_seats=40)
+            for route, hour in ((cls.route, 8), (cls.other_route, 10)) for day in (cls.day, cls.next_day)
+        }
+
+    def setUp(self):
+        caches[settings.TIMETABLE_CACHE_ALIAS].clear()
+        for schedule in self.schedules.values():
+            seat_inventory.discard(schedule.id)
+        for route_id, day in self.schedules:
+            self.fetch(route_id, day)
+
+    def fetch(self, route_id, day, **params):
+        """The response and whether it came from the cache"""
+        hits = timetable_cache.stats()['hits']
+        response = self.client.get(reverse('schedule-list'), {'route_id': route_id, 'date': day, **params})
+        self.assertEqual(response.status_code, 200)
+        return response, timetable_cache.stats()['hits'] > hits
+
+    def cached(self):
+        return {pair for pair in self.schedules if self.fetch(*pair)[1]}
+
+    def test_hit_is_one_cache_read(self):
+        with self.assertNumQueries(1):
+            response, hit = self.fetch(self.route.id, self.day)
+        self.assertTrue(hit)
+        self.assertEqual(response.json()[0]['id'], self.schedules[self.route.id, self.day].id)
+
+    def test_schedule_save_invalidates_only_its_day(self):
+        schedule = self.schedules[self.route.id, self.day]
+        schedule.departure_time = time(8, 30)
+        schedule.save()
+        self.assertEqual(self.cached(), set(self.schedules) - {(self.route.id, self.day)})
+        self.assertEqual(self.fetch(self.route.id, self.day)[0].json()[0]['departure_time'], '08:30:00')
+
+    def test_route_rename_invalidates_only_that_route(self):
+        self.route.name = 'Route 1 Express'
+        self.route.save()
+        self.assertEqual(self.cached(), {pair for pair in self.schedules if pair[0] == self.other_route.id})
+        self.assertEqual(self.fetch(self.route.id, self.next_day)[0].json()[0]['route']['name'], 'Route 1 Express')
+
+    def test_booking_is_overlaid_on_the_cached_timetable(self):
+        self.fetch(self.route.id, self.day, include='routes,buses')
+        schedule = self.schedules[self.route.id, self.day]
+        reserve_seats({schedule.id: 3})
+
+        response, hit = self.fetch(self.route.id, self.day, include='routes,buses')
+        self.assertTrue(hit)
+        self.assertEqual(response.json()['results'][0]['available_seats'], 37)
+        response, hit = self.fetch(self.route.id, self.day)
+        self.assertTrue(hit)
+        self.assertEqual(response.json()[0]['available_seats'], 37)
+        self.assertEqual(self.cached(), set(self.schedules))
+
+
+class SeatInventoryTests(TestCase):
+    """Counters follow bookings made by other processes as soon as a newer row is read"""
+
+    @classmethod
+    def setUpTestData(cls):
+        driver = CustomUser.objects.create_user(email='driver@example.com', password='pass', role='driver')
+        route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20)
+        cls.schedule = Schedule.objects.create(route=route, bus=Bus.objects.create(number_plate='KL-1'),
+                                               driver=driver, date=timezone.localdate() + timedelta(days=1),
+                                               departure_time=time(8, 0), arrival_time=time(9, 0),
+                                               total_seats=40, available_seats=40)
+
+    def setUp(self):
+        self.inventory = SeatInventory(reconcile_seconds=3600)
+        self.inventory.reconcile()
+
+    def test_newer_row_replaces_the_counter(self):
+        stale = Schedule.objects.get(pk=self.schedule.pk)
+        self.assertEqual(self.inventory.observe(stale), 40)
+        # Another process books straight in the database, past this inventory
+        self.assertTrue(Schedule.take_seats(self.schedule.pk, 2))
+
+        self.assertEqual(self.inventory.observe(stale), 40)
+        self.assertEqual(self.inventory.observe(Schedule.objects.get(pk=self.schedule.pk)), 38)
+        self.assertEqual(self.inventory.seats([self.schedule.pk]), {self.schedule.pk: 38})
+
+    def test_older_row_does_not_undo_a_booking(self):
+        stale = Schedule.objects.get(pk=self.schedule.pk)
+        self.assertEqual(self.inventory.observe(stale), 40)
+        self.assertTrue(Schedule.take_seats(self.schedule.pk, 3))
+        fresh = Schedule.objects.get(pk=self.schedule.pk)
+        self.inventory.record_booking(fresh.pk, fresh.available_seats, fresh.date, fresh.updated_at)
+
+        self.assertEqual(self.inventory.observe(stale), 37)
+
+    def test_schedule_list_shows_bookings_from_other_processes(self):
+        seat_inventory.discard(self.schedule.pk)
+        self.client.get(reverse('schedule-list'))
+        Schedule.take_seats(self.schedule.pk, 5)
+
+        response = self.client.get(reverse('schedule-list'))
+        self.assertEqual(response.json()['results'][0]['available_seats'], 35)
+
+
+class LiveGridTests(TestCase):
+    """The grid answers like a plain distance filter over the Bus table, whichever worker wrote the rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now()
+        shuffle = random.Random(7)
+        cls.buses = Bus.objects.bulk_create([
+            Bus(number_plate=f'KL-{number}', is_running=number % 5 != 0,
+                current_latitude=Decimal(f'{10 + shuffle.uniform(-0.4, 0.4):.8f}'),
+                current_longitude=Decimal(f'{76.3 + shuffle.uniform(-0.4, 0.4):.8f}'),
+                last_location_update=cls.now - timedelta(minutes=shuffle.randrange(180)))
+            for number in range(300)
+        ])
+
+    def setUp(self):
+        self.catch_up_seconds, live_positions.catch_up_seconds = live_positions.catch_up_seconds, 0
+        self.flush_interval, live_positions.flush_interval = live_positions.flush_interval, 0
+        live_positions.refresh_index()
+
+    def tearDown(self):
+        live_positions.catch_up_seconds = self.catch_up_seconds
+        live_positions.flush_interval = self.flush_interval
+        for bus in self.buses:
+            live_positions.forget(bus.id)
+
+    def baseline(self, lat, lng, radius_km, since):
+        """The original nearby_buses filter: every running bus, one distance at a time"""
+        return {
+            bus.id for bus in Bus.objects.filter(is_running=True, current_latitude__isnull=False,
+                                                 current_longitude__isnull=False, last_location_update__gte=since)
+            if calculate_distance(lat, lng, float(bus.current_latitude), float(bus.current_longitude)) <= radius_km
+        }
+
+    def assert_matches_baseline(self):
+        since = self.now - timedelta(hours=2)
+        for lat, lng, radius_km in ((10.0, 76.3, 5), (10.1, 76.2, 12), (9.7, 76.6, 25), (10.0, 76.3, 100)):
+            with self.subTest(lat=lat, lng=lng, radius_km=radius_km):
+                self.assertEqual(set(live_positions.nearby(lat, lng, radius_km, updated_after=since)),
+                                 self.baseline(lat, lng, radius_km, since))
+
+    def test_nearby_matches_a_plain_distance_filter(self):
+        # Some fixes arrive through this process's store
+        for bus in self.buses[:40]:
+            live_positions.record(bus.id, float(bus.current_latitude) + 0.01, float(bus.current_longitude),
+                                  self.now + timedelta(seconds=1))
+        self.assert_matches_baseline()
+
+    def test_rows_flushed_by_other_workers_are_seen_without_a_resync(self):
+        moved, stopped = self.buses[1], self.buses[2]
+        later = self.now + timedelta(seconds=30)
+        Bus.objects.filter(pk=moved.pk).update(current_latitude=Decimal('10.00100000'),
+                                                current_longitude=Decimal('76.30100000'), last_location_update=later)
+        Bus.objects.filter(pk=stopped.pk).update(is_running=False, last_location_update=later)
+
+        self.assertFalse(bus_index.is_stale())
+        found = live_positions.nearby(10.0, 76.3, 1)
+        self.assertIn(moved.id, found)
+        self.assertNotIn(stopped.id, live_positions.nearby(10.0, 76.3, 100))
+        self.assert_matches_baseline()
+
+
+# Records one fix in a fresh process against the test database, then exits without flushing itself
+RECORD_AND_EXIT = """
+import sys
+
+import django
+from django.conf import settings
+
+settings.DATABASES['default']['NAME'] = sys.argv[1]
+settings.LIVE_POSITION_FLUSH_INTERVAL = 3600
+django.setup()
+
+from django.utils import timezone
+from schedules.live import live_positions
+
+live_positions.record(int(sys.argv[2]), 10.5, 76.25, timezone.now(), int(sys.argv[3]))
+"""
+
+
+class LivePositionWriteBehindTests(TransactionTestCase):
+    """Positions accepted by the store end up on the Bus row"""
+
+    def setUp(self):
+        self.route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20)
+        self.bus = Bus.objects.create(number_plate='KL-1')
+        self.store = LivePositionStore(BusGridIndex(), flush_interval=3600)
+        self.addCleanup(self.store._wakeup.set)
+        self.addCleanup(live_positions.forget, self.bus.id)
+
+    def record(self, seconds=0):
+        self.assertTrue(self.store.record(self.bus.id, 10.5, 76.25, timezone.now() + timedelta(seconds=seconds),
+                                          self.route.id))
+
+    def assert_saved(self):
+        bus = Bus.objects.get(pk=self.bus.pk)
+        self.assertTrue(bus.is_running)
+        self.assertEqual((bus.current_latitude, bus.current_longitude), (Decimal('10.5'), Decimal('76.25')))
+        self.assertIsNotNone(bus.last_location_update)
+        self.assertEqual(bus.current_route_id, self.route.id)
+
+    def test_flush_writes_position_and_is_running(self):
+        self.record()
+        self.assertFalse(Bus.objects.get(pk=self.bus.pk).is_running)
+        self.assertEqual(self.store.flush(), 1)
+        self.assert_saved()
+        self.assertEqual(self.store.pending_count(), 0)
+
+    def test_failed_flush_puts_the_batch_back(self):
+        self.record()
+        with mock.patch.object(Bus.objects, 'bulk_update', side_effect=DatabaseError('database is locked')):
+            with self.assertRaises(DatabaseError):
+                self.store.flush()
+        self.assertEqual(self.store.pending_count(), 1)
+        self.assertFalse(Bus.objects.get(pk=self.bus.pk).is_running)
+
+        self.assertEqual(self.store.flush(), 1)
+        self.assert_saved()
+
+    def test_stop_flushes_what_is_pending(self):
+        self.record()
+        self.store.stop()
+        self.assert_saved()
+
+    def test_process_exit_flushes_what_is_pending(self):
+        subprocess.run(
+            [sys.executable, '-c', RECORD_AND_EXIT, str(connection.settings_dict['NAME']),
+             str(self.bus.id), str(self.route.id)],
+            cwd=settings.BASE_DIR, check=True, timeout=60,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'transport_system.settings'},
+        )
+        self.assert_saved()
+
+
+class ScheduleKeysetPaginationTests(TestCase):
+    """Walking the upcoming timetable with ?cursor= visits every schedule exactly once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20)
+        day = timezone.localdate() + timedelta(days=1)
+        # Seven departures share one sort key and are told apart by id alone
+        cls.ids = [
+            Schedule.objects.create(
+                route=route, bus=Bus.objects.create(number_plate=f'KL-{number}'), date=day,
+                driver=CustomUser.objects.create_user(email=f'driver{number}@example.com', role='driver'),
+                departure_time=time(8, 0) if number < 7 else time(9, 0), arrival_time=time(10, 0),
+                total_seats=40, available_seats=40,
+            ).id
+            for number in range(9)
+        ]
+
+    def walk(self, page_size):
+        """Schedule ids of every page, following next links"""
+        pages = []
+        url = reverse('schedule-list') + f'?page_size={page_size}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.json()['results']])
+            url = response.json()['next']
+        return pages
+
+    def test_equal_sort_keys_are_neither_repeated_nor_skipped(self):
+        for page_size in (1, 2, 4, 8):
+            with self.subTest(page_size=page_size):
+                pages = self.walk(page_size)
+                self.assertEqual([schedule_id for page in pages for schedule_id in page], self.ids)
+                self.assertTrue(all(len(page) == page_size for page in pages[:-1]))
+
+    def test_full_last_page_has_no_next_link(self):
+        pages = self.walk(3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3])
+        pages = self.walk(9)
+        self.assertEqual(pages, [self.ids])
+
+    def test_malformed_or_tampered_cursor_is_not_found(self):
+        def encode(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+        for cursor in ('not-a-cursor', '!!!!', encode('2026-01-01'), encode(['2026-01-01', '08:00']),
+                       encode(['2026-13-01', '08:00', 1]), encode(['2026-01-01', '08:00', 'x']),
+                       encode({'date': '2026-01-01'}), encode([None, None, None]),
+                       base64.urlsafe_b64encode(b'["2026-01-01", "08:00:00", 1e400]').decode()):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('schedule-list'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+class AssignmentConflictTests(TestCase):
+    """Overlaps between bus assignments, including shifts that run past midnight"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.day = date(2026, 3, 10)
+        cls.route = Route.objects.create(number='1', name='Route 1', origin='A', destination='B', total_distance=20)
+        cls.bus = Bus.objects.create(number_plate='KL-1')
+
+    def shift(self, start, end, day=None, save=False, bus=None):
+        assignment = BusSchedule(bus=bus or self.bus, route=self.route, date=day or self.day,
+                                 start_time=time(*start), end_time=time(*end))
+        if save:
+            assignment.save()
+        return assignment
+
+    def clashes(self, *candidates):
+        return [(conflict.first, conflict.second) for conflict in find_conflicts(candidates)]
+
+    def test_overlapping_shifts(self):
+        saved = self.shift((8, 0), (12, 0), save=True)
+        candidate = self.shift((11, 0), (13, 0))
+        self.assertEqual(self.clashes(candidate), [(saved, candidate)])
+        inside = self.shift((9, 0), (10, 0))
+        self.assertEqual(self.clashes(inside), [(saved, inside)])
+
+    def test_touching_shifts_do_not_overlap(self):
+        self.shift((8, 0), (12, 0), save=True)
+        self.assertEqual(self.clashes(self.shift((12, 0), (14, 0)), self.shift((6, 0), (8, 0))), [])
+
+    def test_other_buses_and_saved_pairs_are_ignored(self):
+        self.shift((8, 0), (12, 0), save=True)
+        self.shift((9, 0), (10, 0), save=True)
+        other_bus = Bus.objects.create(number_plate='KL-2')
+        self.assertEqual(self.clashes(self.shift((8, 0), (12, 0), bus=other_bus)), [])
+
+    def test_editing_a_shift_does_not_clash_with_itself(self):
+        saved = self.shift((8, 0), (12, 0), save=True)
+        saved.end_time = time(13, 0)
+        self.assertEqual(self.clashes(saved), [])
+
+    def test_overnight_shift_spills_into_the_next_morning(self):
+        night = self.shift((22, 0), (2, 0), save=True)
+        next_day = self.day + timedelta(days=1)
+
+        early = self.shift((1, 0), (3, 0), day=next_day)
+        conflicts = find_conflicts([early])
+        self.assertEqual([(conflict.first, conflict.second, conflict.date) for conflict in conflicts],
+                         [(night, early, next_day)])
+        self.assertEqual(self.clashes(self.shift((2, 0), (4, 0), day=next_day)), [])
+        late = self.shift((23, 0), (23, 30))
+        self.assertEqual(self.clashes(late), [(night, late)])
+        # Two days later is out of reach
+        self.assertEqual(self.clashes(self.shift((1, 0), (3, 0), day=self.day + timedelta(days=2))), [])
+
+    def test_overnight_candidate_against_the_next_days_saved_shift(self):
+        morning = self.shift((5, 0), (9, 0), day=self.day + timedelta(days=1), save=True)
+        night = self.shift((21, 0), (6, 0))
+        self.assertEqual(self.clashes(night), [(night, morning)])
+        self.assertEqual(blocked_days([night, self.shift((6, 0), (7, 0))]), {(self.bus.id, self.day)})
+
+    def test_sweep_agrees_with_comparing_every_pair(self):
+        shuffle = random.Random(17)
+        days = [self.day + timedelta(days=offset) for offset in range(3)]
+        candidates = []
+        for _ in range(60):
+            start = shuffle.randrange(0, 24 * 60, 15)
+            end = (start + shuffle.randrange(15, 10 * 60, 15)) % (24 * 60)
+            candidates.append(self.shift(divmod(start, 60), divmod(end, 60), day=shuffle.choice(days)))
+
+        def interval(assignment):
+            start = datetime.combine(assignment.date, assignment.start_time)
+            end = datetime.combine(assignment.date, assignment.end_time)
+            return start, end if end > start else end + timedelta(days=1)
+
+        expected = set()
+        for position, first in enumerate(candidates):
+            for second in candidates[position + 1:]:
+                (first_start, first_end), (second_start, second_end) = interval(first), interval(second)
+                if first_start < second_end and second_start < first_end:
+                    expected.add(frozenset((id(first), id(second))))
+        found = {frozenset((id(first), id(second))) for first, second in self.clashes(*candidates)}
+        self.assertEqual(found, expected)
+
+    def test_full_fleet_week_validates_well_under_a_second(self):
+        buses = Bus.objects.bulk_create([Bus(number_plate=f'KL-W{number}') for number in range(500)])
+        week = [self.day + timedelta(days=offset) for offset in range(7)]
+        # The evening shift runs to 02:30, into the saved 02:00 shift of the next morning
+        shifts = [((5, 0), (10, 0)), ((10, 30), (15, 30)), ((16, 0), (2, 30))]
+        BusSchedule.objects.bulk_create([
+            self.shift((2, 0), (4, 30), day=day, bus=bus) for bus in buses[:250] for day in week
+        ])
+        candidates = [self.shift(start, end, day=day, bus=bus)
+                      for bus in buses for day in week for start, end in shifts]
+        self.assertEqual(len(candidates), 10500)
+
+        started = clock.perf_counter()
+        with self.assertNumQueries(1):
+            conflicts = find_conflicts(candidates)
+        elapsed = clock.perf_counter() - started
+        self.assertEqual(len(conflicts), 250 * 6)
+        self.assertLess(elapsed, 1.0)
+
+
+class FleetOptimizerTests(TestCase):
+    """Greedy plans on unsaved routes and buses; no database involved"""
+
+    def setUp(self):
+        # Depot route: 90 minute cycle, back after 75. Harbour route: 45 minute cycle, back after 30
+        self.routes = [
+            Route(id=1, origin='Depot', duration=Decimal('0.5'), turnaround_time=Decimal('0.25'),
+                  buffer_time=Decimal('0.25')),
+            Route(id=2, origin='Harbour ', duration=Decimal('0.25'), turnaround_time=Decimal('0'),
+                  buffer_time=Decimal('0.25')),
+        ]
+        self.buses = [
+            Bus(id=1, capacity=40, mileage=Decimal('9')),
+            Bus(id=2, capacity=40, mileage=Decimal('7')),
+            Bus(id=3, capacity=60, mileage=Decimal('5')),
+        ]
+        self.requirements = [
+            TripRequirement(1, 360, 30, None), TripRequirement(2, 360, 20, None),
+            TripRequirement(1, 450, 50, None), TripRequirement(2, 420, 10, None),
+            TripRequirement(1, 480, 35, None), TripRequirement(2, 540, 40, None),
+        ]
+
+    def test_small_day_is_assigned_as_pinned(self):
+        optimizer = FleetOptimizer(self.buses, self.routes, self.requirements, deadhead_minutes=30)
+        plan, passes = optimizer.solve(0.1, seed=1)
+
+        self.assertGreaterEqual(passes, 1)
+        # Bus 1 is back at the depot at 07:30 but too small for 50 seats, so bus 3 comes out
+        self.assertEqual(plan.trips, [
+            PlannedTrip(1, 1, 360, 0), PlannedTrip(2, 2, 360, 0), PlannedTrip(2, 2, 420, 0),
+            PlannedTrip(3, 1, 450, 0), PlannedTrip(1, 1, 480, 0), PlannedTrip(2, 2, 540, 0),
+        ])
+        self.assertEqual(plan.summary(), {
+            'trips': 6, 'unserved': 0, 'buses_used': 3, 'idle_minutes': 120, 'deadhead_minutes': 0, 'cost': 390,
+        })
+        self.assertEqual(
+            [(row.bus_id, row.route_id, row.start_time, row.end_time)
+             for row in plan.assignments(date(2026, 3, 10), optimizer.routes)],
+            [(1, 1, time(6, 0), time(9, 15)), (2, 2, time(6, 0), time(9, 30)), (3, 1, time(7, 30), time(8, 45))],
+        )
+
+    def test_optimized_plan_never_uses_more_buses_than_the_greedy_one(self):
+        rng = random.Random(7)
+        routes = [
+            Route(id=number, origin=f'T{number % 3}', duration=Decimal(rng.choice(['0.5', '0.75', '1.0'])),
+                  turnaround_time=Decimal('0.25'), buffer_time=Decimal(rng.choice(['0', '0.25'])))
+            for number in range(1, 9)
+        ]
+        buses = [Bus(id=number, capacity=rng.choice([30, 40, 60]), mileage=Decimal(rng.randint(3, 12)))
+                 for number in range(1, 41)]
+        requirements = [
+            TripRequirement(rng.randint(1, 8), rng.randrange(6 * 60, 20 * 60, 5), rng.randint(0, 55), None)
+            for _ in range(200)
+        ]
+        for seed in range(5):
+            optimizer = FleetOptimizer(buses, routes, requirements, deadhead_minutes=30)
+            greedy = optimizer.run_pass()
+            plan, passes = optimizer.solve(0.05, seed=seed)
+            with self.subTest(seed=seed):
+                self.assertGreater(passes, 1)
+                self.assertLessEqual(plan.buses_used, greedy.buses_used)
+                self.assertLessEqual(len(plan.unserved), len(greedy.unserved))
+                self.assertLessEqual(plan.cost, greedy.cost)
+
+    def test_first_pass_cut_short_returns_the_partial_plan(self):
+        requirements = [TripRequirement(1 + number % 2, 360 + number, 10, None) for number in range(300)]
+        optimizer = FleetOptimizer(self.buses, self.routes, requirements)
+        # Budget set at t=0, the pass's first check at t=0, its check at trip 256 long after the deadline
+        with mock.patch('schedules.optimizer.time.monotonic', side_effect=[0, 0, 100]):
+            plan, passes = optimizer.solve(1)
+
+        self.assertEqual(passes, 0)
+        self.assertEqual(len(plan.trips) + len(plan.unserved), 300)
+        self.assertEqual(plan.unserved[-44:], optimizer.requirements[256:])
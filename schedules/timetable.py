@@ -0,0 +1,171 @@
+"""
+Cache of serialized timetables, one entry per (route, date) and response shape.
+
+`/api/schedules/?route_id=&date=` responses are stored as serialized data,
+so a hit skips the schedule queries and the DRF serializers. Every route and every
+(route, date) has a version token in the cache, and entries are only valid
+for the pair of tokens they were built under. Invalidating a timetable
+replaces its day token, and a route or stop edit replaces the route token
+(one write however many days the route has). Either drops every shape
+cached for those timetables at once and also discards an entry that a
+request was still building from data read before the change. The cache alias is a
+shared backend (the database by default), so a token replaced by the
+generate_schedules command or by another worker is seen by every process.
+
+The database cache still costs queries: a hit is one SELECT on the cache
+table (both tokens and the entry together), plus the seat overlay's query
+for any schedule the seat inventory isn't tracking yet. A miss adds the
+usual list queries and one cache write. A hit skips the joins and the
+serializers, not the database.
+
+Seat counts and bus positions change far more often than timetables, so
+they are not trusted from the cache: hits are overlaid with the seat
+inventory and the live position store before being returned.
+"""
+import threading
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.dateparse import parse_date
+
+TimetableKey = namedtuple('TimetableKey', ['route_id', 'date', 'variant', 'token'])
+
+
+class TimetableCache:
+    """Serialized timetables keyed by route and day, with hit/miss counters"""
+
+    def __init__(self, alias='default', timeout=3600):
+        self.alias = alias
+        self.timeout = timeout
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _version_key(route_id, day):
+        return f'timetable:{route_id}:{day.isoformat()}:version'
+
+    @staticmethod
+    def _route_version_key(route_id):
+        return f'timetable:{route_id}:version'
+
+    @staticmethod
+    def _entry_key(key):
+        return f'timetable:{key.route_id}:{key.date.isoformat()}:{key.variant}'
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def lookup(self, params, include=None):
+        """(key, cached data) for a one-route, one-day timetable request.
+
+        The key is None if the request isn't cacheable, the data None on a miss.
+        """
+        if params.get('cursor'):
+            return None, None
+        try:
+            route_id = int(params.get('route_id', ''))
+            day = parse_date(params.get('date', ''))
+        except ValueError:
+            return None, None
+        if day is None:
+            return None, None
+        variant = 'include=' + ','.join(sorted(include)) if include is not None else 'nested'
+
+        # The route's token covers every day at once (route and stop edits), the
+        # day's token just that timetable; both are read with the entry in one round trip
+        version_keys = [self._route_version_key(route_id), self._version_key(route_id, day)]
+        entry_key = self._entry_key(TimetableKey(route_id, day, variant, None))
+        found = self.cache.get_many(version_keys + [entry_key])
+        missing = [version_key for version_key in version_keys if version_key not in found]
+        if missing:
+            # First use, or a token was evicted: anything cached under an old token is dead
+            for version_key in missing:
+                self.cache.add(version_key, uuid.uuid4().hex, timeout=None)
+            found = self.cache.get_many(version_keys)
+        token = ':'.join(str(found.get(version_key)) for version_key in version_keys)
+        key = TimetableKey(route_id, day, variant, token)
+
+        entry = found.get(entry_key)
+        if entry is not None and entry[0] == key.token:
+            self._count('hits')
+            return key, entry[1]
+        self._count('misses')
+        return key, None
+
+    def set(self, key, data):
+        self.cache.set(self._entry_key(key), (key.token, data), timeout=self.timeout)
+        self._count('stores')
+
+    def invalidate(self, pairs):
+        """Drop the cached timetables of these (route_id, date) pairs"""
+        pairs = {
+            (route_id, parse_date(day) if isinstance(day, str) else day)
+            for route_id, day in pairs if route_id is not None and day is not None
+        }
+        if not pairs:
+            return
+        self.cache.set_many(
+            {self._version_key(route_id, day): uuid.uuid4().hex for route_id, day in pairs},
+            timeout=None,
+        )
+        self._count('invalidations', len(pairs))
+
+    def invalidate_routes(self, route_ids):
+        """Drop every cached timetable of these routes, whatever the day"""
+        route_ids = {route_id for route_id in route_ids if route_id is not None}
+        if not route_ids:
+            return
+        self.cache.set_many(
+            {self._route_version_key(route_id): uuid.uuid4().hex for route_id in route_ids},
+            timeout=None,
+        )
+        self._count('invalidations', len(route_ids))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+        stats['cache'] = self.alias
+        stats['timeout_seconds'] = self.timeout
+        return stats
+
+
+def overlay_live_state(data, include=None):
+    """Refresh the volatile fields of cached timetable data in place"""
+    from .inventory import seat_inventory
+    from .live import live_positions
+
+    rows = data if include is None else data['results']
+    seats_left = seat_inventory.seats([row['id'] for row in rows])
+    for row in rows:
+        if row['id'] in seats_left:
+            row['available_seats'] = seats_left[row['id']]
+
+    if include is None:
+        buses = [row['bus'] for row in rows if isinstance(row.get('bus'), dict)]
+    else:
+        buses = list(data['included'].get('buses', {}).values())
+    for bus in buses:
+        position = live_positions.get(bus['id'])
+        if position is None:
+            continue
+        bus['current_latitude'] = str(position.latitude)
+        bus['current_longitude'] = str(position.longitude)
+        bus['last_location_update'] = position.timestamp
+        bus['is_running'] = True
+        bus['current_route'] = position.route_id
+    return data
+
+
+timetable_cache = TimetableCache(
+    alias=getattr(settings, 'TIMETABLE_CACHE_ALIAS', 'default'),
+    timeout=getattr(settings, 'TIMETABLE_CACHE_SECONDS', 3600),
+)
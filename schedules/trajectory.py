@@ -0,0 +1,153 @@
+"""
+Append-only store for bus GPS history.
+
+Every accepted fix is appended as a fixed-width binary record to two segment
+files for its UTC day: TRAJECTORY_DIR/<YYYY-MM-DD>/route-<route_id>.seg
+(route 0 holds buses without a route) and <YYYY-MM-DD>/bus-<bus_id>.seg.
+A route's day is then one sequential read of one file and a bus's day is one
+read of its own file, and no GPS history ever touches the relational
+database. Segments are memory-mapped and decoded in one step with a numpy
+structured dtype; filtering and ordering happen on the arrays.
+
+Points are returned as compact (timestamp_ms, latitude, longitude) rows
+(plus route_id for single-bus queries, since a bus can change routes),
+rendered as JSON arrays.
+"""
+import mmap
+import os
+import struct
+import threading
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+# bus_id, timestamp (microseconds since epoch, UTC), latitude, longitude, route_id
+RECORD = struct.Struct('<IqddI')
+RECORD_DTYPE = np.dtype([
+    ('bus_id', '<u4'), ('timestamp_us', '<i8'), ('latitude', '<f8'), ('longitude', '<f8'), ('route_id', '<u4'),
+])
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+DAY_US = 86400 * 1000000
+NO_RECORDS = np.empty(0, dtype=RECORD_DTYPE)
+
+
+def to_micros(value):
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+class TrajectoryStore:
+    """Per-day segment files of fixed-width position records, one per route and one per bus"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+
+    def segment_path(self, day, route_id):
+        return self.root / day.isoformat() / f'route-{route_id or 0}.seg'
+
+    def bus_segment_path(self, day, bus_id):
+        return self.root / day.isoformat() / f'bus-{bus_id}.seg'
+
+    def append(self, fixes):
+        """Append (bus_id, timestamp, latitude, longitude, route_id) fixes"""
+        segments = {}
+        for bus_id, timestamp, latitude, longitude, route_id in fixes:
+            timestamp = timestamp.astimezone(dt_timezone.utc)
+            record = RECORD.pack(bus_id, to_micros(timestamp), float(latitude), float(longitude), route_id or 0)
+            day = timestamp.date()
+            segments.setdefault((day, 'route', route_id or 0), bytearray()).extend(record)
+            segments.setdefault((day, 'bus', bus_id), bytearray()).extend(record)
+
+        with self._lock:
+            for (day, kind, key), data in segments.items():
+                path = self.segment_path(day, key) if kind == 'route' else self.bus_segment_path(day, key)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, 'ab') as segment:
+                    segment.write(data)
+
+    def _scan(self, path, start_us, end_us, bus_id=None):
+        """Records (a RECORD_DTYPE array) in one segment inside [start_us, end_us), optionally for one bus"""
+        try:
+            segment = open(path, 'rb')
+        except FileNotFoundError:
+            return NO_RECORDS
+        with segment:
+            size = os.fstat(segment.fileno()).st_size
+            # Ignore a torn record at the end of a segment that is being appended to
+            count = size // RECORD.size
+            if count == 0:
+                return NO_RECORDS
+            with mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # Copy out of the mapping so it can be closed
+                records = np.frombuffer(mapped, dtype=RECORD_DTYPE, count=count).copy()
+
+        day_start_us = self._day_start_us(path)
+        if not (start_us <= day_start_us and day_start_us + DAY_US <= end_us):
+            timestamps = records['timestamp_us']
+            records = records[(timestamps >= start_us) & (timestamps < end_us)]
+        if bus_id is not None:
+            records = records[records['bus_id'] == bus_id]
+        return records
+
+    @staticmethod
+    def _day_start_us(path):
+        return to_micros(datetime.fromisoformat(path.parent.name).replace(tzinfo=dt_timezone.utc))
+
+    def _days(self, start, end):
+        day = start.astimezone(dt_timezone.utc).date()
+        last = end.astimezone(dt_timezone.utc).date()
+        while day <= last:
+            yield day
+            day += timedelta(days=1)
+
+    def bus_trajectory(self, bus_id, start, end):
+        """Fixes of one bus in [start, end), oldest first, across all its routes"""
+        start_us, end_us = to_micros(start), to_micros(end)
+        chunks = []
+        for day in self._days(start, end):
+            path = self.bus_segment_path(day, bus_id)
+            if path.exists():
+                chunks.append(self._scan(path, start_us, end_us))
+            elif (self.root / day.isoformat()).is_dir() and not any(path.parent.glob('bus-*.seg')):
+                # Days written before per-bus segments existed only have route segments
+                chunks.extend(self._scan(route_path, start_us, end_us, bus_id)
+                              for route_path in path.parent.glob('route-*.seg'))
+        records = np.concatenate(chunks) if chunks else NO_RECORDS
+        records = records[np.argsort(records['timestamp_us'], kind='stable')]
+        route_ids = [route_id or None for route_id in records['route_id'].tolist()]
+        return list(zip(
+            (records['timestamp_us'] // 1000).tolist(), records['latitude'].tolist(),
+            records['longitude'].tolist(), route_ids,
+        ))
+
+    def route_trajectories(self, route_id, start, end):
+        """Fixes of every bus on a route in [start, end), grouped by bus"""
+        start_us, end_us = to_micros(start), to_micros(end)
+        chunks = [self._scan(self.segment_path(day, route_id), start_us, end_us) for day in self._days(start, end)]
+        records = np.concatenate(chunks) if chunks else NO_RECORDS
+        # Group by bus, oldest first within each bus (two stable sorts beat a lexsort here)
+        by_time = np.argsort(records['timestamp_us'], kind='stable')
+        records = records[by_time[np.argsort(records['bus_id'][by_time], kind='stable')]]
+        bus_ids = records['bus_id']
+        bounds = np.flatnonzero(np.diff(bus_ids)) + 1
+        timestamps = (records['timestamp_us'] // 1000).tolist()
+        latitudes = records['latitude'].tolist()
+        longitudes = records['longitude'].tolist()
+        trajectories = {}
+        for first, last in zip([0, *bounds.tolist()], [*bounds.tolist(), len(records)]):
+            trajectories[int(bus_ids[first])] = list(
+                zip(timestamps[first:last], latitudes[first:last], longitudes[first:last])
+            )
+        return trajectories
+
+
+def day_window(day):
+    """[midnight, next midnight) of a date in UTC"""
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+trajectories = TrajectoryStore(getattr(settings, 'TRAJECTORY_DIR', settings.BASE_DIR / 'trajectories'))
@@ -0,0 +1,105 @@
+"""
+Resolves the trip each bus is currently running.
+
+Yesterday's and today's schedules for every requested bus are loaded in one
+query, so a trip that left before midnight and is still running is found.
+Each trip is placed on the timeline as full datetimes (an arrival earlier
+than the departure falls on the next day). A bus's current trip is the one
+whose window contains now, or else its next departure. The answer is cached
+per bus until that bus's next departure or arrival boundary (capped at
+CURRENT_TRIP_CACHE_SECONDS), so repeated polls make no queries at all.
+"""
+import threading
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def trip_window(schedule):
+    """(departure, arrival) of a trip as aware datetimes; arrival is next day for trips past midnight"""
+    departure = timezone.make_aware(datetime.combine(schedule.date, schedule.departure_time))
+    arrival_day = schedule.date
+    if schedule.arrival_time < schedule.departure_time:
+        arrival_day += timedelta(days=1)
+    arrival = timezone.make_aware(datetime.combine(arrival_day, schedule.arrival_time))
+    return departure, arrival
+
+
+def trip_contains(schedule, moment):
+    """Is an aware datetime inside a trip's window"""
+    departure, arrival = trip_window(schedule)
+    return departure <= moment <= arrival
+
+
+def pick_current_trip(schedules, moment):
+    """The running trip (latest departure wins), else the next departure, else None"""
+    running = [schedule for schedule in schedules if trip_contains(schedule, moment)]
+    if running:
+        return max(running, key=lambda schedule: trip_window(schedule)[0])
+    upcoming = [schedule for schedule in schedules if trip_window(schedule)[0] > moment]
+    if upcoming:
+        return min(upcoming, key=lambda schedule: trip_window(schedule)[0])
+    return None
+
+
+class CurrentTripResolver:
+    """Per-bus cache of the current Schedule, valid until the next trip boundary"""
+
+    def __init__(self, max_age_seconds=300):
+        self.max_age = timedelta(seconds=max_age_seconds)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, bus_ids, now=None):
+        """Map each bus id to its current Schedule (or None) with at most one query"""
+        from .models import Schedule
+
+        now = timezone.localtime(now)
+        results = {}
+        missing = []
+        with self._lock:
+            for bus_id in bus_ids:
+                cached = self._cache.get(bus_id)
+                if cached and cached[1] > now:
+                    results[bus_id] = cached[0]
+                else:
+                    missing.append(bus_id)
+        if not missing:
+            return results
+
+        today = now.date()
+        by_bus = {bus_id: [] for bus_id in missing}
+        for schedule in Schedule.objects.filter(bus_id__in=missing, date__in=[today - timedelta(days=1), today]):
+            by_bus[schedule.bus_id].append(schedule)
+
+        end_of_day = timezone.make_aware(datetime.combine(today + timedelta(days=1), time.min))
+        with self._lock:
+            for bus_id, schedules in by_bus.items():
+                current = pick_current_trip(schedules, now)
+                # Valid until the next departure or arrival of this bus
+                boundaries = [
+                    boundary
+                    for schedule in schedules
+                    for boundary in trip_window(schedule)
+                    if boundary > now
+                ]
+                valid_until = min(boundaries, default=end_of_day)
+                valid_until = min(valid_until, now + self.max_age)
+                self._cache[bus_id] = (current, valid_until)
+                results[bus_id] = current
+        return results
+
+    def current_trip(self, bus_id, now=None):
+        return self.resolve([bus_id], now)[bus_id]
+
+    def invalidate(self, bus_id):
+        with self._lock:
+            self._cache.pop(bus_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+current_trips = CurrentTripResolver(getattr(settings, 'CURRENT_TRIP_CACHE_SECONDS', 300))
@@ -4,9 +4,21 @@ from . import views
 urlpatterns = [
     path('schedules/', views.schedules_page, name='schedules-page'),
     path('api/schedules/', views.ScheduleListView.as_view(), name='schedule-list'),
+    path('api/schedules/reserve/', views.reserve_schedule_seats, name='reserve-schedule-seats'),
+    path('api/schedules/availability/', views.seat_availability, name='seat-availability'),
+    path('api/seat-inventory/', views.seat_inventory_status, name='seat-inventory-status'),
+    path('api/timetable-cache/', views.timetable_cache_stats, name='timetable-cache-stats'),
     path('create-schedule/', views.create_bus_schedule, name='create-bus-schedule'),
     path('api/buses/nearby/', views.nearby_buses, name='nearby-buses'),
+    path('api/buses/search/', views.bus_search, name='bus-search'),
     path('api/buses/update-location/', views.update_bus_location, name='update-bus-location'),
+    path('api/buses/update-locations/', views.update_bus_locations_batch, name='update-bus-locations-batch'),
+    path('api/buses/distances/', views.bus_distance_matrix, name='bus-distance-matrix'),
+    path('api/buses/stream/', views.live_bus_feed, name='live-bus-feed'),
     path('api/buses/<int:bus_id>/', views.bus_details, name='bus-details'),
+    path('api/buses/<int:bus_id>/trajectory/', views.bus_trajectory, name='bus-trajectory'),
+    path('api/routes/<int:route_id>/trajectory/', views.route_trajectories, name='route-trajectories'),
+    path('api/stops/<int:stop_id>/arrivals/', views.stop_arrivals, name='stop-arrivals'),
+    path('api/stops/<int:stop_id>/departures/', views.stop_departures, name='stop-departures'),
     path('api/buses/nearby/', views.nearby_buses, name='nearby-buses'),
 ]
\ No newline at end of file
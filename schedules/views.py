@@ -2,47 +2,109 @@ from rest_framework import generics
 from django.utils import timezone
 from django.shortcuts import render, redirect  # <-- ADD redirect HERE
 from django.contrib.auth.decorators import user_passes_test  # <-- ADD THIS IMPORT
-from .models import Schedule, Bus, Route, BusSchedule  # <-- ADD Bus, Route, BusSchedule
+from .models import Schedule, Bus, Route, BusSchedule, StopTime  # <-- ADD Bus, Route, BusSchedule
+from routes.models import Stop
 from .serializers import ScheduleSerializer
-from django.db.models import Q
+from .pagination import ScheduleKeysetPagination
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from datetime import timedelta
-import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
 from .serializers import LiveBusSerializer,BusLocationSerializer
+from .serializers import TIMETABLE_INCLUDES, schedule_row, side_load
+from .spatial import in_bbox
+from .distance import distance_matrix, distances_from
+from .live import live_positions
+from .feed import Subscription, live_feed
+from .trajectory import day_window, trajectories
+from .trips import current_trips
+from .eta import eta_engine
+from .booking import SeatsUnavailable, reserve_seats
+from .conflicts import describe, find_conflicts
+from .imports import import_assignments
+from .inventory import seat_inventory
+from .timetable import overlay_live_state, timetable_cache
+from transport_system.conditional import make_etag, not_modified, stamp_response
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+import asyncio
+import io
+import json
 
 # KEEP ALL EXISTING CODE - API VIEWS
 class ScheduleListView(generics.ListAPIView):
-    """API view to list schedules, optionally filtered by route and date."""
+    """Schedules filtered by route and date.
+
+    A single day (?date=) is returned as a plain list. Without a date, all
+    upcoming schedules are paged with ?cursor= (and optional ?page_size=).
+
+    With ?include=routes,buses,drivers the response is normalized: schedules
+    reference their route/bus/driver by id and every referenced object is
+    side-loaded once under "included".
+    """
     serializer_class = ScheduleSerializer
+    pagination_class = ScheduleKeysetPagination
 
-    def get_queryset(self):
-        queryset = Schedule.objects.all().select_related('route', 'bus')
+    def get_includes(self):
+        """The requested side-loads, or None for the nested response"""
+        include = self.request.query_params.get('include')
+        if include is None:
+            return None
+        return {name.strip() for name in include.split(',') if name.strip()}
+
+    def paginate_queryset(self, queryset):
+        params = self.request.query_params
+        if params.get('date') and not params.get('cursor'):
+            return None
+        return super().paginate_queryset(queryset)
+
+    def list(self, request, *args, **kwargs):
+        include = self.get_includes()
+        if include is not None and include.difference(TIMETABLE_INCLUDES):
+            unknown = include.difference(TIMETABLE_INCLUDES)
+            return Response({'error': f"Unknown include: {', '.join(sorted(unknown))}. "
+                                      f"Choose from {', '.join(TIMETABLE_INCLUDES)}"}, 
+                           status=status.HTTP_400_BAD_REQUEST)
         
-        # Get filter parameters from the URL query string
-        route_id = self.request.query_params.get('route_id', None)
-        date = self.request.query_params.get('date', None)
+        # One route's day is served from the timetable cache when possible
+        key, cached = timetable_cache.lookup(request.query_params, include)
+        if cached is not None:
+            return Response(overlay_live_state(cached, include))
+        response = self.build_response(request, include)
+        if key is not None and response.status_code == 200:
+            timetable_cache.set(key, response.data)
+        return response
+
+    def build_response(self, request, include):
+        if include is None:
+            response = super().list(request)
+            response.data = list(response.data) if isinstance(response.data, list) else response.data
+            return response
         
-        # Apply filters if they are provided
-        if route_id:
-            queryset = queryset.filter(route_id=route_id)
-        if date:
-            queryset = queryset.filter(date=date)
-        else:
-            # If no date is provided, default to today and future schedules
-            today = timezone.now().date()
-            queryset = queryset.filter(date__gte=today)
+        queryset = self.get_queryset()
+        page = self.paginate_queryset(queryset)
+        schedules = page if page is not None else list(queryset)
+        seats_left = {schedule.id: seat_inventory.observe(schedule) for schedule in schedules}
+        rows = [schedule_row(schedule, seats_left) for schedule in schedules]
+        included = side_load(schedules, include)
         
-        return queryset.order_by('date', 'departure_time')
-
-# KEEP EXISTING PAGE VIEW
-class ScheduleListView(generics.ListAPIView):
-    serializer_class = ScheduleSerializer
+        if page is None:
+            return Response({'results': rows, 'included': included})
+        response = self.get_paginated_response(rows)
+        response.data['included'] = included
+        return response
 
     def get_queryset(self):
-        queryset = Schedule.objects.all().select_related('route', 'bus')
+        queryset = Schedule.objects.all()
+        if self.get_includes() is None:
+            # Everything the nested serializer touches, so a page costs a fixed number of queries
+            queryset = queryset.select_related('route', 'bus', 'driver').prefetch_related('route__stops')
         
         route_id = self.request.query_params.get('route_id', None)
         date = self.request.query_params.get('date', None)
@@ -67,39 +129,84 @@ def admin_check(user):
 
 @user_passes_test(admin_check)
 def create_bus_schedule(request):
-    if request.method == 'POST':
+    errors = []
+    error_status = 409
+    import_result = None
+    if request.method == 'POST' and request.FILES.get('file'):
+        # Stream the CSV through the importer instead of reading it into memory
+        lines = io.TextIOWrapper(request.FILES['file'].file, encoding='utf-8-sig', newline='')
+        import_result = import_assignments(lines)
+    elif request.method == 'POST':
         bus_id = request.POST.get('bus')
         route_id = request.POST.get('route')
         date = request.POST.get('date')
         start_time = request.POST.get('start_time')
         end_time = request.POST.get('end_time')
         
-        bus = Bus.objects.get(id=bus_id)
-        route = Route.objects.get(id=route_id)
-        
-        BusSchedule.objects.create(
-            bus=bus,
-            route=route,
-            date=date,
-            start_time=start_time,
-            end_time=end_time
-        )
-        return redirect('create-bus-schedule')
-    
-    buses = Bus.objects.all()
-    routes = Route.objects.all()
-    schedules = BusSchedule.objects.all().select_related('bus', 'route').order_by('-date', 'start_time')
+        try:
+            bus = Bus.objects.get(id=bus_id)
+            route = Route.objects.get(id=route_id)
+            assignment = BusSchedule(
+                bus=bus,
+                route=route,
+                date=parse_date(date or ''),
+                start_time=parse_time(start_time or ''),
+                end_time=parse_time(end_time or '')
+            )
+        except (Bus.DoesNotExist, Route.DoesNotExist, ValueError):
+            assignment = None
+        if assignment is None or None in (assignment.date, assignment.start_time, assignment.end_time):
+            errors = ['Choose a bus and a route, and enter a valid date, start time and end time.']
+            error_status = 400
+        else:
+            # Refuse to double-book the bus
+            conflicts = find_conflicts([assignment])
+            if not conflicts:
+                assignment.save()
+                return redirect('create-bus-schedule')
+            errors = [describe(conflict) for conflict in conflicts]
+    
+    # Only one date window of assignments is listed, a page at a time
+    today = timezone.localdate()
+    window_start = parse_date(request.GET.get('from') or '') or today
+    window_end = parse_date(request.GET.get('to') or '') or window_start + timedelta(days=6)
+    schedules = BusSchedule.objects.filter(date__range=(window_start, window_end)).select_related(
+        'bus', 'route').order_by('-date', 'start_time')
+    page = Paginator(schedules, getattr(settings, 'BUS_ASSIGNMENTS_PAGE_SIZE', 50)).get_page(request.GET.get('page'))
     
     return render(request, 'create_schedule.html', {
-        'buses': buses,
-        'routes': routes,
-        'schedules': schedules
-    })
+        'page': page,
+        'window_start': window_start,
+        'window_end': window_end,
+        'errors': errors,
+        'import_result': import_result
+    }, status=error_status if errors else 200)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def bus_search(request):
+    """Buses whose number plate contains ?q=, for the assignment page's bus picker"""
+    if request.user.role != 'admin':
+        return Response({'error': 'Only admins can search buses'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    query = request.GET.get('q', '').strip()
+    buses = Bus.objects.filter(is_active=True, number_plate__icontains=query).order_by('number_plate')
+    return Response([
+        {'id': bus.id, 'label': f"{bus.number_plate} ({bus.get_service_type_display()})"}
+        for bus in buses[:getattr(settings, 'AUTOCOMPLETE_RESULTS', 20)]
+    ])
 
 # NEW API VIEW FOR NEARBY BUSES
 @api_view(['GET'])
 def nearby_buses(request):
-    """Get buses near user location"""
+    """Get buses near user location.
+
+    Responses carry an ETag; polling with If-None-Match gets a 304 while no bus
+    in range has moved. There is no Last-Modified: buses leaving the radius or
+    ageing out don't move any timestamp forward, so only the ETag is reliable. With ?since=<ISO-8601 or epoch seconds> only
+    buses whose position changed after that time are returned, plus the ids of
+    every bus still in range so the client can drop the rest.
+    """
     try:
         user_lat = float(request.GET.get('latitude'))
         user_lng = float(request.GET.get('longitude'))
@@ -109,24 +216,60 @@ def nearby_buses(request):
             'error': 'Invalid coordinates. Provide latitude, longitude, and optional radius.'
         }, status=status.HTTP_400_BAD_REQUEST)
     
+    since = None
+    if request.GET.get('since'):
+        since = parse_since(request.GET['since'])
+        if since is None:
+            return Response({'error': 'since must be an ISO-8601 datetime or epoch seconds'}, 
+                           status=status.HTTP_400_BAD_REQUEST)
+    
     # Get buses that are currently running and updated recently (last 2 hours for testing)
     two_hours_ago = timezone.now() - timedelta(hours=2)
     
-    running_buses = Bus.objects.filter(
-        is_running=True,
-        current_latitude__isnull=False,
-        current_longitude__isnull=False,
-        last_location_update__gte=two_hours_ago
-    ).select_related('current_route')
+    # Only consider the buses the spatial grid puts inside the search radius
+    candidate_ids = live_positions.nearby(user_lat, user_lng, radius_km, updated_after=two_hours_ago)
+    last_updates = live_positions.last_updates(candidate_ids)
+    
+    # Current trip of every bus in range, resolved with at most one query
+    trips_by_bus = current_trips.resolve(candidate_ids)
+    # Seat counts come from the live inventory; cached trips may predate recent bookings
+    seats_left = seat_inventory.seats([trip.id for trip in trips_by_bus.values() if trip])
+    
+    # Everything the payload depends on, fingerprinted before any serialization work
+    route_count, routes_modified = Route.catalog_state()
+    etag = make_etag(
+        'nearby', request.accepted_renderer.format, user_lat, user_lng, radius_km, since,
+        sorted(last_updates.items()),
+        sorted((bus_id, trip_state(trip, seats_left)) for bus_id, trip in trips_by_bus.items()),
+        route_count, routes_modified,
+    )
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    
+    changed_ids = candidate_ids
+    if since is not None:
+        changed_ids = [bus_id for bus_id in candidate_ids if last_updates.get(bus_id) and last_updates[bus_id] > since]
+    
+    candidate_buses = Bus.objects.filter(id__in=changed_ids).select_related('current_route')
+    
+    # Positions may not be flushed yet, so filter on the live values
+    running_buses = []
+    for bus in candidate_buses:
+        live_positions.apply(bus)
+        if (bus.is_running and bus.current_latitude is not None and bus.current_longitude is not None
+                and bus.last_location_update is not None and bus.last_location_update >= two_hours_ago):
+            running_buses.append(bus)
+    
+    distances = distances_from(
+        user_lat, user_lng,
+        [float(bus.current_latitude) for bus in running_buses],
+        [float(bus.current_longitude) for bus in running_buses]
+    )
     
     nearby_buses_list = []
     
-    for bus in running_buses:
-        distance = calculate_distance(
-            user_lat, user_lng,
-            float(bus.current_latitude), float(bus.current_longitude)
-        )
-        
+    for bus, distance in zip(running_buses, distances.tolist()):
         if distance <= radius_km:
             bus_data = {
                 'id': bus.id,
@@ -152,16 +295,12 @@ def nearby_buses(request):
                     'total_distance': float(bus.current_route.total_distance)
                 }
             
-            # Find current schedule for this bus
-            current_schedule = Schedule.objects.filter(
-                bus=bus,
-                date=timezone.now().date()
-            ).first()
+            current_schedule = trips_by_bus.get(bus.id)
             
             if current_schedule:
                 bus_data['schedule'] = {
                     'id': current_schedule.id,
-                    'available_seats': current_schedule.available_seats,
+                    'available_seats': seats_left.get(current_schedule.id, current_schedule.available_seats),
                     'total_seats': current_schedule.total_seats,
                     'departure_time': current_schedule.departure_time.strftime('%H:%M'),
                     'arrival_time': current_schedule.arrival_time.strftime('%H:%M'),
@@ -172,30 +311,40 @@ def nearby_buses(request):
     
     nearby_buses_list.sort(key=lambda x: x['distance_km'])
     
-    return Response({
+    data = {
         'buses': nearby_buses_list,
         'user_location': {'latitude': user_lat, 'longitude': user_lng},
         'search_radius_km': radius_km,
         'total_found': len(nearby_buses_list)
-    })
+    }
+    if since is not None:
+        # Pass as_of back as the next since; buses missing from bus_ids left the area
+        data['since'] = since
+        data['as_of'] = max([since, *last_updates.values()])
+        data['bus_ids'] = sorted(last_updates)
+    return stamp_response(Response(data), etag)
+
+def parse_since(value):
+    """Parse ?since= as ISO-8601 or epoch seconds; None if it is neither"""
+    try:
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        pass
+    try:
+        since = parse_datetime(value)
+    except ValueError:
+        return None
+    if since is not None and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+def trip_state(schedule, seats_left):
+    """The parts of a current trip that appear in live bus payloads"""
+    if schedule is None:
+        return None
+    return (schedule.id, seats_left.get(schedule.id, schedule.available_seats), schedule.total_seats,
+            schedule.departure_time, schedule.arrival_time, schedule.date)
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two coordinates in kilometers"""
-    R = 6371
-    
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
-    
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
-    
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    distance = R * c
-    
-    return distance
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def update_bus_location(request):
@@ -213,25 +362,29 @@ def update_bus_location(request):
     except (TypeError, ValueError):
         return Response({'error': 'Invalid data provided'}, 
                        status=status.HTTP_400_BAD_REQUEST)
+    if not valid_coordinates(latitude, longitude):
+        return Response({'error': 'Coordinates out of range'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
     
     try:
         # Find the bus assigned to this driver
         bus = Bus.objects.get(id=bus_id)
         
-        # Update location
-        bus.update_location(latitude, longitude)
-        bus.is_running = True
+        route_id = bus.current_route_id
         
         # If schedule provided, link it
         if schedule_id:
             try:
                 schedule = Schedule.objects.get(id=schedule_id, driver=request.user)
-                bus.current_schedule = schedule
-                bus.current_route = schedule.route
+                route_id = schedule.route_id
             except Schedule.DoesNotExist:
                 pass
         
-        bus.save()
+        # Hand the fix to the live store; the Bus row catches up on the next flush
+        timestamp = timezone.now()
+        if live_positions.record(bus.id, latitude, longitude, timestamp, route_id):
+            trajectories.append([(bus.id, timestamp, latitude, longitude, route_id)])
+        live_positions.apply(bus)
         
         return Response({
             'success': True,
@@ -243,32 +396,492 @@ def update_bus_location(request):
         return Response({'error': 'Bus not found'}, 
                        status=status.HTTP_404_NOT_FOUND)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def update_bus_locations_batch(request):
+    """Driver endpoint to upload many timestamped fixes in one request.
+
+    Only the newest fix per bus is kept; the live store persists them in bulk.
+    """
+    if request.user.role != 'driver':
+        return Response({'error': 'Only drivers can update bus locations'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    
+    fixes = request.data.get('fixes')
+    if not isinstance(fixes, list) or not fixes:
+        return Response({'error': 'Provide a non-empty list of fixes'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    batch_limit = getattr(settings, 'BUS_LOCATION_BATCH_LIMIT', 500)
+    if len(fixes) > batch_limit:
+        return Response({'error': f'At most {batch_limit} fixes per request'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    # Keep only the newest valid fix for each bus
+    now = timezone.now()
+    latest = {}
+    valid_fixes = []
+    rejected = []
+    for index, fix in enumerate(fixes):
+        try:
+            bus_id = int(fix['bus_id'])
+            latitude = float(fix['latitude'])
+            longitude = float(fix['longitude'])
+            timestamp = parse_fix_timestamp(fix.get('timestamp'), now)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            rejected.append({'index': index, 'error': 'Invalid fix'})
+            continue
+        if not valid_coordinates(latitude, longitude):
+            rejected.append({'index': index, 'error': 'Coordinates out of range'})
+            continue
+        
+        valid_fixes.append((bus_id, timestamp, latitude, longitude))
+        previous = latest.get(bus_id)
+        if previous is None or timestamp >= previous['timestamp']:
+            latest[bus_id] = {
+                'latitude': latitude,
+                'longitude': longitude,
+                'timestamp': timestamp,
+                # A schedule sent with any earlier fix still applies
+                'schedule_id': fix.get('schedule_id') or (previous and previous['schedule_id']),
+            }
+    
+    buses = Bus.objects.in_bulk(list(latest))
+    schedule_ids = [fix['schedule_id'] for fix in latest.values() if fix['schedule_id']]
+    schedule_routes = dict(
+        Schedule.objects.filter(id__in=schedule_ids, driver=request.user).values_list('id', 'route_id')
+    ) if schedule_ids else {}
+    
+    # Current trips for the ETA engine, resolved for the whole upload with at most one query
+    trips_by_bus = current_trips.resolve([bus_id for bus_id in latest if bus_id in buses])
+    
+    updated = []
+    bus_routes = {}
+    known_until = {}
+    for bus_id, fix in latest.items():
+        bus = buses.get(bus_id)
+        if bus is None:
+            rejected.append({'bus_id': bus_id, 'error': 'Bus not found'})
+            continue
+        route_id = schedule_routes.get(fix['schedule_id'], bus.current_route_id)
+        # Ignore uploads no newer than the position we already have (the store may be ahead of the row)
+        position = live_positions.get(bus_id)
+        stamps = [bus.last_location_update, position and position.timestamp]
+        previous = max([stamp for stamp in stamps if stamp], default=None)
+        if previous and fix['timestamp'] <= previous:
+            continue
+        if live_positions.record(bus_id, fix['latitude'], fix['longitude'], fix['timestamp'], route_id,
+                                 trips_by_bus):
+            updated.append(bus_id)
+            bus_routes[bus_id] = route_id
+            known_until[bus_id] = previous
+    
+    # The accepted buses' earlier fixes in this upload belong in their history too,
+    # but nothing the store already had, so a retried upload adds no duplicates
+    history = {
+        (bus_id, timestamp): (bus_id, timestamp, latitude, longitude, bus_routes[bus_id])
+        for bus_id, timestamp, latitude, longitude in valid_fixes
+        if bus_id in bus_routes and (known_until[bus_id] is None or timestamp > known_until[bus_id])
+    }
+    trajectories.append(history.values())
+    
+    return Response({
+        'success': True,
+        'accepted': len(fixes) - len([r for r in rejected if 'index' in r]),
+        'updated_buses': updated,
+        'rejected': rejected
+    })
+
+def valid_coordinates(latitude, longitude):
+    """False for NaN, infinities and positions off the globe"""
+    return -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+def parse_fix_timestamp(value, now):
+    """Parse an ISO-8601 string or epoch seconds; missing or future times become now"""
+    if value is None or value == '':
+        return now
+    if isinstance(value, (int, float)):
+        try:
+            timestamp = datetime.fromtimestamp(value, tz=dt_timezone.utc)
+        except (OverflowError, OSError):
+            raise ValueError('Invalid timestamp')
+    else:
+        timestamp = parse_datetime(value)
+        if timestamp is None:
+            raise ValueError('Invalid timestamp')
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+    return min(timestamp, now)
+
 @api_view(['GET'])
 def bus_details(request, bus_id):
-    """Get detailed information about a specific bus"""
+    """Get detailed information about a specific bus (supports If-None-Match/If-Modified-Since)"""
     try:
-        bus = Bus.objects.select_related('current_route', 'current_schedule').get(
-            id=bus_id, is_running=True
-        )
-        return Response(LiveBusSerializer(bus).data)
+        current_schedule = current_trips.current_trip(bus_id)
+        etag = last_modified = None
+        last_updates = live_positions.last_updates([bus_id])
+        if bus_id in last_updates:
+            # Buses with a live position can be revalidated without loading them
+            route_count, routes_modified = Route.catalog_state()
+            etag = make_etag(
+                'bus', request.accepted_renderer.format, bus_id, last_updates[bus_id],
+                trip_state(current_schedule, seat_inventory.seats([current_schedule.id] if current_schedule else [])),
+                eta_engine.bus_etas(bus_id), route_count, routes_modified,
+            )
+            last_modified = max(
+                [stamp for stamp in (last_updates[bus_id], routes_modified) if stamp is not None],
+                default=None
+            )
+            cached = not_modified(request, etag, last_modified)
+            if cached is not None:
+                return cached
+        
+        bus = live_positions.apply(Bus.objects.select_related('current_route').get(id=bus_id))
+        if not bus.is_running:
+            raise Bus.DoesNotExist
+        bus.current_schedule = current_schedule
+        response = Response(LiveBusSerializer(bus).data)
+        if etag is not None:
+            stamp_response(response, etag, last_modified)
+        return response
     except Bus.DoesNotExist:
         return Response({'error': 'Bus not found or not running'}, 
                        status=status.HTTP_404_NOT_FOUND)
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two coordinates in kilometers"""
-    R = 6371  # Earth's radius in kilometers
+async def live_bus_feed(request):
+    """Server-Sent Events stream of bus position changes (served by the ASGI app only).
+
+    Subscribe with ?bbox=min_lat,min_lng,max_lat,max_lng and/or ?route_id=<id>.
+    The first event is a snapshot of the buses in view; after that only position
+    changes are pushed, with in_view=false when a bus leaves the box or route.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'The live feed is only available through the ASGI server'}, 
+                            status=501)
+    
+    bbox = None
+    route_id = None
+    try:
+        if request.GET.get('bbox'):
+            bbox = tuple(float(value) for value in request.GET['bbox'].split(','))
+            if len(bbox) != 4 or bbox[0] > bbox[2]:
+                raise ValueError
+        if request.GET.get('route_id'):
+            route_id = int(request.GET['route_id'])
+    except ValueError:
+        return JsonResponse({'error': 'bbox must be min_lat,min_lng,max_lat,max_lng and route_id a number'}, 
+                            status=400)
+    if bbox is None and route_id is None:
+        return JsonResponse({'error': 'Provide a bbox and/or route_id to subscribe to'}, status=400)
+    
+    # Subscribe before taking the snapshot so no change falls in between
+    subscription = live_feed.subscribe(Subscription(asyncio.get_running_loop(), bbox, route_id))
+    try:
+        snapshot = await sync_to_async(live_feed_snapshot)(bbox, route_id)
+    except Exception:
+        live_feed.unsubscribe(subscription)
+        raise
+    live_feed.seed(subscription, [bus['id'] for bus in snapshot])
+    
+    response = StreamingHttpResponse(
+        stream_live_events(subscription, snapshot), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def live_feed_snapshot(bbox, route_id):
+    """Buses currently inside a feed subscription, with live positions applied"""
+    two_hours_ago = timezone.now() - timedelta(hours=2)
+    if bbox is not None:
+        candidate_ids = live_positions.within_bbox(*bbox)
+    else:
+        candidate_ids = list(Bus.objects.filter(
+            current_route_id=route_id, is_running=True
+        ).values_list('id', flat=True))
+        candidate_ids += live_positions.bus_ids_on_route(route_id)
     
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
+    snapshot = []
+    for bus in Bus.objects.filter(id__in=candidate_ids):
+        live_positions.apply(bus)
+        if (not bus.is_running or bus.current_latitude is None or bus.current_longitude is None
+                or bus.last_location_update is None or bus.last_location_update < two_hours_ago):
+            continue
+        if route_id is not None and bus.current_route_id != route_id:
+            continue
+        if bbox is not None and not in_bbox(float(bus.current_latitude), float(bus.current_longitude), *bbox):
+            continue
+        snapshot.append({
+            'id': bus.id,
+            'number_plate': bus.number_plate,
+            'capacity': bus.capacity,
+            'current_latitude': str(bus.current_latitude),
+            'current_longitude': str(bus.current_longitude),
+            'last_location_update': bus.last_location_update,
+            'route_id': bus.current_route_id,
+        })
+    return snapshot
+
+async def stream_live_events(subscription, snapshot):
+    keepalive = getattr(settings, 'LIVE_FEED_KEEPALIVE_SECONDS', 15)
+    try:
+        yield server_sent_event('snapshot', {'buses': snapshot})
+        while True:
+            events = await subscription.next_events(keepalive)
+            if not events:
+                yield ': keepalive\n\n'
+            for event in events:
+                yield server_sent_event('position', event)
+    finally:
+        live_feed.unsubscribe(subscription)
+
+def server_sent_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+def trajectory_window(request):
+    """Read ?start=&end= (ISO-8601) or ?date=YYYY-MM-DD; defaults to today (UTC)"""
+    start = request.GET.get('start')
+    end = request.GET.get('end')
+    if start or end:
+        start = parse_datetime(start or '')
+        end = parse_datetime(end or '') if end else timezone.now()
+        if start is None or end is None:
+            raise ValueError('start and end must be ISO-8601 datetimes')
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        if timezone.is_naive(end):
+            end = timezone.make_aware(end)
+    else:
+        day = parse_date(request.GET.get('date', '')) if request.GET.get('date') else timezone.now().date()
+        if day is None:
+            raise ValueError('date must be YYYY-MM-DD')
+        start, end = day_window(day)
     
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
+    if end <= start:
+        raise ValueError('end must be after start')
+    max_days = getattr(settings, 'TRAJECTORY_MAX_WINDOW_DAYS', 7)
+    if end - start > timedelta(days=max_days):
+        raise ValueError(f'Window can span at most {max_days} days')
+    return start, end
+
+@api_view(['GET'])
+def bus_trajectory(request, bus_id):
+    """GPS history of one bus over a time window"""
+    try:
+        start, end = trajectory_window(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    distance = R * c
+    points = trajectories.bus_trajectory(bus_id, start, end)
+    return Response({
+        'bus_id': bus_id,
+        'start': start,
+        'end': end,
+        'fields': ['timestamp_ms', 'latitude', 'longitude', 'route_id'],
+        'points': points,
+        'total_points': len(points)
+    })
+
+@api_view(['GET'])
+def route_trajectories(request, route_id):
+    """GPS history of every bus that ran on a route over a time window"""
+    try:
+        start, end = trajectory_window(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    return distance    
\ No newline at end of file
+    buses = trajectories.route_trajectories(route_id, start, end)
+    return Response({
+        'route_id': route_id,
+        'start': start,
+        'end': end,
+        'fields': ['timestamp_ms', 'latitude', 'longitude'],
+        'buses': [{'bus_id': bus_id, 'points': points} for bus_id, points in buses.items()],
+        'total_points': sum(len(points) for points in buses.values())
+    })
+
+@api_view(['GET'])
+def bus_distance_matrix(request):
+    """Distances from up to K points to every running bus in one call.
+
+    Pass ?points=lat,lng;lat,lng;... and get back a K x N matrix in km.
+    Positions come from the live store, so no database query is made.
+    """
+    max_points = getattr(settings, 'DISTANCE_MATRIX_MAX_POINTS', 100)
+    try:
+        points = [
+            tuple(float(value) for value in pair.split(','))
+            for pair in request.GET.get('points', '').split(';') if pair.strip()
+        ]
+        if not points or any(len(point) != 2 for point in points):
+            raise ValueError
+    except ValueError:
+        return Response({'error': 'Provide points as lat,lng;lat,lng;...'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    if len(points) > max_points:
+        return Response({'error': f'At most {max_points} points per request'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    two_hours_ago = timezone.now() - timedelta(hours=2)
+    bus_ids, lats, lngs = live_positions.positions(updated_after=two_hours_ago)
+    matrix = distance_matrix([lat for lat, _ in points], [lng for _, lng in points], lats, lngs)
+    
+    return Response({
+        'points': [{'latitude': lat, 'longitude': lng} for lat, lng in points],
+        'buses': [
+            {'id': bus_id, 'latitude': lat, 'longitude': lng}
+            for bus_id, lat, lng in zip(bus_ids, lats, lngs)
+        ],
+        'distances_km': matrix.round(2).tolist()
+    })
+
+@api_view(['GET'])
+def stop_arrivals(request, stop_id):
+    """Predicted arrivals at a stop, served from the precomputed ETA tables"""
+    now = timezone.now()
+    arrivals = eta_engine.stop_arrivals(stop_id, updated_after=now - timedelta(hours=2))
+    return Response({
+        'stop_id': stop_id,
+        'arrivals': [
+            {
+                'bus_id': arrival['bus_id'],
+                'route_id': arrival['route_id'],
+                'distance_km': arrival['distance_km'],
+                'eta': arrival['eta'],
+                'minutes_away': max(round((arrival['eta'] - now).total_seconds() / 60), 0),
+            }
+            for arrival in arrivals
+        ]
+    })
+
+@api_view(['GET'])
+def stop_departures(request, stop_id):
+    """Next scheduled departures passing a stop, read from the stop-time index.
+
+    ?after=HH:MM (default now) and ?date=YYYY-MM-DD (default today) set where
+    to start; ?limit= caps the number of departures returned.
+    """
+    today = timezone.localdate()
+    day = parse_date(request.GET.get('date', '')) if request.GET.get('date') else today
+    after = parse_time(request.GET.get('after', '')) if request.GET.get('after') else None
+    try:
+        limit = min(int(request.GET.get('limit', 10)), getattr(settings, 'STOP_DEPARTURES_LIMIT', 50))
+    except ValueError:
+        limit = None
+    if day is None or (request.GET.get('after') and after is None) or not limit or limit < 1:
+        return Response({'error': 'Use date=YYYY-MM-DD, after=HH:MM and a positive limit'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    if after is None:
+        after = timezone.localtime().time().replace(second=0, microsecond=0) if day == today else datetime.min.time()
+    
+    stop_times = list(
+        StopTime.objects.filter(stop_id=stop_id, date=day, passing_time__gte=after)
+        .select_related('schedule__route', 'schedule__bus')
+        .order_by('passing_time')[:limit]
+    )
+    if not stop_times and not Stop.objects.filter(id=stop_id).exists():
+        return Response({'error': 'Stop not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    seats_left = seat_inventory.seats([stop_time.schedule_id for stop_time in stop_times])
+    return Response({
+        'stop_id': stop_id,
+        'date': day,
+        'after': after,
+        'departures': [
+            {
+                'schedule_id': stop_time.schedule_id,
+                'route_id': stop_time.schedule.route_id,
+                'route_number': stop_time.schedule.route.number,
+                'bus_id': stop_time.schedule.bus_id,
+                'bus_number_plate': stop_time.schedule.bus.number_plate,
+                'passing_time': stop_time.passing_time,
+                'departure_time': stop_time.schedule.departure_time,
+                'available_seats': seats_left.get(stop_time.schedule_id),
+            }
+            for stop_time in stop_times
+        ]
+    })
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def reserve_schedule_seats(request):
+    """Book seats on one or more schedules in a single all-or-nothing transaction.
+
+    Body: {"reservations": [{"schedule_id": 1, "seats": 2}, ...]}
+    """
+    reservations = request.data.get('reservations') if isinstance(request.data, dict) else None
+    limit = getattr(settings, 'SEAT_RESERVATION_LIMIT', 20)
+    if not isinstance(reservations, list) or not reservations:
+        return Response({'error': 'Provide a non-empty "reservations" list'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    if len(reservations) > limit:
+        return Response({'error': f'At most {limit} reservations per request'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    requested = {}
+    try:
+        for reservation in reservations:
+            schedule_id = int(reservation['schedule_id'])
+            seats = int(reservation.get('seats', 1))
+            if seats < 1:
+                raise ValueError
+            requested[schedule_id] = requested.get(schedule_id, 0) + seats
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return Response({'error': 'Each reservation needs a schedule_id and a positive number of seats'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        remaining = reserve_seats(requested)
+    except Schedule.DoesNotExist as error:
+        return Response({'error': str(error)}, status=status.HTTP_404_NOT_FOUND)
+    except SeatsUnavailable as error:
+        return Response({'error': str(error), 'schedule_id': error.schedule_id}, 
+                       status=status.HTTP_409_CONFLICT)
+    
+    return Response({
+        'reserved': [
+            {'schedule_id': schedule_id, 'seats': seats, 'available_seats': remaining[schedule_id]}
+            for schedule_id, seats in sorted(requested.items())
+        ]
+    })
+
+@api_view(['GET'])
+def seat_availability(request):
+    """Seats left on ?ids=1,2,3, served from the seat inventory"""
+    try:
+        schedule_ids = [int(value) for value in request.GET.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return Response({'error': 'ids must be a comma-separated list of schedule ids'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    limit = getattr(settings, 'SEAT_AVAILABILITY_MAX_IDS', 200)
+    if not schedule_ids or len(schedule_ids) > limit:
+        return Response({'error': f'Provide between 1 and {limit} schedule ids'}, 
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    seats_left = seat_inventory.seats(schedule_ids)
+    return Response({
+        'availability': [
+            {'schedule_id': schedule_id, 'available_seats': seats_left[schedule_id]}
+            for schedule_id in schedule_ids if schedule_id in seats_left
+        ]
+    })
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def seat_inventory_status(request):
+    """Admin view of the seat inventory; POST reconciles it with the database now"""
+    if request.user.role != 'admin':
+        return Response({'error': 'Only admins can inspect the seat inventory'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    if request.method == 'POST':
+        seat_inventory.reconcile()
+    return Response(seat_inventory.stats())
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def timetable_cache_stats(request):
+    """Hit/miss counters of the timetable cache in this process"""
+    if request.user.role != 'admin':
+        return Response({'error': 'Only admins can inspect the timetable cache'}, 
+                       status=status.HTTP_403_FORBIDDEN)
+    return Response(timetable_cache.stats())
@@ -0,0 +1,36 @@
+"""
+Conditional GET helpers for polled API endpoints.
+
+Views compute a cheap fingerprint of the state a response would be built
+from, answer 304 Not Modified when the client already has it, and only
+serialize a payload when something changed.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """Stable ETag value for the state a response is built from"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def not_modified(request, etag, last_modified=None):
+    """A 304 response if the client's cached copy is still current, else None"""
+    response = get_conditional_response(
+        request,
+        etag=quote_etag(etag),
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is not None:
+        stamp_response(response, etag, last_modified)
+    return response
+
+
+def stamp_response(response, etag, last_modified=None):
+    """Attach the validators a client sends back on its next poll"""
+    response.headers['ETag'] = quote_etag(etag)
+    if last_modified:
+        response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -27,7 +28,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = [
     
-    "192.168.163.81"
+    "192.168.163.81",
+    "localhost",  # Local servers, e.g. the loadtest_live harness
+    "127.0.0.1",
 ]
 
 
@@ -88,9 +91,29 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            # WAL lets readers run alongside the writer; IMMEDIATE takes the write lock
+            # up front so concurrent transactions queue instead of failing with "locked"
+            "init_command": "PRAGMA journal_mode=WAL;",
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
+        # A file rather than shared-cache memory, so concurrency tests see the same locking as production
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
 
+# Optional local Postgres (e.g. for load tests): set POSTGRES_DB to switch over
+if os.environ.get("POSTGRES_DB"):
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ["POSTGRES_DB"],
+        "USER": os.environ.get("POSTGRES_USER", ""),
+        "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+        "HOST": os.environ.get("POSTGRES_HOST", "localhost"),
+        "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -158,4 +181,55 @@ SESSION_COOKIE_AGE = 86400  # 24 hours
 
 SESSION_SAVE_EVERY_REQUEST = True
 SESSION_COOKIE_HTTPONLY = False
-SESSION_COOKIE_SAMESITE = 'Lax'
\ No newline at end of file
+SESSION_COOKIE_SAMESITE = 'Lax'
+# Live bus tracking
+BUS_GRID_CELL_DEGREES = 0.05  # Spatial index cell size (~5.5 km of latitude)
+BUS_GRID_RESYNC_SECONDS = 60  # Full reload of the index from the database this often (see schedules/live.py)
+BUS_GRID_CATCH_UP_SECONDS = 1  # Read positions flushed by other workers at most this often
+BUS_LOCATION_BATCH_LIMIT = 500  # Max fixes accepted by /api/buses/update-locations/
+# Accepted fixes sit in worker memory until the next flush. A clean shutdown flushes
+# them, but a crash or SIGKILL loses up to this many seconds of live positions (the
+# trajectory files still have them, and the next fix from each bus replaces them anyway)
+LIVE_POSITION_FLUSH_INTERVAL = 5  # Seconds between live position flushes; 0 writes through
+LIVE_FEED_KEEPALIVE_SECONDS = 15  # Comment sent on idle /api/buses/stream/ connections
+TRAJECTORY_DIR = BASE_DIR / 'trajectories'  # Per-day GPS history segment files
+TRAJECTORY_MAX_WINDOW_DAYS = 7  # Longest window a trajectory query may ask for
+DISTANCE_MATRIX_MAX_POINTS = 100  # Max points per /api/buses/distances/ request
+CURRENT_TRIP_CACHE_SECONDS = 300  # Upper bound on how long a resolved current trip is reused
+
+# Seat booking
+SEAT_RESERVATION_LIMIT = 20  # Max schedules per /api/schedules/reserve/ request
+SEAT_INVENTORY_RECONCILE_SECONDS = 30  # How often cached seat counts are checked against the database
+SEAT_AVAILABILITY_MAX_IDS = 200  # Max schedule ids per /api/schedules/availability/ request
+SCHEDULE_PAGE_SIZE = 50  # Default page of /api/schedules/ when no date is given
+SCHEDULE_MAX_PAGE_SIZE = 200  # Largest ?page_size= accepted
+SCHEDULE_GENERATOR_DAYS = 7  # Days generated by the Route admin "Generate schedules" action
+STOP_DEPARTURES_LIMIT = 50  # Max departures per /api/stops/<id>/departures/ request
+BUS_ASSIGNMENTS_PAGE_SIZE = 50  # Assignments per page on /create-schedule/
+AUTOCOMPLETE_RESULTS = 20  # Max matches returned by /api/buses/search/ and /api/routes/search/
+OPTIMIZER_TIME_BUDGET_SECONDS = 10  # Search time for optimize_assignments before the best plan is returned
+OPTIMIZER_BASE_HEADWAY_MINUTES = 60  # Every route gets at least one departure this often
+OPTIMIZER_DEADHEAD_MINUTES = 30  # Assumed empty run between two different terminals
+
+# Timetable cache
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Kept in the database so that invalidations made by management commands and
+    # other workers reach every server process (the table is created by migrate)
+    "timetables": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "timetable_cache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    # Shared for the same reason: generate_weekly_report runs in its own process
+    "dashboard": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "dashboard_cache",
+    },
+}
+TIMETABLE_CACHE_ALIAS = "timetables"  # Cache holding serialized /api/schedules/ timetables
+TIMETABLE_CACHE_SECONDS = 3600  # Upper bound on how long a timetable is served without a rebuild
+DASHBOARD_CACHE_ALIAS = "dashboard"  # Cache holding the admin dashboard's weekly summaries
+DASHBOARD_CACHE_SECONDS = 3600  # Upper bound on how long a weekly summary is served without a rebuild